@@ -0,0 +1,348 @@
+'''
+Headless benchmark of the Visualizer. Scripted MIDI workloads are played through the Visualizer
+with the SDL dummy video driver - no window, no MIDI device, no Tk display needed.
+Every workload and mode runs in a fresh process, so its peak RSS is its own and not the high-water
+mark of the runs before it.
+Run from the project directory:
+    python code/benchmark.py [--output data/benchmark.json] [--workloads bend_storm ...] [--modes guitar ...]
+'''
+import os
+import sys
+import json
+import platform
+import argparse
+import threading
+import multiprocessing
+from datetime import datetime
+from time import perf_counter, sleep
+from contextlib import redirect_stdout
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import mido
+import pygame
+
+from settings import Settings
+from commons import exception_catcher
+from instruments import HeadlessGuitar, HeadlessPiano
+from playandshow import Visualizer
+from midiinput import MidiSource, MidiFileSource
+from fretboardstate import FretboardState
+
+try:
+    import resource
+except ImportError:
+    resource = None  # not available on Windows, peak RSS is not reported there
+
+SCREEN_SIZE = (1920, 1080)
+OPEN_STRINGS_MIDI = [64, 59, 55, 50, 45, 40]  # channel 0 is the high E string
+MODES = {
+    'guitar': (True, False),
+    'piano': (False, True),
+    'combined': (True, True)
+}
+
+#region workloads
+def strummed_chords(repeats: int = 300) -> list:
+    # frets from high E to low E, None - string not played
+    shapes = [[0, 1, 0, 2, 3, None], [3, 0, 0, 0, 2, 3], [0, 1, 2, 2, 0, None], [2, 3, 2, 0, None, None]]
+    signals = []
+    for repeat in range(repeats):
+        shape = shapes[repeat % len(shapes)]
+        strings = [channel for channel in reversed(range(6)) if shape[channel] is not None]  # strummed down
+        for channel in strings:
+            signals.append(mido.Message('note_on', channel=channel, velocity=100,
+                                        note=OPEN_STRINGS_MIDI[channel] + shape[channel]))
+        for channel in strings:
+            signals.append(mido.Message('note_off', channel=channel, note=OPEN_STRINGS_MIDI[channel] + shape[channel]))
+    return signals
+
+def legato_hammer_ons(repeats: int = 1500) -> list:
+    channel = 2  # G string
+    signals = []
+    for repeat in range(repeats):
+        note = OPEN_STRINGS_MIDI[channel] + 5 + repeat % 8
+        signals.append(mido.Message('note_on', channel=channel, note=note, velocity=90))
+        # hammer-on and pull-off as the converter sends them - one step pitch and back to 0
+        for pitch in (4096, 0, -4095, 0):
+            signals.append(mido.Message('pitchwheel', channel=channel, pitch=pitch))
+        signals.append(mido.Message('note_off', channel=channel, note=note))
+    return signals
+
+def bend_storm(repeats: int = 10) -> list:
+    signals = []
+    for repeat in range(repeats):
+        for channel in range(6):
+            signals.append(mido.Message('note_on', channel=channel, note=OPEN_STRINGS_MIDI[channel] + 7, velocity=90))
+        for pitch in list(range(100, 6000, 50)) + list(range(6000, 100, -50)):
+            for channel in range(6):
+                signals.append(mido.Message('pitchwheel', channel=channel, pitch=pitch))
+        for channel in range(6):
+            signals.append(mido.Message('note_off', channel=channel, note=OPEN_STRINGS_MIDI[channel] + 7))
+    return signals
+
+def piano_chords(repeats: int = 300) -> list:
+    left_hand = [40, 47, 52, 55, 59]
+    right_hand = [64, 67, 71, 74, 79]
+    signals = []
+    for repeat in range(repeats):
+        chord = [note + repeat % 8 for note in left_hand + right_hand]
+        for note in chord:
+            signals.append(mido.Message('note_on', channel=0, note=note, velocity=80))
+        for note in chord:
+            signals.append(mido.Message('note_off', channel=0, note=note))
+    return signals
+
+def wide_piano_chords(repeats: int = 300) -> list:
+    # both hands spread over the 88 keys (A0-C8), keys out of a shorter keyboard are ignored by it
+    chord = [21, 28, 40, 47, 55, 64, 76, 84, 96, 105]
+    signals = []
+    for repeat in range(repeats):
+        notes = [note + repeat % 4 for note in chord]
+        for note in notes:
+            signals.append(mido.Message('note_on', channel=0, note=note, velocity=80))
+        for note in notes:
+            signals.append(mido.Message('note_off', channel=0, note=note))
+    return signals
+
+def mpe_keyboard(repeats: int = 20) -> list:
+    # MPE controller moved above the guitar channels: one note per channel 7-16 (0-based 6-15),
+    # every held note sliding and pressed harder as the controller streams per-note expression
+    channels = range(6, 16)
+    signals = []
+    for repeat in range(repeats):
+        notes = {channel: 48 + 3 * (channel - 6) + repeat % 5 for channel in channels}
+        for channel, note in notes.items():
+            signals.append(mido.Message('pitchwheel', channel=channel, pitch=0))
+            signals.append(mido.Message('note_on', channel=channel, note=note, velocity=90))
+        for step in range(100):
+            for channel in channels:
+                signals.append(mido.Message('pitchwheel', channel=channel, pitch=(step * 80 + channel * 7) % 8000))
+                signals.append(mido.Message('aftertouch', channel=channel, value=step % 128))
+        for channel, note in notes.items():
+            signals.append(mido.Message('note_off', channel=channel, note=note))
+    return signals
+
+WORKLOADS = {
+    'strummed_chords': strummed_chords,
+    'legato_hammer_ons': legato_hammer_ons,
+    'bend_storm': bend_storm,
+    'piano_chords': piano_chords,
+    'wide_piano_chords': wide_piano_chords,
+    'mpe_keyboard': mpe_keyboard
+}
+#endregion
+
+class ScriptedInput(MidiSource):
+    """Source which delivers a workload to the callback from its own thread, like a MIDI backend does.
+    Without rate the next batch is delivered as soon as the previous one was taken by the Visualizer.
+    The Visualizer window is closed after the last message."""
+
+    def __init__(self, signals: list, batch_size: int, rate: int, backlog):
+        self.signals = signals
+        self.batch_size = batch_size
+        self.rate = rate
+        self.backlog = backlog
+        self.closed = False
+        self.started_at = perf_counter()
+
+    def open(self, callback):
+        self.callback = callback
+        self.thread = threading.Thread(target=self.feed, daemon=True)
+        self.thread.start()
+        return self
+
+    def feed(self):
+        self.started_at = perf_counter()
+        for idx in range(0, len(self.signals), self.batch_size):
+            if self.closed:
+                return
+            for signal in self.signals[idx:idx+self.batch_size]:
+                self.callback(signal)
+            if self.rate:
+                sleep(max(0, self.started_at + (idx + self.batch_size) / self.rate - perf_counter()))
+            else:
+                while self.backlog() and not self.closed:
+                    sleep(0.0001)
+        pygame.event.post(pygame.event.Event(pygame.QUIT))
+
+    def close(self):
+        self.closed = True
+
+class BenchmarkVisualizer(Visualizer):
+
+    def __init__(self, signals: list, batch_size: int, rate: int, **kwargs):
+        self.signals = signals
+        self.batch_size = batch_size
+        self.rate = rate
+        self.frame_times = []
+        self.scripted_input = ScriptedInput(signals, batch_size, rate, backlog=lambda: len(self.midi_reader.queue))
+        super().__init__(midi_source=self.scripted_input, **kwargs)
+        self.finished_at = perf_counter()
+
+    def render_changes(self, screen):
+        start = perf_counter()
+        super().render_changes(screen)
+        self.frame_times.append(perf_counter() - start)
+
+def get_distribution(samples: list) -> dict:
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    distribution = {f'p{percentile}': samples[int(percentile / 100 * (len(samples) - 1))] * 1000
+                    for percentile in (50, 95, 99)}
+    distribution['max'] = samples[-1] * 1000
+    distribution['mean'] = sum(samples) / len(samples) * 1000
+    return {key: round(value, 3) for key, value in distribution.items()}
+
+def get_peak_rss_kb() -> int|None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak  # bytes on macOS, kilobytes elsewhere
+
+def get_canvas_calls_on_switch(guitar, settings_client, root: str, scale_type: str) -> dict:
+    # Tk canvas calls made by the fretboard when the root or the scale type is switched
+    other_root = 'G' if root != 'G' else 'D'
+    other_scale_type = 'minor_pentatonic' if scale_type != 'minor_pentatonic' else 'major_scale'
+    switches = {
+        'root': (other_root, scale_type),
+        'scale': (other_root, other_scale_type),
+        'back': (root, scale_type)
+    }
+    canvas_calls = {}
+    for switch, (switch_root, switch_scale_type) in switches.items():
+        guitar.canvas.calls = {}
+        guitar.show_fretboard(switch_root, settings_client.scale_index.get_scale_name(switch_scale_type),
+                              0, guitar.FRETS_NUMBER)
+        canvas_calls[switch] = dict(guitar.canvas.calls)
+    return canvas_calls
+
+def get_state_messages_per_s(guitar, piano, signals: list) -> float:
+    # note state alone, without rendering
+    fretboard_state = FretboardState(guitar, piano)
+    start = perf_counter()
+    for signal in signals:
+        fretboard_state.update(signal)
+    elapsed = perf_counter() - start
+    return round(len(signals) / elapsed, 1)
+
+def get_catcher_overhead_ns(calls: int = 200000, repeats: int = 5) -> dict:
+    # per call cost of the error catching decorators over a plain call, best of the repeats
+    def probe(screen, fret, interval, string_number=None, is_played=False):
+        return fret
+    timings = {}
+    for name, decorator in (('none', None), ('exception_catcher', exception_catcher)):
+        fun = decorator(probe) if decorator else probe
+        best = None
+        for _ in range(repeats):
+            start = perf_counter()
+            for fret in range(calls):
+                fun(None, fret, 'p5', string_number=1)
+            elapsed = perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best / calls
+    return {name: round(1e9 * (timing - timings['none']), 1) for name, timing in timings.items() if name != 'none'}
+
+def run_workload(settings_client, guitar, piano, workload: str, mode: str, args) -> dict:
+    show_guitar, show_piano = MODES[mode]
+    signals = MidiFileSource(workload).signals if workload.endswith('.mid') else WORKLOADS[workload]()
+    with open(os.devnull, 'w') as devnull, redirect_stdout(sys.stdout if args.verbose else devnull):
+        vis = BenchmarkVisualizer(signals, args.batch_size, args.rate,
+                                  settings_client=settings_client, size=SCREEN_SIZE,
+                                  show_guitar=show_guitar, show_piano=show_piano,
+                                  guitar=guitar, piano=piano, first_fret=0,
+                                  last_fret=guitar.FRETS_NUMBER,
+                                  scale_type=args.scale_type, max_bend=guitar.STRING_DISTANCE,
+                                  reduce_bends=settings_client.settings['reduce_bends'],
+                                  target_fps=args.fps or 60, immediate_rendering=not args.fps)
+    elapsed = vis.finished_at - vis.scripted_input.started_at
+    state_messages_per_s = get_state_messages_per_s(guitar, piano, signals)
+    return {
+        'workload': os.path.basename(workload),
+        'mode': mode,
+        'messages': len(signals),
+        'elapsed_s': round(elapsed, 4),
+        'messages_per_s': round(len(signals) / elapsed, 1),
+        'state_messages_per_s': state_messages_per_s,
+        'frames': vis.frame_scheduler.rendered_frames,
+        'skipped_frames': vis.frame_scheduler.skipped_frames,
+        'frames_per_s': round(vis.frame_scheduler.rendered_frames / elapsed, 1),
+        'frame_time_ms': get_distribution(vis.frame_times),
+        'dropped_messages': vis.midi_reader.dropped,
+        'folded_pitchwheel': vis.pitchwheel_coalescer.folded,
+        'display_latency_ms': {
+            signal_type: get_distribution(list(vis.latency_monitor.samples[signal_type]['display']))
+            for signal_type in sorted(vis.latency_monitor.samples)
+        },
+        'peak_rss_kb': get_peak_rss_kb()
+    }
+
+def get_instruments(args) -> tuple:
+    settings_client = Settings(app=None)
+    if args.piano_range:
+        settings_client.settings['piano_range'] = args.piano_range
+    guitar = HeadlessGuitar(None, SCREEN_SIZE[0], settings_client)
+    piano = HeadlessPiano(None, SCREEN_SIZE[0], settings_client)
+    guitar.show_fretboard(args.root, settings_client.scale_index.get_scale_name(args.scale_type),
+                          0, guitar.FRETS_NUMBER)
+    return settings_client, guitar, piano
+
+def run_isolated(workload: str, mode: str, args) -> dict:
+    # entry of the process of one workload and mode
+    return run_workload(*get_instruments(args), workload, mode, args)
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless benchmark of the Visualizer with scripted MIDI workloads.')
+    parser.add_argument('--workloads', nargs='+', choices=list(WORKLOADS), default=list(WORKLOADS))
+    parser.add_argument('--mid', nargs='+', default=[], help='.mid files (e.g. recorded sessions) run as extra workloads')
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--batch-size', type=int, default=8, help='messages delivered to the port callback at once')
+    parser.add_argument('--rate', type=int, default=0, help='messages per second, 0 - as fast as the Visualizer takes them')
+    parser.add_argument('--fps', type=int, default=0, help='target FPS, 0 - immediate rendering')
+    parser.add_argument('--root', default='C')
+    parser.add_argument('--scale-type', default='major_scale')
+    parser.add_argument('--piano-range', help='key range from constants.json, e.g. "88 keys (A0-C8)", '
+                                              'the one from settings.json by default')
+    parser.add_argument('--output', default='data/benchmark.json')
+    parser.add_argument('--verbose', action='store_true', help='keep the output of the Visualizer')
+    args = parser.parse_args()
+
+    if args.piano_range and args.piano_range not in (piano_ranges := Settings(app=None).constants['piano_ranges']):
+        parser.error(f"--piano-range must be one of {list(piano_ranges)}")
+    settings_client, guitar, piano = get_instruments(args)
+    canvas_calls = get_canvas_calls_on_switch(guitar, settings_client, args.root, args.scale_type)
+    print('Canvas calls on root switch:', canvas_calls['root'], 'scale switch:', canvas_calls['scale'])
+    print(f'MIDI lookup tables: guitar {guitar.get_midi_tables_size()} B, piano {piano.get_midi_tables_size()} B')
+    print(f'Piano: {piano.piano_range}')
+    catcher_overhead = get_catcher_overhead_ns()
+    print('Error catching overhead per call:', ', '.join(f'{name} {ns} ns' for name, ns in catcher_overhead.items()))
+    results = []
+    # a new worker process per run, started with spawn so it does not inherit the memory of this one
+    with multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+        for workload in args.workloads + args.mid:
+            for mode in args.modes:
+                result = pool.apply(run_isolated, (workload, mode, args))
+                results.append(result)
+                print(f"{result['workload']:<18} {mode:<9} {result['messages_per_s']:>10} msg/s {result['frames_per_s']:>8} fps  "
+                      f"frame p50 {result['frame_time_ms'].get('p50', 0):>7} ms  p99 {result['frame_time_ms'].get('p99', 0):>7} ms  "
+                      f"peak RSS {result['peak_rss_kb']} kB")
+    report = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'platform': platform.platform(),
+        'canvas_calls_on_switch': canvas_calls,
+        'piano_range': piano.piano_range,
+        'midi_tables_bytes': {'guitar': guitar.get_midi_tables_size(), 'piano': piano.get_midi_tables_size()},
+        'catcher_overhead_ns': catcher_overhead,
+        'parameters': vars(args),
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4)
+    print(f'Results written to {args.output}')
+
+if __name__ == '__main__':
+    main()
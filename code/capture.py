@@ -0,0 +1,217 @@
+'''
+Binary capture of incoming MIDI messages for signal diagnostics (.smcap files, written by SignalConfig).
+Layout:
+    header   HEADER: magic, version, record size, index step, wall-clock time of the capture start
+    records  RECORD each: microseconds since the capture start, message length, first 3 message bytes
+    footer   written on close: time of every INDEX_STEP-th record (uint64 us), then TRAILER
+Captures without the footer (app killed while capturing) are readable, their index is rebuilt from the records.
+Messages longer than 3 bytes (sysex) keep only their first bytes, they are shown but not exported.
+The records are memory-mapped by CaptureReader, so captures of millions of messages are not loaded into memory.
+Run from the project directory to look into a capture without the app:
+    python code/capture.py data/captures/capture_....smcap [--from 1.5] [--count 50] [--channel 1] [--type note_on]
+    python code/capture.py data/captures/capture_....smcap --from 10 --to 20 --export slice.mid
+'''
+import os
+import mmap
+import time
+import struct
+import argparse
+from array import array
+from bisect import bisect_right
+
+import mido
+
+from midiinput import save_midi_file
+
+MAGIC = b'SMCAP'
+VERSION = 1
+HEADER = struct.Struct('<5sBHId')  # magic, version, record size, index step, started at (epoch seconds)
+RECORD = struct.Struct('<QB3s')  # time (us), message length, message bytes
+TRAILER = struct.Struct('<QQ5s')  # records number, index offset, magic
+INDEX_STEP = 1024
+TRUNCATED = 0xFF  # length of messages longer than 3 bytes
+TYPE_NAMES = {
+    0x80: 'note_off', 0x90: 'note_on', 0xA0: 'polytouch', 0xB0: 'control_change',
+    0xC0: 'program_change', 0xD0: 'aftertouch', 0xE0: 'pitchwheel'
+}
+TYPE_STATUSES = {name: status for status, name in TYPE_NAMES.items()}
+
+class CaptureWriter():
+    """Appends messages to a capture file. Time of the messages is their arrival time (perf_counter),
+    as MidiReader sets it, the capture starts when the writer is created."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, INDEX_STEP, time.time()))
+        self.started_at = time.perf_counter()
+        self.index = array('Q')
+        self.count = 0
+
+    def write(self, signals: list):
+        # one write per batch of messages
+        records = bytearray()
+        for signal in signals:
+            data = signal.bytes()
+            timestamp = max(0, round((signal.time - self.started_at) * 1e6))
+            if self.count % INDEX_STEP == 0:
+                self.index.append(timestamp)
+            records += RECORD.pack(timestamp, len(data) if len(data) <= 3 else TRUNCATED, bytes(data[:3]))
+            self.count += 1
+        self.file.write(records)
+
+    def close(self):
+        if self.file.closed:
+            return
+        index_offset = self.file.tell()
+        self.file.write(self.index.tobytes())
+        self.file.write(TRAILER.pack(self.count, index_offset, MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class CaptureReader():
+    """Memory-mapped capture file. Records are numbered from 0 and read straight from the map,
+    the sparse time index (every INDEX_STEP-th record) narrows the binary search by time."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, self.index_step, self.started_at = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self.close()
+            raise ValueError(f'{path} is not a capture file of version {VERSION}')
+        size = len(self.map)
+        if size >= HEADER.size + TRAILER.size and self.map[size-len(MAGIC):] == MAGIC:
+            self.count, index_offset, _ = TRAILER.unpack_from(self.map, size - TRAILER.size)
+            self.index = array('Q', self.map[index_offset:size-TRAILER.size])
+        else:
+            # not closed - the file ends after the last whole record
+            self.count = (size - HEADER.size) // RECORD.size
+            self.index = array('Q', (self.get_time_us(record) for record in range(0, self.count, self.index_step)))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def get_time_us(self, record: int) -> int:
+        return struct.unpack_from('<Q', self.map, HEADER.size + record * RECORD.size)[0]
+
+    def get_duration(self) -> float:
+        return self.get_time_us(self.count - 1) / 1e6 if self.count else 0
+
+    def get(self, record: int) -> tuple:
+        # (seconds since the capture start, message bytes)
+        timestamp, length, data = RECORD.unpack_from(self.map, HEADER.size + record * RECORD.size)
+        return timestamp / 1e6, data if length == TRUNCATED else data[:length]
+
+    def find(self, seconds: float) -> int:
+        # number of the first record at or after the time, len() when there is none
+        timestamp = round(seconds * 1e6)
+        block = max(0, bisect_right(self.index, timestamp) - 1)
+        low, high = block * self.index_step, min(self.count, (block + 1) * self.index_step)
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_time_us(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    @staticmethod
+    def matches(data: bytes, channels: set|None, types: set|None) -> bool:
+        # channels 0-15 and TYPE_NAMES, system messages have no channel and match only without filters
+        status = data[0] if data else 0
+        if status >= 0xF0:
+            return channels is None and types is None
+        return (channels is None or status & 0x0F in channels) and \
+               (types is None or TYPE_NAMES.get(status & 0xF0) in types)
+
+    def iter_records(self, start: int = 0, stop: int|None = None, channels: set|None = None,
+                     types: set|None = None, chunk: int = 4096):
+        # (record number, seconds, message bytes) of the matching records, read chunk by chunk from the map
+        stop = self.count if stop is None else min(stop, self.count)
+        for chunk_start in range(start, stop, chunk):
+            chunk_stop = min(stop, chunk_start + chunk)
+            records = self.map[HEADER.size + chunk_start * RECORD.size:HEADER.size + chunk_stop * RECORD.size]
+            for record, (timestamp, length, data) in enumerate(RECORD.iter_unpack(records), chunk_start):
+                data = data if length == TRUNCATED else data[:length]
+                if self.matches(data, channels, types):
+                    yield record, timestamp / 1e6, data
+
+    def get_page(self, start: int, size: int, channels: set|None = None, types: set|None = None) -> tuple:
+        # (up to size matching records from start, number of the record to start the next page from)
+        page = []
+        for record in self.iter_records(start, channels=channels, types=types):
+            if len(page) == size:
+                return page, record[0]
+            page.append(record)
+        return page, self.count
+
+    @staticmethod
+    def get_message(data: bytes):
+        try:
+            return mido.Message.from_bytes(data)
+        except ValueError:
+            return None
+
+    def get_line(self, record: int, seconds: float, data: bytes) -> str:
+        signal = self.get_message(data)
+        return f'{record:>10} {seconds:>14.6f}  {signal if signal is not None else "raw " + data.hex(" ")}'
+
+    def export_mid(self, path: str, start_seconds: float, end_seconds: float,
+                   channels: set|None = None, types: set|None = None) -> int:
+        # matching messages of the time slice to .mid for replay, returns the number of exported messages
+        timed_signals = []
+        for _, seconds, data in self.iter_records(self.find(start_seconds), self.find(end_seconds), channels, types):
+            signal = self.get_message(data)
+            if signal is not None and not signal.is_meta:
+                timed_signals.append((seconds, signal))
+        if timed_signals:
+            save_midi_file(path, timed_signals)
+        return len(timed_signals)
+
+    def summary(self) -> str:
+        return f'[CAPTURE] {self.path}: {self.count} messages, {self.get_duration():.3f} s, ' \
+               f'started {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at))}'
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Shows or exports messages of a signal capture.')
+    parser.add_argument('path')
+    parser.add_argument('--from', dest='start', type=float, default=0, help='seconds since the capture start')
+    parser.add_argument('--to', dest='end', type=float, default=None, help='end of the exported slice in seconds')
+    parser.add_argument('--count', type=int, default=50, help='messages shown')
+    parser.add_argument('--channel', type=int, nargs='+', help='channels 1-16')
+    parser.add_argument('--type', nargs='+', choices=list(TYPE_STATUSES))
+    parser.add_argument('--export', help='.mid file the slice is exported to')
+    args = parser.parse_args()
+    channels = {channel - 1 for channel in args.channel} if args.channel else None
+    types = set(args.type) if args.type else None
+    with CaptureReader(args.path) as reader:
+        print(reader.summary())
+        if args.export:
+            end = args.end if args.end is not None else reader.get_duration() + 1
+            exported = reader.export_mid(args.export, args.start, end, channels, types)
+            print(f'{exported} messages exported to {args.export}')
+            return
+        page, _ = reader.get_page(reader.find(args.start), args.count, channels, types)
+        for record in page:
+            print(reader.get_line(*record))
+
+if __name__ == '__main__':
+    main()
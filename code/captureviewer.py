@@ -0,0 +1,125 @@
+import tkinter as tk
+from tkinter import filedialog
+import ttkbootstrap as tb
+from ttkbootstrap.dialogs import Messagebox
+
+from commons import exception_catcher
+from capture import CaptureReader, TYPE_STATUSES
+
+class CaptureViewer:
+    """Window paging through a signal capture, PAGE_SIZE matching messages at a time.
+    The capture is memory-mapped, so only the shown page is read."""
+    PAGE_SIZE = 200
+
+    def __init__(self, settings_client):
+        self.settings_client = settings_client
+        self.reader = None
+
+    @exception_catcher
+    def start(self):
+        strings = self.settings_client.strings
+        path = filedialog.askopenfilename(initialdir='data/captures',
+                                          filetypes=[(strings['capture_files'], '*.smcap')])
+        if not path:
+            return
+        self.reader = CaptureReader(path)
+        self.page_starts = []  # starts of the pages before the shown one, for going back
+        self.page_start = 0
+        self.next_page_start = 0
+        padx = 10
+        pady = 10
+        self.window = tk.Toplevel()
+        self.window.title(strings['open_capture'])
+        self.window.geometry('1000x750')
+        self.window.protocol("WM_DELETE_WINDOW", self.close_window)
+        tb.Label(self.window, text=self.reader.summary()).grid(row=0, columnspan=2, padx=padx, pady=pady, sticky='w')
+
+        filters_frame = tb.Frame(self.window)
+        tb.Label(filters_frame, text=strings['time_s']).grid(row=0, column=0, padx=padx)
+        self.input_time = tb.Entry(filters_frame, width=10)
+        self.input_time.insert(0, '0')
+        self.input_time.grid(row=0, column=1, padx=padx)
+        tb.Label(filters_frame, text=strings['channel']).grid(row=0, column=2, padx=padx)
+        self.input_channel = tb.Combobox(filters_frame, width=6, state='readonly',
+                                         values=[strings['all']] + [str(channel) for channel in range(1, 17)])
+        self.input_channel.current(0)
+        self.input_channel.grid(row=0, column=3, padx=padx)
+        tb.Label(filters_frame, text=strings['message_type']).grid(row=0, column=4, padx=padx)
+        self.input_type = tb.Combobox(filters_frame, width=14, state='readonly',
+                                      values=[strings['all']] + list(TYPE_STATUSES))
+        self.input_type.current(0)
+        self.input_type.grid(row=0, column=5, padx=padx)
+        tb.Button(filters_frame, text=strings['go_to'], command=self.go_to, takefocus=False).grid(row=0, column=6, padx=padx)
+        filters_frame.grid(row=1, columnspan=2, padx=padx, pady=pady, sticky='w')
+
+        self.textbox = tb.Text(self.window, width=110, height=25)
+        self.textbox.grid(row=2, columnspan=2, padx=padx, pady=pady)
+        self.textbox.config(state=tk.DISABLED)
+
+        pages_frame = tb.Frame(self.window)
+        tb.Button(pages_frame, text=strings['previous_page'], command=self.show_previous_page,
+                  takefocus=False).grid(row=0, column=0, padx=padx)
+        tb.Button(pages_frame, text=strings['next_page'], command=self.show_next_page,
+                  takefocus=False).grid(row=0, column=1, padx=padx)
+        pages_frame.grid(row=3, column=0, padx=padx, pady=pady, sticky='w')
+
+        export_frame = tb.Frame(self.window)
+        tb.Label(export_frame, text=strings['export_to_s']).grid(row=0, column=0, padx=padx)
+        self.input_export_to = tb.Entry(export_frame, width=10)
+        self.input_export_to.insert(0, f'{self.reader.get_duration():.3f}')
+        self.input_export_to.grid(row=0, column=1, padx=padx)
+        tb.Button(export_frame, text=strings['export_mid'], command=self.export_mid,
+                  takefocus=False).grid(row=0, column=2, padx=padx)
+        export_frame.grid(row=3, column=1, padx=padx, pady=pady, sticky='e')
+        self.show_page()
+
+    def get_filters(self) -> tuple:
+        # (channels 0-15, message types), None - all of them
+        channel = self.input_channel.get()
+        signal_type = self.input_type.get()
+        return ({int(channel) - 1} if channel != self.settings_client.strings['all'] else None,
+                {signal_type} if signal_type != self.settings_client.strings['all'] else None)
+
+    @exception_catcher
+    def show_page(self):
+        channels, types = self.get_filters()
+        page, self.next_page_start = self.reader.get_page(self.page_start, self.PAGE_SIZE, channels, types)
+        self.textbox.config(state=tk.NORMAL)
+        self.textbox.delete('1.0', tk.END)
+        self.textbox.insert(tk.END, '\n'.join(self.reader.get_line(*record) for record in page))
+        self.textbox.config(state=tk.DISABLED)
+
+    @exception_catcher
+    def go_to(self):
+        self.page_starts = []
+        self.page_start = self.reader.find(float(self.input_time.get()))
+        self.show_page()
+
+    @exception_catcher
+    def show_next_page(self):
+        if self.next_page_start < len(self.reader):
+            self.page_starts.append(self.page_start)
+            self.page_start = self.next_page_start
+            self.show_page()
+
+    @exception_catcher
+    def show_previous_page(self):
+        if self.page_starts:
+            self.page_start = self.page_starts.pop()
+            self.show_page()
+
+    @exception_catcher
+    def export_mid(self):
+        path = filedialog.asksaveasfilename(initialdir='data/recordings', defaultextension='.mid',
+                                            filetypes=[(self.settings_client.strings['midi_files'], '*.mid')])
+        if not path:
+            return
+        channels, types = self.get_filters()
+        start = float(self.input_time.get())
+        exported = self.reader.export_mid(path, start, float(self.input_export_to.get()), channels, types)
+        Messagebox.show_info(f"{exported} {self.settings_client.strings['messages_exported']} {path}",
+                             self.settings_client.strings['export_mid'])
+
+    def close_window(self):
+        self.reader.close()
+        self.window.destroy()
@@ -1,6 +1,136 @@
+import os
+import atexit
+import threading
+from queue import SimpleQueue, Empty
+from functools import partial
+from time import monotonic
 from datetime import datetime
 from traceback import format_exc
 from ttkbootstrap.dialogs import Messagebox
+from tracelog import TRACE
+
+class ErrorReporter():
+    """Reports errors caught by exception_catcher without making the caller wait for the log file.
+    Errors are de-duplicated by call site (function, line which raised, exception type): a call site is reported
+    at most once per REPORT_INTERVAL and the number of repeats is logged with its next report, the error dialog
+    is shown only for the first error of a call site. At most MAX_REPORTS reports are made per REPORT_INTERVAL.
+    Errors can be reported from any thread: the dialog is shown by the Tk thread, polling DIALOG_POLL_MS after
+    set_root(), and not at all in processes without a Tk root (the visualizer, the benchmark).
+    The log is written by a background thread, started with the first report, and rotated at MAX_LOG_BYTES.
+    The in-memory trace (tracelog.TRACE) is dumped by the same thread with every report, when it is enabled."""
+    LOG_PATH = 'data/logs.txt'
+    MAX_LOG_BYTES = 1024 * 1024
+    LOG_BACKUPS = 3  # logs.txt.1 is the newest one
+    REPORT_INTERVAL = 10  # seconds
+    MAX_REPORTS = 20
+    DIALOG_POLL_MS = 200
+
+    def __init__(self):
+        self.lock = threading.Lock()  # guards the de-duplication state below
+        self.call_sites = {}  # call site -> [reported at, repeats not reported]
+        self.interval_started_at = None
+        self.reports_in_interval = 0
+        self.suppressed = 0  # over MAX_REPORTS, logged with the next report
+        self.queue = SimpleQueue()
+        self.writer = None
+        self.root = None
+        self.dialogs = SimpleQueue()  # messages shown by the Tk thread
+
+    def set_root(self, root):
+        self.root = root
+        root.after(self.DIALOG_POLL_MS, self.show_dialogs)
+
+    def show_dialogs(self):
+        try:
+            while True:
+                Messagebox.show_error(self.dialogs.get_nowait(), 'Error')
+        except Empty:
+            pass
+        self.root.after(self.DIALOG_POLL_MS, self.show_dialogs)
+
+    def get_call_site(self, fun, ex: Exception) -> tuple:
+        # innermost frame, without reading the source lines like traceback.extract_tb does
+        tb = ex.__traceback__
+        while tb.tb_next is not None:
+            tb = tb.tb_next
+        return fun.__qualname__, tb.tb_frame.f_code.co_filename, tb.tb_lineno, type(ex).__name__
+
+    def report(self, fun, ex: Exception, show_dialog: bool = True):
+        TRACE.error('%s in %s: %s', type(ex).__name__, fun.__qualname__, ex)
+        with self.lock:
+            msg, first_error = self.get_report(fun, ex)
+        if msg is None:
+            return
+        self.write(f'***********\n{datetime.now()}:\t\t{msg}')
+        if TRACE.enabled:
+            self.run_in_writer(partial(TRACE.dump, reason=f'after an error in {fun.__qualname__}'))
+        if show_dialog and first_error and self.root is not None:
+            self.dialogs.put(msg)
+
+    def get_report(self, fun, ex: Exception) -> tuple:
+        # (message or None when the error is not reported, first error of the call site)
+        now = monotonic()
+        call_site = self.get_call_site(fun, ex)
+        site_state = self.call_sites.get(call_site)
+        first_error = site_state is None
+        if not first_error and now - site_state[0] < self.REPORT_INTERVAL:
+            site_state[1] += 1
+            return None, False
+        if self.interval_started_at is None or now - self.interval_started_at >= self.REPORT_INTERVAL:
+            self.interval_started_at = now
+            self.reports_in_interval = 0
+        if self.reports_in_interval >= self.MAX_REPORTS:
+            self.suppressed += 1
+            return None, False
+        self.reports_in_interval += 1
+        repeats = 0 if first_error else site_state[1]
+        self.call_sites[call_site] = [now, 0]
+        msg = f'Error in function {fun.__qualname__}.\n\nException: {ex}\n\n{format_exc()}'
+        if repeats:
+            msg += f'(repeated {repeats} times since the previous report)\n'
+        if self.suppressed:
+            msg += f'({self.suppressed} errors of other call sites were not reported)\n'
+            self.suppressed = 0
+        return msg, first_error
+
+    def write(self, entry: str):
+        self.run_in_writer(partial(self.write_entry, entry))
+
+    def run_in_writer(self, task):
+        if self.writer is None:
+            self.writer = threading.Thread(target=self.run_tasks, name='ErrorReporter', daemon=True)
+            self.writer.start()
+            atexit.register(self.close)
+        self.queue.put(task)
+
+    def run_tasks(self):
+        while (task := self.queue.get()) is not None:
+            try:
+                task()
+            except OSError as ex:
+                TRACE.error('Cannot write the error log or the trace: %s', ex)
+
+    def write_entry(self, entry: str):
+        self.rotate(len(entry.encode('utf-8')))
+        with open(self.LOG_PATH, 'a+', encoding='utf-8') as f:
+            f.write(entry)
+
+    def rotate(self, entry_size: int):
+        if not os.path.exists(self.LOG_PATH) or os.path.getsize(self.LOG_PATH) + entry_size <= self.MAX_LOG_BYTES:
+            return
+        for backup in range(self.LOG_BACKUPS - 1, 0, -1):
+            if os.path.exists(f'{self.LOG_PATH}.{backup}'):
+                os.replace(f'{self.LOG_PATH}.{backup}', f'{self.LOG_PATH}.{backup+1}')
+        os.replace(self.LOG_PATH, f'{self.LOG_PATH}.1')
+
+    def close(self):
+        # entries still queued are written before the app exits
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join(timeout=2)
+            self.writer = None
+
+ERROR_REPORTER = ErrorReporter()
 
 def exception_catcher(fun):
     def decorator(*args, **kwargs):
@@ -8,9 +138,5 @@ def exception_catcher(fun):
             val = fun(*args, **kwargs)
             return val
         except Exception as ex:
-            msg = f'Error in function {fun.__qualname__}.\n\nException: {ex}\n\n{format_exc()}'
-            Messagebox.show_error(msg, 'Error')
-            print(msg)
-            with open('data/logs.txt','a+') as f:
-                f.write(f'***********\n{datetime.now()}:\t\t{msg}')
-    return decorator
\ No newline at end of file
+            ERROR_REPORTER.report(fun, ex)
+    return decorator
@@ -0,0 +1,256 @@
+from array import array
+from tracelog import TRACE
+
+class StringState():
+    """Note played on one string, note is None when the string is silent. Records are updated in place."""
+    __slots__ = ('note', 'fret', 'interval', 'bend')
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.note = None
+        self.fret = None
+        self.interval = None
+        self.bend = 0
+
+    def set(self, note: int, fret: int, interval: str, bend: int = 0):
+        self.note = note
+        self.fret = fret
+        self.interval = interval
+        self.bend = bend
+
+    def snapshot(self) -> tuple|None:
+        # everything the string is drawn from
+        return None if self.note is None else (self.fret, self.interval, self.bend)
+
+    def __repr__(self):
+        return f'StringState(note={self.note}, fret={self.fret}, interval={self.interval}, bend={self.bend})'
+
+class FretboardState():
+    """Note state of the guitar (one MIDI channel per string, channel 0 is string 1) and of the piano keys
+    the notes are shown on. Works on plain MIDI messages, without pygame or Tk.
+    Channels above the strings are keyboard channels - a keyboard or an MPE controller, moved there with
+    the channel map of its port if needed. Their notes are shown on the piano only and stay until released,
+    the guitar notes are cleared from the piano when no string is played.
+    Held notes of all 16 channels are 128-bit bitsets (bit n - MIDI note n) with their union, so "what is
+    held now" is one int - an O(1) snapshot which stays valid after later messages. The last pitch bend
+    and channel pressure of every channel are kept too, with MPE they are per-note expression.
+    update(signal) returns the delta of one message: (bitmask of changed strings - bit n for string n,
+    tuple of piano keys which were pressed or released)."""
+    MAX_PITCH_SHIFT = 6000 # 2730
+    ONE_STEP_PITCH = (-4095, 4096)
+    NO_CHANGE = (0, ())
+    CHANNELS = 16
+    CHANNEL_MODE_CONTROLS = (120, 123)  # all sound off, all notes off
+
+    def __init__(self, guitar, piano):
+        """guitar and piano provide the MIDI lookup tables (MIDI_FRETS, MIDI_INTERVALS, INTERVAL_NAMES, NO_FRET
+        and MIDI_KEYS, NO_KEY), indexed by MIDI value 0-127."""
+        self.midi_frets = guitar.MIDI_FRETS
+        self.midi_intervals = guitar.MIDI_INTERVALS
+        self.interval_names = guitar.INTERVAL_NAMES
+        self.no_fret = guitar.NO_FRET
+        self.midi_keys = piano.MIDI_KEYS
+        self.no_key = piano.NO_KEY
+        self.STRING_NUMBER = guitar.STRING_NUMBER
+        self.strings = [None] + [StringState() for _ in range(self.STRING_NUMBER)]  # indexed by string number
+        self.GUITAR_CHANNELS = (1 << self.STRING_NUMBER) - 1  # bitmask of the string channels
+        self.held = [0] * self.CHANNELS  # held notes by channel
+        self.holders = bytearray(128)  # number of channels holding the note
+        self.held_notes = 0  # notes held on any channel
+        self.holding = 0  # bitmask of channels with a held note, bit n for channel n
+        self.bends = array('h', [0]) * self.CHANNELS  # last pitchwheel -8192-8191
+        self.pressures = bytearray(self.CHANNELS)  # last channel pressure (aftertouch) 0-127
+        self.piano_keys = set()  # keys of the held notes, what the piano shows
+        self.played = 0  # bitmask of strings with a note
+        # previous message which got to the note state, for the hammer-on heuristic
+        self.prev_type = 'note_on'
+        self.prev_pitch = None
+        self.changed_keys = []
+
+    def get_played_strings(self):
+        for string_number in range(1, self.STRING_NUMBER+1):
+            if self.played >> string_number & 1:
+                yield string_number, self.strings[string_number]
+
+    def set_string(self, string_number: int, note: int, fret: int, interval: str, bend: int = 0):
+        self.strings[string_number].set(note, fret, interval, bend)
+        self.played |= 1 << string_number
+
+    def clear_string(self, string_number: int):
+        self.strings[string_number].clear()
+        self.played &= ~(1 << string_number)
+
+    def set_midi_intervals(self, midi_intervals: list) -> int:
+        # scale root changed, intervals of the played strings are looked up again, returns the changed strings
+        self.midi_intervals = midi_intervals
+        changed_strings = 0
+        for string_number, string in self.get_played_strings():
+            interval = self.interval_names[midi_intervals[string_number][string.note]]
+            if interval != string.interval:
+                string.interval = interval
+                changed_strings |= 1 << string_number
+        return changed_strings
+
+    def get_held(self, channel: int|None = None) -> int:
+        # bitset of the channel, of all channels without one
+        return self.held_notes if channel is None else self.held[channel]
+
+    @staticmethod
+    def get_notes(bits: int) -> list:
+        # MIDI notes of a bitset (or channels of a channel bitmask), lowest first
+        notes = []
+        while bits:
+            lowest = bits & -bits
+            notes.append(lowest.bit_length() - 1)
+            bits ^= lowest
+        return notes
+
+    def press_note(self, channel: int, note: int):
+        bit = 1 << note
+        if self.held[channel] & bit:
+            return
+        self.held[channel] |= bit
+        self.holding |= 1 << channel
+        self.holders[note] += 1
+        # note out of the piano range is held, but not shown
+        if self.holders[note] == 1:
+            self.held_notes |= bit
+            if (key := self.midi_keys[note]) != self.no_key:
+                self.piano_keys.add(key)
+                self.changed_keys.append(key)
+
+    def release_note(self, channel: int, note: int):
+        bit = 1 << note
+        if not self.held[channel] & bit:
+            return
+        self.held[channel] ^= bit
+        if not self.held[channel]:
+            self.holding &= ~(1 << channel)
+        self.holders[note] -= 1
+        if not self.holders[note]:
+            self.held_notes ^= bit
+            if (key := self.midi_keys[note]) != self.no_key:
+                self.piano_keys.discard(key)
+                self.changed_keys.append(key)
+
+    def clear_channels(self, channels: int):
+        # channels - bitmask, bit n for channel n
+        for channel in self.get_notes(channels & self.holding):
+            for note in self.get_notes(self.held[channel]):
+                self.release_note(channel, note)
+
+    def feeds_hammer_on(self, signal) -> bool:
+        # the message becomes the previous message of the hammer-on heuristic (prev_type) in update()
+        channel = getattr(signal, 'channel', -1)
+        if not 0 <= channel < self.STRING_NUMBER:
+            return False
+        return signal.type != 'note_on' or self.midi_keys[signal.note] != self.no_key or \
+            self.midi_frets[channel + 1][signal.note] != self.no_fret
+
+    def update(self, signal) -> tuple:
+        channel = getattr(signal, 'channel', -1)
+        # system messages (clock, active sensing, sysex) have no channel
+        if channel < 0:
+            return self.NO_CHANGE
+        self.changed_keys = []
+        if channel >= self.STRING_NUMBER:
+            return self.update_keyboard(channel, signal)
+        string_number = channel + 1
+        if signal.type == 'note_on':
+            changed_strings = self.note_on(string_number, signal)
+            if changed_strings is None:
+                return self.NO_CHANGE
+        elif signal.type == 'note_off':
+            changed_strings = self.note_off(string_number, signal)
+        elif signal.type == 'pitchwheel':
+            changed_strings = self.pitchwheel(string_number, signal)
+            if changed_strings < 0:
+                # hammer-on, the piano keys are not checked after it
+                self.prev_type, self.prev_pitch = signal.type, signal.pitch
+                return 1 << string_number, tuple(self.changed_keys)
+        else:
+            changed_strings = 0
+        if not self.played and self.holding & self.GUITAR_CHANNELS:
+            self.clear_channels(self.GUITAR_CHANNELS)
+        self.prev_type, self.prev_pitch = signal.type, getattr(signal, 'pitch', None)
+        return changed_strings, tuple(self.changed_keys)
+
+    def update_keyboard(self, channel: int, signal) -> tuple:
+        # keyboard messages do not get to the hammer-on heuristic of the strings
+        if signal.type == 'note_on' and signal.velocity > 0:
+            self.press_note(channel, signal.note)
+        elif signal.type in ('note_on', 'note_off'):
+            self.release_note(channel, signal.note)
+        elif signal.type == 'pitchwheel':
+            self.bends[channel] = signal.pitch
+        elif signal.type == 'aftertouch':
+            self.pressures[channel] = signal.value
+        elif signal.type == 'control_change' and signal.control in self.CHANNEL_MODE_CONTROLS:
+            self.clear_channels(1 << channel)
+        return (0, tuple(self.changed_keys)) if self.changed_keys else self.NO_CHANGE
+
+    def note_on(self, string_number: int, signal) -> int|None:
+        # None - the note is out of the piano and the guitar range, the message is ignored
+        channel = string_number - 1
+        fret = self.midi_frets[string_number][signal.note]
+        if self.midi_keys[signal.note] == self.no_key and fret == self.no_fret:
+            return None
+        string = self.strings[string_number]
+        if signal.velocity > 0:
+            if string.note is not None:
+                self.release_note(channel, string.note)
+            # note out of the guitar range is shown on the piano only, the string keeps its previous note
+            if fret == self.no_fret:
+                self.press_note(channel, signal.note)
+                return 0
+            self.set_string(string_number, signal.note, fret,
+                            self.interval_names[self.midi_intervals[string_number][signal.note]])
+            self.press_note(channel, signal.note)
+            return 1 << string_number
+        changed_strings = 0
+        if string.note == signal.note:
+            self.clear_string(string_number)
+            changed_strings = 1 << string_number
+        self.release_note(channel, signal.note)
+        return changed_strings
+
+    def note_off(self, string_number: int, signal) -> int:
+        string = self.strings[string_number]
+        # string state is changed in place, so its fields are traced and not the record
+        TRACE.debug('[NOTE OFF] %s\t\tcurrent note: %s, fret: %s', signal, string.note, string.fret)
+        changed_strings = 0
+        # note can be a semitone away from the played one after a hammer-on or pull-off
+        if string.note is not None and signal.note - 1 <= string.note <= signal.note + 1:
+            self.release_note(string_number - 1, string.note)
+            self.clear_string(string_number)
+            changed_strings = 1 << string_number
+        else:
+            TRACE.warning('[NOTE OFF WTF] %s\t\t%s', signal, string.note)
+        self.release_note(string_number - 1, signal.note)
+        return changed_strings
+
+    def pitchwheel(self, string_number: int, signal) -> int:
+        # -1 - hammer-on or pull-off moved the note one fret
+        string = self.strings[string_number]
+        if string.note is None:
+            return 0
+        side = 0
+        prev_pitchwheel = self.prev_type == 'pitchwheel'
+        if signal.pitch == 0 and prev_pitchwheel and self.prev_pitch in self.ONE_STEP_PITCH:
+            side = 1 if self.prev_pitch == self.ONE_STEP_PITCH[0] else -1
+        if string.fret > 0 and signal.pitch in self.ONE_STEP_PITCH and (not prev_pitchwheel or self.prev_pitch == 0):
+            side = -1 if signal.pitch == self.ONE_STEP_PITCH[0] else 1
+        note = string.note + side
+        if side and 0 <= note < 128 and self.midi_frets[string_number][note] != self.no_fret:
+            self.press_note(string_number - 1, note)
+            self.release_note(string_number - 1, string.note)
+            self.set_string(string_number, note, string.fret + side,
+                            self.interval_names[self.midi_intervals[string_number][note]])
+            return -1
+        bend = min(max(signal.pitch, 0), self.MAX_PITCH_SHIFT)
+        if bend == string.bend:
+            return 0
+        string.bend = bend
+        return 1 << string_number
@@ -1,42 +1,57 @@
 import tkinter as tk
+from array import array
 from commons import exception_catcher
+from tunings import TuningCache, FretboardTables
+from startuptrace import STARTUP_TRACE
 
 class Guitar():
+    CANVAS = tk.Canvas
+    TUNING_CACHE = TuningCache()
+    NO_FRET = FretboardTables.NO_FRET  # MIDI value not on the string
 
     @exception_catcher
+    @STARTUP_TRACE.traced
     def __init__(self, root, max_width, settings_client):    
         self.settings_client = settings_client
         self.font = ('Constantia', 10)
         self.CANVAS_WIDTH = max_width
         self.FRETBOARD_LENGTH = self.CANVAS_WIDTH - self.CANVAS_WIDTH // 25  # x axis
         self.FRETBOARD_WIDTH = self.FRETBOARD_LENGTH // 7
-        self.STRING_NUMBER = 6
-        self.FRETS_NUMBER = 24
-        self.ONE_DOT_FRETS = [3, 5, 7, 9, 15, 17, 19, 21]
-        self.TWO_DOT_FRETS = [12, 24]
         self.OPEN_STRING_DISTANCE = 50
         self.DOT_SIZE = self.FRETBOARD_LENGTH / 24 / 7
-        self.STRING_DISTANCE = self.FRETBOARD_WIDTH / (self.STRING_NUMBER + 1)
         self.TEXT_MARGIN = self.FRETBOARD_WIDTH / 10  # how much place under the fretboard for fret labels (numbers)
-        # how long the guitar string would be - only for calculating fret distance
-        self.POTENTIAL_STRING_LENGTH = self.FRETBOARD_LENGTH * 1.3
-        self.FRET_DICT = {}
-        self.STRING_DICT = {} # High E is first string, low E is 6th string
         # !!! IMPORTANT !!!
         ''' 
-        Updated in self.show_fretboard(). Holds information required for showing what's played through MIDI signal.
-        self.MIDI_INFO_DICT = {
-            (string number) 1: {
-                (midi value) 64 : {
-                    "fret_number": 1
-                    "interval": "p4"
-                } 
-            }
-        }
+        Hold information required for showing what's played through MIDI signal,
+        indexed by string number and then by MIDI value 0-127:
+        self.MIDI_FRETS[1][64] -> 0 (fret number, NO_FRET if not on the string)
+        self.MIDI_INTERVALS[1][64] -> 7 (interval code, self.INTERVAL_NAMES[7] -> "p5"), updated in self.show_fretboard()
         '''
-        self.MIDI_INFO_DICT = {}    
+        self.INTERVAL_NAMES = tuple(self.settings_client.constants['all_intervals'])
+        self.canvas = self.CANVAS(root, width=int(self.CANVAS_WIDTH), height=int(self.FRETBOARD_WIDTH+self.TEXT_MARGIN))
+        self.root_note = None
+        self.set_tuning(self.settings_client.settings['tuning'], self.settings_client.settings['frets_number'])
+
+    @exception_catcher
+    @STARTUP_TRACE.traced
+    def set_tuning(self, tuning: str, frets_number: int):
+        # strings and frets can change, so the canvas is drawn again
+        self.tuning = tuning
+        self.tables = self.TUNING_CACHE.get(self.settings_client.constants['tunings'][tuning], int(frets_number))
+        self.STRING_NUMBER = self.tables.STRING_NUMBER
+        self.FRETS_NUMBER = self.tables.FRETS_NUMBER
+        self.ONE_DOT_FRETS = [fret for fret in range(1, self.FRETS_NUMBER+1) if fret % 12 in (3, 5, 7, 9)]
+        self.TWO_DOT_FRETS = [fret for fret in range(1, self.FRETS_NUMBER+1) if fret % 12 == 0]
+        self.LABELED_FRETS = sorted(self.ONE_DOT_FRETS + self.TWO_DOT_FRETS)
+        self.STRING_DISTANCE = self.FRETBOARD_WIDTH / (self.STRING_NUMBER + 1)
+        # how long the guitar string would be - only for calculating fret distance, the last fret at 3/4 of it with 24 frets
+        self.POTENTIAL_STRING_LENGTH = self.FRETBOARD_LENGTH * 1.3 * (0.75 / (1 - 2 ** (-self.FRETS_NUMBER / 12)))
+        self.FRET_DICT = {}
+        self.STRING_DICT = {} # High E is first string, low E is 6th string
+        self.MIDI_FRETS = self.tables.MIDI_FRETS
+        self.MIDI_INTERVALS = self.tables.get_midi_intervals(
+            self.settings_client.scale_index.get_note_index(self.root_note or 'C'))
 
-        self.canvas = tk.Canvas(root, width=int(self.CANVAS_WIDTH), height=int(self.FRETBOARD_WIDTH+self.TEXT_MARGIN))
         distance = self.OPEN_STRING_DISTANCE
         for fret in range(0, self.FRETS_NUMBER + 1):
             location = self.POTENTIAL_STRING_LENGTH - distance
@@ -62,34 +77,30 @@ class Guitar():
                 'x1': self.FRETBOARD_LENGTH,
                 'y1': self.STRING_DISTANCE*string
             }
-        
-        for string in self.settings_client.constants['guitar_strings']:
-            # determine notes on the fretboard
-            open_note = 'E' if string == "EE" else string
-            note_idx = self.settings_client.constants['all_notes_grouped'].index(
-                next(filter(lambda x: open_note in x, self.settings_client.constants['all_notes_grouped']))
-            )
-            for fret in range(self.FRETS_NUMBER+1):
-                self.settings_client.constants['guitar_strings'][string]['frets'].append(self.settings_client.constants['all_notes_grouped'][note_idx])
-                note_idx = note_idx + 1 if  note_idx + 1 < len(self.settings_client.constants['all_notes_grouped']) else 0        
-        self.draw_guitar()        
+        self.canvas.delete('all')
+        self.guitar_colors = None
+        self.draw_guitar()
+        self.create_markers()
     
     @exception_catcher
+    @STARTUP_TRACE.traced
     def draw_guitar(self):
         self.canvas.create_rectangle(0, 0, self.FRETBOARD_LENGTH, self.FRETBOARD_WIDTH,  
-                outline=self.settings_client.settings['guitar_neck_color'], fill=self.settings_client.settings['guitar_neck_color'])
+                outline=self.settings_client.settings['guitar_neck_color'], fill=self.settings_client.settings['guitar_neck_color'],
+                tags='neck')
         # fret 0 - open string
         self.canvas.create_line(*self.FRET_DICT[0]['coords'].values(), 
-                                fill=self.settings_client.settings['fret_zero_color'], width=9)        
+                                fill=self.settings_client.settings['fret_zero_color'], width=9, tags='fret_zero')        
         for fret in range(1, self.FRETS_NUMBER + 1):
             self.canvas.create_line(*self.FRET_DICT[fret]['coords'].values(), 
-                                    fill=self.settings_client.settings['guitar_frets_color'], width=2)
-            if fret in self.settings_client.constants['frets_labeled']:
+                                    fill=self.settings_client.settings['guitar_frets_color'], width=2, tags='fret')
+            if fret in self.LABELED_FRETS:
                 self.canvas.create_text(
                     self.FRET_DICT[fret-1]['coords']['x0'] + (self.FRET_DICT[fret]['coords']['x0'] - self.FRET_DICT[fret-1]['coords']['x0'])/2,
                     float(self.FRETBOARD_WIDTH + self.TEXT_MARGIN/2),
                     text = str(fret),
-                    fill='grey'
+                    fill='grey',
+                    tags='fret_label'
                 )
 
         for fret in range(1, self.FRETS_NUMBER+1):
@@ -104,7 +115,8 @@ class Guitar():
                         middle_point[0] + self.DOT_SIZE,
                         middle_point[1] - self.DOT_SIZE,
                         outline=self.settings_client.settings['guitar_dots_color'], 
-                        fill=self.settings_client.settings['guitar_dots_color']
+                        fill=self.settings_client.settings['guitar_dots_color'],
+                        tags='dot'
                 )
             elif fret in self.TWO_DOT_FRETS:
                 self.canvas.create_oval(
@@ -113,7 +125,8 @@ class Guitar():
                         middle_point[0] + self.DOT_SIZE,
                         self.FRET_DICT[fret]['coords']['y0'] + self.DOT_SIZE*5,
                         outline=self.settings_client.settings['guitar_dots_color'], 
-                        fill=self.settings_client.settings['guitar_dots_color']
+                        fill=self.settings_client.settings['guitar_dots_color'],
+                        tags='dot'
                 )           
                 self.canvas.create_oval(
                         middle_point[0] - self.DOT_SIZE,
@@ -121,125 +134,156 @@ class Guitar():
                         middle_point[0] + self.DOT_SIZE,
                         self.FRET_DICT[fret]['coords']['y1'] - self.DOT_SIZE*3,
                         outline=self.settings_client.settings['guitar_dots_color'], 
-                        fill=self.settings_client.settings['guitar_dots_color']
+                        fill=self.settings_client.settings['guitar_dots_color'],
+                        tags='dot'
                 )   
 
         for string in range(1, self.STRING_NUMBER+1):
             self.canvas.create_line(*self.STRING_DICT[string]['coords'].values(),
                                     fill=self.settings_client.settings['guitar_strings_color'], 
-                                    width=int(0.5 + 0.5*string))
-        
+                                    width=int(0.5 + 0.5*string), tags='string')
+
     @exception_catcher
-    def get_midi_value_open_string(self, string_name: str):
-        match string_name:
-            case "E":
-                midi_val = 40
-            case "A":
-                midi_val = 45
-            case "D":
-                midi_val = 50
-            case "G":
-                midi_val = 55
-            case "B": 
-                midi_val = 59
-            case "EE":
-                midi_val = 64
-        return midi_val
+    def update_guitar_colors(self):
+        # colors of the items drawn by draw_guitar(), only when settings changed
+        colors = (self.settings_client.settings['guitar_neck_color'], self.settings_client.settings['fret_zero_color'],
+                  self.settings_client.settings['guitar_frets_color'], self.settings_client.settings['guitar_dots_color'],
+                  self.settings_client.settings['guitar_strings_color'])
+        if colors == self.guitar_colors:
+            return
+        neck_color, fret_zero_color, frets_color, dots_color, strings_color = self.guitar_colors = colors
+        self.canvas.itemconfigure('neck', outline=neck_color, fill=neck_color)
+        self.canvas.itemconfigure('fret_zero', fill=fret_zero_color)
+        self.canvas.itemconfigure('fret', fill=frets_color)
+        self.canvas.itemconfigure('dot', outline=dots_color, fill=dots_color)
+        self.canvas.itemconfigure('string', fill=strings_color)
 
     @exception_catcher
-    def show_fretboard(self, root_note, scale_type_name, first_fret, last_fret):
-        self.canvas.delete('all')
-        self.draw_guitar()
-        root_note_idx = self.settings_client.constants['all_notes_grouped'].index(
-            next(filter(lambda x: root_note in x, self.settings_client.constants['all_notes_grouped']))
-        )
-        scale_type = next(filter(lambda x: self.settings_client.strings[x]==scale_type_name, self.settings_client.strings))
-        sorted_notes = self.settings_client.constants['all_notes_grouped'][root_note_idx:] + self.settings_client.constants['all_notes_grouped'][: root_note_idx]
-        self.assigned_intervals = {}
-        for note, interval in zip(sorted_notes, self.settings_client.constants['all_intervals']):
-            self.assigned_intervals[str(note)] = interval
-        for string in self.settings_client.constants['guitar_strings']:
-            string_num = self.settings_client.constants['guitar_strings'][string]['number']
-            self.MIDI_INFO_DICT[string_num] = {}
-            midi_val = self.get_midi_value_open_string(string)
-            for fret in range(0, self.settings_client.constants['frets_number']+1):                
-                note = self.settings_client.constants['guitar_strings'][string]['frets'][fret]
-                interval = self.assigned_intervals[str(note)]
-                self.MIDI_INFO_DICT[string_num][midi_val] = {
-                    "fret_number": fret,
-                    "interval": interval
-                }
-                if fret in range(int(first_fret), int(last_fret)+1) and \
-                        interval in self.settings_client.constants['scale_types'][scale_type]['intervals']:
-                    self.draw_interval(string, fret, interval)
-                midi_val += 1
+    @STARTUP_TRACE.traced
+    def create_markers(self):
+        # hidden oval and text for every string and fret, show_fretboard() shows the scale on them
+        for string_number in range(1, self.STRING_NUMBER+1):
+            for fret in range(self.FRETS_NUMBER+1):
+                tag = self.get_marker_tag(string_number, fret)
+                self.canvas.create_oval(0, 0, 0, 0, state='hidden', tags=('marker', 'marker_oval', tag, f'{tag}_oval'))
+                self.canvas.create_text(self.FRET_DICT[fret]['middle_x'], self.STRING_DICT[string_number]['coords']['y0'],
+                                        state='hidden', tags=('marker', 'marker_text', tag, f'{tag}_text'))
+        self.markers_size = None
+        self.shown_markers = {}
+
+    def get_marker_tag(self, string_number: int, fret: int) -> str:
+        return f'marker_{string_number}_{fret}'
 
     @exception_catcher
-    def draw_interval(self, string: str, fret: str, interval: str):
+    def update_markers_size(self):
         r = self.settings_client.settings['interval_label_radius']
-        string_number = self.settings_client.constants['guitar_strings'][string]['number']
-        middle_x = self.FRET_DICT[fret]['middle_x']
-        self.canvas.create_oval(
-            middle_x - r,
-            self.STRING_DICT[string_number]['coords']['y0'] - r,
-            middle_x + r,
-            self.STRING_DICT[string_number]['coords']['y0'] + r,
+        font = ('Aria', self.settings_client.settings['interval_font_size'])
+        if (r, font) == self.markers_size:
+            return
+        self.markers_size = (r, font)
+        for string_number in range(1, self.STRING_NUMBER+1):
+            y = self.STRING_DICT[string_number]['coords']['y0']
+            for fret in range(self.FRETS_NUMBER+1):
+                middle_x = self.FRET_DICT[fret]['middle_x']
+                self.canvas.coords(f'{self.get_marker_tag(string_number, fret)}_oval', middle_x - r, y - r, middle_x + r, y + r)
+        self.canvas.itemconfigure('marker_text', font=font)
+
+    @exception_catcher
+    def show_fretboard(self, root_note, scale_type_name, first_fret, last_fret):
+        # canvas items are created once, only the changed ones are configured
+        self.root_note = root_note
+        self.update_guitar_colors()
+        self.update_markers_size()
+        scale_type = self.settings_client.scale_index.get_scale_type(scale_type_name)
+        self.MIDI_INTERVALS = self.tables.get_midi_intervals(self.settings_client.scale_index.get_note_index(root_note))
+        markers = {}
+        for fret, interval, string_num in self.get_scale_markers(root_note, scale_type):
+            if int(first_fret) <= fret <= int(last_fret):
+                markers[(string_num, fret)] = (interval, self.settings_client.settings['interval_color'][interval]['bg'],
+                                               self.settings_client.settings['interval_color'][interval]['font'])
+        for string_num, fret in self.shown_markers.keys() - markers.keys():
+            self.canvas.itemconfigure(self.get_marker_tag(string_num, fret), state='hidden')
+        for (string_num, fret), marker in markers.items():
+            if self.shown_markers.get((string_num, fret)) != marker:
+                self.draw_interval(string_num, fret, marker[0])
+        self.shown_markers = markers
+
+    @exception_catcher
+    def get_scale_markers(self, root_note: str, scale_type: str) -> tuple:
+        # (fret, interval, string number) of every scale interval on the fretboard, strings from the first one
+        markers = self.tables.get_scale_markers(self.settings_client.scale_index.get_note_index(root_note),
+                                                self.settings_client.scale_index.get_scale_codes(scale_type))
+        return tuple((fret, self.INTERVAL_NAMES[code], string_number) for fret, code, string_number in markers)
+
+    def get_midi_tables_size(self) -> int:
+        # bytes taken by the MIDI lookup tables
+        return sum(table.nbytes for table in self.MIDI_FRETS[1:] + self.MIDI_INTERVALS[1:])
+
+    @exception_catcher
+    def draw_interval(self, string_number: int, fret: int, interval: str):
+        tag = self.get_marker_tag(string_number, fret)
+        self.canvas.itemconfigure(
+            f'{tag}_oval',
             outline=self.settings_client.settings['interval_color'][interval]['bg'], 
-            fill=self.settings_client.settings['interval_color'][interval]['bg']
+            fill=self.settings_client.settings['interval_color'][interval]['bg'],
+            state='normal'
         )
-        self.canvas.create_text(
-            middle_x,
-            self.STRING_DICT[string_number]['coords']['y0'],
-            font=('Aria', self.settings_client.settings['interval_font_size']),
-            text = str(self.settings_client.constants['all_intervals'][interval].encode('cp1252').decode()),
-            fill=self.settings_client.settings['interval_color'][interval]['font'],            
+        self.canvas.itemconfigure(
+            f'{tag}_text',
+            text = self.settings_client.constants['all_intervals'][interval],
+            fill=self.settings_client.settings['interval_color'][interval]['font'],
+            state='normal'
         )
 
 
 class Piano():
+    CANVAS = tk.Canvas
+    NO_KEY = -128  # MIDI value out of the keyboard, -1 is the key left of the keyboard
 
     @exception_catcher
+    @STARTUP_TRACE.traced
     def __init__(self, root, max_width, settings_client):
         self.settings_client = settings_client
         self.CANVAS_WIDTH = max_width
         self.KEYBOARD_LENGTH = self.CANVAS_WIDTH - self.CANVAS_WIDTH // 10  # x axis, horizontal
         self.KEYBOARD_WIDTH = self.KEYBOARD_LENGTH // 6 # y axis, vertical
-        self.canvas = tk.Canvas(root, width=int(self.CANVAS_WIDTH), height=int(self.KEYBOARD_WIDTH))
-        self.OCTAVES_NUMBER = 4
+        self.canvas = self.CANVAS(root, width=int(self.CANVAS_WIDTH), height=int(self.KEYBOARD_WIDTH))
         self.KEYS_PADDING_BOTTOM = 10
-        self.MIDI_INFO_DICT = {}
-        '''
-        self.MIDI_INFO_DICT = {
-            (midi value) 64 : (key_number} 15
-        }
-        '''        
+        self.b = b = 'b'    # black key signature
+        self.w = w ='w'    # white key signature
+        self.octave = [w,b,w,b,w, w,b,w,b,w,b,w] # c, c#, d, d#, e,   f, f#, g, g#, a, a#, b
+        self.set_range(self.settings_client.settings['piano_range'])
+
+    @exception_catcher
+    @STARTUP_TRACE.traced
+    def set_range(self, piano_range: str):
+        # keys and their width can change, so the canvas is drawn again
+        self.piano_range = piano_range
+        # first and last MIDI value of the keyboard, e.g. 21-108 (A0-C8) for 88 keys
+        first_midi_val, last_midi_val = self.settings_client.constants['piano_ranges'][piano_range]
+        self.all_keys = [self.octave[midi_val % 12] for midi_val in range(first_midi_val, last_midi_val+1)]
+        self.KEYS_NUMBER = len(self.all_keys)
+        # key number indexed by MIDI value 0-127, self.MIDI_KEYS[64] -> 24 for 49 keys from E2
+        self.MIDI_KEYS = array('b', [self.NO_KEY]) * 128
 
-        self.white_key_width = self.KEYBOARD_LENGTH / (self.OCTAVES_NUMBER*7) # x axis, horizontal
+        self.white_key_width = self.KEYBOARD_LENGTH / self.all_keys.count(self.w) # x axis, horizontal
         self.white_key_length = self.KEYBOARD_WIDTH - self.KEYS_PADDING_BOTTOM # y axis, vertical
         self.black_key_width = self.white_key_width * 0.75
         self.black_key_length = self.white_key_length * 0.6
-        self.b = b = 'b'    # black key signature
-        self.w = w ='w'    # white key signature
-        self.octave = [w,b,w,b,w, w,b,w,b,w,b,w] # c, c#, d, d#, e,   f, f#, g, g#, a, a#, b
-        # 4 octaves from E to E (like in guitar)
-        self.all_keys = self.octave[4:] + self.octave * 3 + self.octave[:5]
         self.keys = {}
-        idx = 4 # starting from E
         x_pos_white = 0
-        midi_val = 40 # E2
         self.BLACK_KEYS_NBRS = []
         self.WHITE_KEYS_NBRS = []
         for key_num, key in enumerate(self.all_keys):
+            midi_val = first_midi_val + key_num
             self.keys[key_num] = {
-                'note': self.settings_client.constants['all_notes_grouped'][idx],
+                'note': self.settings_client.constants['all_notes_grouped'][midi_val % 12],
                 'type': key,
                 'midi_val': midi_val,
                 'left_black': True if key_num > 1 and self.all_keys[key_num-1] == self.b else False,
                 'right_black': True if key_num < len(self.all_keys)-1 and self.all_keys[key_num+1] == self.b else False
             }
-            self.MIDI_INFO_DICT[midi_val] = key_num
-            midi_val += 1
-            idx = idx + 1 if idx+1 < len(self.settings_client.constants['all_notes_grouped']) else 0
+            self.MIDI_KEYS[midi_val] = key_num
             if key == self.w:
                 self.keys[key_num]['x_pos'] = x_pos_white
                 x_pos_white = x_pos_white + self.white_key_width 
@@ -247,6 +291,9 @@ class Piano():
             else:
                 self.BLACK_KEYS_NBRS.append(key_num)
                 self.keys[key_num]['x_pos'] = x_pos_white - (self.black_key_width / 2)
+        # key colour by key number in constant time, the lists above keep the keyboard order
+        self.WHITE_KEYS = frozenset(self.WHITE_KEYS_NBRS)
+        self.BLACK_KEYS = frozenset(self.BLACK_KEYS_NBRS)
 
         self.sorted_keys = dict(sorted(self.keys.items(), key=lambda item: item[1]['type'], reverse=True))
         for out_of_range_key in [-1, len(self.keys)]:
@@ -256,8 +303,13 @@ class Piano():
                 'right_black': False,
                 'type': self.w
             }
+        self.canvas.delete('all')
         self.draw_piano()
 
+    def get_midi_tables_size(self) -> int:
+        # bytes taken by the MIDI lookup table
+        return self.MIDI_KEYS.itemsize * len(self.MIDI_KEYS)
+
     @exception_catcher
     def draw_key(self, key_type: str, x_pos: float|int):
         if key_type == self.w:
@@ -268,6 +320,29 @@ class Piano():
                                          outline='black', fill='black')
             
     @exception_catcher
+    @STARTUP_TRACE.traced
     def draw_piano(self):
         for key, values in self.sorted_keys.items():
             self.draw_key(values['type'], values['x_pos'])
+
+
+class HeadlessCanvas():
+    """Stand-in for tk.Canvas which only counts calls, so instruments can be built without a display
+    (benchmark, visualizer process)."""
+
+    def __init__(self, root=None, **kwargs):
+        self.calls = {}
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            return self.calls[name]
+        return call
+
+
+class HeadlessGuitar(Guitar):
+    CANVAS = HeadlessCanvas
+
+
+class HeadlessPiano(Piano):
+    CANVAS = HeadlessCanvas
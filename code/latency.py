@@ -0,0 +1,71 @@
+import os
+from collections import deque
+from datetime import datetime
+from time import perf_counter
+
+class LatencyMonitor():
+    """Input-to-display latency of MIDI messages. Every message carries its arrival time (perf_counter)
+    in message.time, latency is measured when the note state is updated, the frame is drawn and displayed.
+    Samples are kept in rolling windows per message type and stage."""
+    STAGES = ('state', 'draw', 'display')
+    WINDOW = 1024
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self):
+        self.samples = {}
+        self.pending = []  # (message type, arrival time) of messages not displayed yet
+
+    def record(self, signal_type: str, stage: str, latency: float):
+        if signal_type not in self.samples:
+            self.samples[signal_type] = {stage: deque(maxlen=self.WINDOW) for stage in self.STAGES}
+        self.samples[signal_type][stage].append(latency)
+
+    def ingested(self, signals: list):
+        now = perf_counter()
+        for signal in signals:
+            self.record(signal.type, 'state', now - signal.time)
+            self.pending.append((signal.type, signal.time))
+
+    def drawn(self):
+        now = perf_counter()
+        for signal_type, arrived_at in self.pending:
+            self.record(signal_type, 'draw', now - arrived_at)
+
+    def displayed(self):
+        now = perf_counter()
+        for signal_type, arrived_at in self.pending:
+            self.record(signal_type, 'display', now - arrived_at)
+        self.pending = []
+
+    def discard_pending(self):
+        # messages which did not change anything on screen
+        self.pending = []
+
+    def get_percentiles(self, signal_type: str, stage: str) -> list:
+        samples = sorted(self.samples[signal_type][stage])
+        if not samples:
+            return [0 for _ in self.PERCENTILES]
+        return [samples[int(percentile / 100 * (len(samples) - 1))] for percentile in self.PERCENTILES]
+
+    def get_lines(self, stage: str = 'display') -> list:
+        lines = []
+        for signal_type in sorted(self.samples):
+            values = ', '.join(f'p{percentile} {value*1000:.1f}'
+                               for percentile, value in zip(self.PERCENTILES, self.get_percentiles(signal_type, stage)))
+            lines.append(f'{signal_type}: {values} ms')
+        return lines
+
+    def dump_csv(self, path: str, **run_info):
+        if not self.samples:
+            return
+        header = not os.path.exists(path)
+        with open(path, 'a+') as f:
+            if header:
+                f.write(','.join(['date', *run_info, 'message_type', 'stage', 'samples',
+                                  *[f'p{percentile}_ms' for percentile in self.PERCENTILES]]) + '\n')
+            date = datetime.now().isoformat(timespec='seconds')
+            for signal_type in sorted(self.samples):
+                for stage in self.STAGES:
+                    values = [f'{value*1000:.3f}' for value in self.get_percentiles(signal_type, stage)]
+                    f.write(','.join([date, *[str(value) for value in run_info.values()], signal_type, stage,
+                                      str(len(self.samples[signal_type][stage])), *values]) + '\n')
@@ -1,13 +1,23 @@
-import tkinter as tk
-import ttkbootstrap as tb
-import ttkbootstrap.constants as tb_const
-from ttkbootstrap.scrolled import ScrolledFrame
+from startuptrace import STARTUP_TRACE
+with STARTUP_TRACE.measure('import tkinter'):
+    import tkinter as tk
+    from tkinter import filedialog
+from datetime import datetime
+with STARTUP_TRACE.measure('import ttkbootstrap'):
+    import ttkbootstrap as tb
+    import ttkbootstrap.constants as tb_const
+    from ttkbootstrap.scrolled import ScrolledFrame
 
-from commons import exception_catcher
-from settings import Settings
-from playandshow import Visualizer
-from instruments import Guitar, Piano
-from signalconfig import SignalConfig
+with STARTUP_TRACE.measure('import commons'):
+    from commons import exception_catcher, ERROR_REPORTER
+with STARTUP_TRACE.measure('import settings'):
+    from settings import Settings
+with STARTUP_TRACE.measure('import instruments'):
+    from instruments import Guitar, Piano
+with STARTUP_TRACE.measure('import signalconfig'):
+    from signalconfig import SignalConfig
+# visualprocess and midiinput (mido) are imported when visuals are started, they are slow to import,
+# playandshow (pygame) is imported only by the visualizer process
 
 class App:
 
@@ -16,15 +26,17 @@ class App:
         row = 0
         self.settings_client = Settings(self)
         theme = 'darkly' if self.settings_client.settings['dark_theme'] else 'cosmo'
-        self.root = tb.Window(themename=theme)
+        with STARTUP_TRACE.measure('ttkbootstrap window and theme setup'):
+            self.root = tb.Window(themename=theme)
+        ERROR_REPORTER.set_root(self.root)
 
         self.root.iconbitmap('data/seeMidi.ico')
         self.root.title("See MIDI")
         self.root.geometry('{}x{}'.format(*self.root.maxsize()))
         self.root.state('zoomed')
-        self.settings_client = Settings(self)
         self.menubar = tk.Menu(self.root)
         self.signal_config = SignalConfig(self.settings_client)
+        self.visualizer = None  # VisualizerProcess of the last started visuals
         # settings
         self.settings_menu = tk.Menu(self.menubar, tearoff=0)
         self.settings_menu.add_command(label=self.settings_client.strings['settings'], command=self.settings_client.open)
@@ -33,6 +45,8 @@ class App:
         # tools
         self.tools_menu = tk.Menu(self.menubar, tearoff=0)
         self.tools_menu.add_command(label=self.settings_client.strings['signal_config'], command=self.signal_config.start)
+        self.tools_menu.add_command(label=self.settings_client.strings['replay_midi_file'], command=self.replay_midi_file)
+        self.tools_menu.add_command(label=self.settings_client.strings['watch_state_stream'], command=self.watch_state_stream)
         self.menubar.add_cascade(label=self.settings_client.strings['tools'], menu=self.tools_menu)
 
         self.root.config(menu=self.menubar)
@@ -93,12 +107,12 @@ class App:
         self.fret_range_frame = tb.Labelframe(self.settings_frame, bootstyle="default", text=self.settings_client.strings['fret_range'])
         self.label_from = tb.Label(self.fret_range_frame, text=self.settings_client.strings['from'])
         self.input_fret_from = tb.Combobox(self.fret_range_frame, width=5, state='readonly',
-                                                values=list(range(0,self.settings_client.constants['frets_number']+1)))
+                                                values=list(range(0,self.guitar.FRETS_NUMBER+1)))
         self.input_fret_from.current(0)
         self.label_to = tb.Label(self.fret_range_frame, text=self.settings_client.strings['to'])
         self.input_fret_to = tb.Combobox(self.fret_range_frame, width=5, state='readonly',
-                                                values=list(range(0,self.settings_client.constants['frets_number']+1)))
-        self.input_fret_to.current(self.settings_client.constants['frets_number'])
+                                                values=list(range(0,self.guitar.FRETS_NUMBER+1)))
+        self.input_fret_to.current(self.guitar.FRETS_NUMBER)
         self.label_from.grid(column=0, row=0, padx=10)
         self.input_fret_from.grid(column=1, row=0, pady= 10, padx=5)
         self.label_to.grid(column=2, row=0, padx=5)
@@ -118,7 +132,7 @@ class App:
         #region scale type
         self.scale_type_frame = tb.Labelframe(self.settings_frame, text=self.settings_client.strings['type'], bootstyle="default")
         self.input_scale_type = tb.Combobox(self.scale_type_frame, width=15, state='readonly',
-                                            values=[self.settings_client.strings[s] for s in self.settings_client.constants['scale_types']])
+                                            values=self.settings_client.scale_index.get_scale_names())
         self.input_scale_type.current(0)
         self.input_scale_type.grid(pady=10, padx=30)
         self.scale_type_frame.grid(row=2, column=3, padx=20, pady=20)
@@ -137,6 +151,8 @@ class App:
         row += 1
         self.show_guitar_fretboard()
 
+        # idle callbacks run after the pending redraws, so the main window is painted by then
+        self.root.after_idle(STARTUP_TRACE.finish)
         self.root.mainloop()
 
     @exception_catcher
@@ -146,6 +162,8 @@ class App:
         self.settings_menu.entryconfigure(0, label=self.settings_client.strings['settings'])
         self.settings_menu.entryconfigure(1, label=self.settings_client.strings['revert_to_default'])
         self.tools_menu.entryconfig(0, label=self.settings_client.strings['signal_config'])
+        self.tools_menu.entryconfig(1, label=self.settings_client.strings['replay_midi_file'])
+        self.tools_menu.entryconfig(2, label=self.settings_client.strings['watch_state_stream'])
         self.check_show_guitar.configure(text=self.settings_client.strings['show_guitar'])    
         self.check_show_piano.configure(text=self.settings_client.strings['show_piano'])
         self.fret_range_frame.configure(text=self.settings_client.strings['fret_range'])
@@ -153,17 +171,34 @@ class App:
         self.label_to.configure(text=self.settings_client.strings['to'])
         self.scale_root_frame.configure(text=self.settings_client.strings['scale_root'])
         self.scale_type_frame.configure(text=self.settings_client.strings['type'])
-        if self.input_scale_type.get() not in self.settings_client.strings.values():
+        if self.input_scale_type.get() not in self.settings_client.scale_index.get_scale_names():
             # language did change
-            self.input_scale_type.configure(values=[self.settings_client.strings[s] for s in self.settings_client.constants['scale_types']])
+            self.input_scale_type.configure(values=self.settings_client.scale_index.get_scale_names())
             self.input_scale_type.current(0)        
         self.btn_update.configure(text=self.settings_client.strings['update'])
+        if (self.guitar.tuning, self.guitar.FRETS_NUMBER) != (self.settings_client.settings['tuning'],
+                                                             self.settings_client.settings['frets_number']):
+            self.guitar.set_tuning(self.settings_client.settings['tuning'], self.settings_client.settings['frets_number'])
+            self.input_fret_from.configure(values=list(range(0,self.guitar.FRETS_NUMBER+1)))
+            self.input_fret_to.configure(values=list(range(0,self.guitar.FRETS_NUMBER+1)))
+            self.input_fret_from.current(0)
+            self.input_fret_to.current(self.guitar.FRETS_NUMBER)
+        if self.piano.piano_range != self.settings_client.settings['piano_range']:
+            self.piano.set_range(self.settings_client.settings['piano_range'])
+        if self.visualizer is not None and self.visualizer.is_running():
+            # settings were saved, running visuals read them again
+            self.visualizer.reload_settings()
         self.show_guitar_fretboard()
 
     @exception_catcher
     def show_guitar_fretboard(self):
         self.guitar.show_fretboard(self.input_scale_root.get(), self.input_scale_type.get(),
                             self.input_fret_from.get(), self.input_fret_to.get())
+        if self.visualizer is not None and self.visualizer.is_running():
+            # running visuals follow the root, scale and fret range
+            self.visualizer.set_scale(self.input_scale_root.get(),
+                                      self.settings_client.scale_index.get_scale_type(self.input_scale_type.get()),
+                                      int(self.input_fret_from.get()), int(self.input_fret_to.get()))
 
     @exception_catcher
     def set_guitar_visibility(self):
@@ -180,18 +215,47 @@ class App:
             self.piano_frame.grid_forget()
     
     @exception_catcher
-    def play(self):
-        vis = Visualizer(settings_client=self.settings_client,
-                        size=self.root.maxsize(),
-                        show_guitar=self.check_state_show_guitar.get(),
-                        show_piano=self.check_state_show_piano.get(),
-                        guitar = self.guitar,
-                        piano = self.piano,
-                        first_fret = int(self.input_fret_from.get()),
-                        last_fret = int(self.input_fret_to.get()),
-                        scale_type = next(filter(lambda x: self.settings_client.strings[x]==self.input_scale_type.get(), self.settings_client.strings)),
-                        max_bend = self.guitar.STRING_DISTANCE,
-                        reduce_bends = self.settings_client.settings['reduce_bends']
-                        )
-
-app = App()
+    def replay_midi_file(self):
+        from midiinput import MidiFileSource
+        path = filedialog.askopenfilename(initialdir='data/recordings',
+                                          filetypes=[(self.settings_client.strings['midi_files'], '*.mid *.midi')])
+        if path:
+            self.play(MidiFileSource(path, speed=self.settings_client.settings['replay_speed']))
+
+    @exception_catcher
+    def watch_state_stream(self):
+        # viewer of the visuals streamed from another screen, in its own process like the visuals
+        import multiprocessing
+        from statestream import run_viewer, parse_address
+        _, port = parse_address(self.settings_client.settings['stream_address'])
+        multiprocessing.get_context('spawn').Process(target=run_viewer, args=(f'0.0.0.0:{port}',),
+                                                     name='viewer', daemon=True).start()
+
+    @exception_catcher
+    def play(self, midi_source=None):
+        from visualprocess import VisualizerProcess
+        from midiinput import get_live_source
+        if self.visualizer is not None and self.visualizer.is_running():
+            return  # the MIDI ports are taken by the running visuals
+        if midi_source is None:
+            record_path = f'data/recordings/session_{datetime.now():%Y%m%d_%H%M%S}.mid' \
+                if self.settings_client.settings['record_sessions'] else None
+            midi_source = get_live_source(self.settings_client.settings['midi_ports'], record_path=record_path)
+        # no MIDI input is shown in the visualizer window, as before
+        self.visualizer = VisualizerProcess(self.guitar, self.piano, midi_source, params={
+            'size': self.root.maxsize(),
+            'show_guitar': self.check_state_show_guitar.get(),
+            'show_piano': self.check_state_show_piano.get(),
+            'root_note': self.input_scale_root.get(),
+            'first_fret': int(self.input_fret_from.get()),
+            'last_fret': int(self.input_fret_to.get()),
+            'scale_type': self.settings_client.scale_index.get_scale_type(self.input_scale_type.get()),
+            'reduce_bends': self.settings_client.settings['reduce_bends'],
+            'target_fps': self.settings_client.settings['target_fps'],
+            'immediate_rendering': self.settings_client.settings['immediate_rendering'],
+            'dump_latency_csv': self.settings_client.settings['dump_latency_csv']
+        }).start()
+
+if __name__ == '__main__':
+    # the visualizer process imports this module again
+    app = App()
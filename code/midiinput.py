@@ -0,0 +1,293 @@
+import os
+import mido
+import threading
+from functools import partial
+from collections import deque
+from time import perf_counter, sleep
+from tracelog import TRACE
+
+class MidiReader():
+    """Receives messages from the callback of a mido input port (called on the backend thread) into a bounded
+    queue and wakes the consumer once per batch, so the consumer can block instead of polling the port.
+    Time of every message is replaced by its arrival time (perf_counter) for latency measurement."""
+    QUEUE_SIZE = 4096
+
+    def __init__(self, wake=None):
+        self.wake = wake
+        self.queue = deque()
+        self.wake_pending = False
+        self.woken_at = 0
+        self.received = 0
+        self.dropped = 0
+        self.wakeups = 0
+        self.total_wake_latency = 0
+        self.max_wake_latency = 0
+
+    def receive(self, signal) -> bool:
+        # True - the queue was full and the oldest message was dropped
+        signal.time = perf_counter()
+        dropped = len(self.queue) >= self.QUEUE_SIZE
+        if dropped:
+            TRACE.warning('[MIDI READER] queue full, dropped %s', self.queue.popleft())
+            self.dropped += 1
+        self.queue.append(signal)
+        self.received += 1
+        if not self.wake_pending:
+            self.wake_pending = True
+            self.woken_at = perf_counter()
+            if self.wake:
+                self.wake()
+        return dropped
+
+    def drain(self) -> list:
+        if self.wake_pending:
+            # time between the first message of the batch and the consumer getting to it
+            latency = perf_counter() - self.woken_at
+            self.wakeups += 1
+            self.total_wake_latency += latency
+            self.max_wake_latency = max(self.max_wake_latency, latency)
+            self.wake_pending = False
+        signals = []
+        while self.queue:
+            signals.append(self.queue.popleft())
+        return signals
+
+    def summary(self) -> str:
+        mean_latency = self.total_wake_latency / self.wakeups if self.wakeups else 0
+        return f'[MIDI READER] received: {self.received}, dropped: {self.dropped}, wakeups: {self.wakeups}, ' \
+               f'wake latency mean: {mean_latency*1000:.2f} ms, max: {self.max_wake_latency*1000:.2f} ms'
+
+class PitchwheelCoalescer():
+    """Folds pitchwheel messages superseded by a later pitchwheel on the same channel within one batch.
+    Pitchwheel messages with pitch 0 or one step (hammer-on heuristic), and messages which a hammer-on
+    signal would see as its previous signal, are always kept.
+    feeds_hammer_on(signal) tells which messages the heuristic sees at all (FretboardState.feeds_hammer_on),
+    the others (system and keyboard channel messages) are skipped while looking for the previous signal.
+    Without it every message counts."""
+
+    def __init__(self, one_step_pitch: list, feeds_hammer_on=None):
+        self.special_pitches = {0, *one_step_pitch}
+        self.feeds_hammer_on = feeds_hammer_on or (lambda signal: True)
+        self.received = 0
+        self.folded = 0
+
+    def coalesce(self, batch: list) -> list:
+        self.received += len(batch)
+        kept = []
+        channels_bent_later = set()  # channels whose next message in the batch is pitchwheel
+        successor = None  # next message which stays in the batch and is seen by the hammer-on heuristic
+        for signal in reversed(batch):
+            channel = getattr(signal, 'channel', None)
+            if signal.type == 'pitchwheel':
+                if signal.pitch not in self.special_pitches and channel in channels_bent_later and \
+                        not (successor is not None and successor.type == 'pitchwheel' and
+                             successor.pitch in self.special_pitches):
+                    self.folded += 1
+                    continue
+                channels_bent_later.add(channel)
+            else:
+                channels_bent_later.discard(channel)
+            kept.append(signal)
+            if self.feeds_hammer_on(signal):
+                successor = signal
+        kept.reverse()
+        return kept
+
+    def summary(self) -> str:
+        return f'[PITCHWHEEL] received: {self.received}, folded: {self.folded}'
+
+def save_midi_file(path: str, timed_signals: list, ticks_per_beat: int = 480, tempo: int = 500000):
+    # timed_signals - (time in seconds, message), delta times in ticks are counted from the first message
+    track = mido.MidiTrack()
+    prev_time = timed_signals[0][0]
+    for timestamp, signal in timed_signals:
+        ticks = round(mido.second2tick(timestamp - prev_time, ticks_per_beat, tempo))
+        track.append(signal.copy(time=ticks))
+        prev_time = timestamp
+    midi_file = mido.MidiFile(ticks_per_beat=ticks_per_beat)
+    midi_file.tracks.append(track)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    midi_file.save(path)
+
+class MidiSource():
+    """Source of MIDI messages. open(callback) starts delivering messages to callback (from another thread)
+    and returns the source, close() stops it. OSError is raised when the source cannot be opened."""
+
+    def open(self, callback):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def get_port_lines(self) -> list:
+        # statistics of the input ports, for sources with more than one
+        return []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class LivePortSource(MidiSource):
+    """MIDI input port, the default one without port name. With record_path the session is saved to .mid on close."""
+    TICKS_PER_BEAT = 480
+    TEMPO = 500000  # microseconds per beat, 120 bpm
+
+    def __init__(self, port_name: str|None = None, record_path: str|None = None):
+        self.port_name = port_name
+        self.record_path = record_path
+        self.recorded = []  # (arrival time, message)
+        self.port = None
+
+    def open(self, callback):
+        self.callback = callback
+        self.port = mido.open_input(self.port_name, callback=self.receive if self.record_path else callback)
+        return self
+
+    def receive(self, signal):
+        self.recorded.append((perf_counter(), signal.copy(time=0)))
+        self.callback(signal)
+
+    def close(self):
+        if self.port is not None:
+            self.port.close()
+        if self.record_path and self.recorded:
+            self.save_recording()
+
+    def save_recording(self):
+        save_midi_file(self.record_path, self.recorded, self.TICKS_PER_BEAT, self.TEMPO)
+        TRACE.info('Session recorded to %s', self.record_path)
+
+def get_input_port_names() -> list:
+    # connected input ports, none when the MIDI backend cannot be loaded
+    try:
+        return mido.get_input_names()
+    except (ImportError, OSError):
+        return []
+
+def parse_channel_map(text: str) -> dict:
+    # '1>7 2>8' -> {'1': 7, '2': 8}, channels 1-16 like in settings.json
+    channel_map = {}
+    for pair in text.split():
+        source, _, target = pair.partition('>')
+        if not (1 <= int(source) <= 16 and 1 <= int(target) <= 16):
+            raise ValueError(f'MIDI channels are 1-16, got {pair}')
+        channel_map[str(int(source))] = int(target)
+    return channel_map
+
+def format_channel_map(channel_map: dict) -> str:
+    return ' '.join(f'{source}>{target}' for source, target in channel_map.items())
+
+class PortStats():
+    """Channel remapping and counters of one port of MultiPortSource."""
+
+    def __init__(self, name: str, channel_map: dict):
+        self.name = name
+        # channel 0-15 -> channel 0-15, channel_map uses 1-16
+        self.channels = bytes(int(channel_map.get(str(channel+1), channel+1)) - 1 for channel in range(16))
+        self.received = 0
+        self.dropped = 0
+        self.opened_at = perf_counter()
+
+    def remap(self, signal):
+        # messages from the backend are not shared, so they are changed in place
+        self.received += 1
+        channel = getattr(signal, 'channel', None)
+        if channel is not None and self.channels[channel] != channel:
+            signal.channel = self.channels[channel]
+
+    def summary(self) -> str:
+        rate = self.received / max(perf_counter() - self.opened_at, 1e-9)
+        return f'[MIDI PORT] {self.name}: received: {self.received}, {rate:.1f} msg/s, dropped: {self.dropped}'
+
+class MultiPortSource(LivePortSource):
+    """Named input ports opened together: ports = [{"name": ..., "channel_map": {"1": 7}}] as in settings.json.
+    Every port is read by its own backend callback thread. Messages are delivered to the callback one at a time
+    under a lock, and the receiver (MidiReader) stamps their arrival time, so the merged stream is ordered by it.
+    Nothing is buffered for the merge - a busy port alone only takes an uncontended lock per message."""
+
+    def __init__(self, ports: list, record_path: str|None = None):
+        super().__init__(None, record_path)
+        self.ports_config = ports
+        self.lock = threading.Lock()
+        self.ports = []
+        self.stats = []
+
+    def open(self, callback):
+        self.callback = callback
+        try:
+            for port in self.ports_config:
+                stats = PortStats(port['name'], port.get('channel_map', {}))
+                self.ports.append(mido.open_input(port['name'], callback=partial(self.deliver, stats)))
+                self.stats.append(stats)
+        except Exception:
+            self.close()
+            raise
+        return self
+
+    def deliver(self, stats: PortStats, signal):
+        with self.lock:
+            stats.remap(signal)
+            if self.record_path:
+                self.recorded.append((perf_counter(), signal.copy(time=0)))
+            if self.callback(signal):
+                stats.dropped += 1
+
+    def close(self):
+        for port in self.ports:
+            port.close()
+        self.ports = []
+        if self.record_path and self.recorded:
+            self.save_recording()
+
+    def get_port_lines(self) -> list:
+        return [stats.summary() for stats in self.stats]
+
+def get_live_source(ports: list, record_path: str|None = None) -> LivePortSource:
+    # ports from settings.json, none - the default port
+    return MultiPortSource(ports, record_path) if ports else LivePortSource(record_path=record_path)
+
+class MessageListSource(MidiSource):
+    """Replays in-memory messages, message time is the delta in seconds from the previous one (like mido plays files).
+    speed 1 - original timing, N - N times faster, 0 - as fast as possible."""
+
+    def __init__(self, signals: list, speed: float = 1):
+        self.signals = signals
+        self.speed = speed
+        self.closed = False
+
+    def open(self, callback):
+        self.callback = callback
+        self.closed = False
+        self.thread = threading.Thread(target=self.replay, daemon=True)
+        self.thread.start()
+        return self
+
+    def replay(self):
+        start = perf_counter()
+        position = 0
+        for signal in self.signals:
+            if self.closed:
+                return
+            position += signal.time
+            if self.speed:
+                sleep(max(0, start + position / self.speed - perf_counter()))
+            # receiver takes over the message (arrival time is written into it)
+            self.callback(signal.copy())
+
+    def close(self):
+        self.closed = True
+
+class MidiFileSource(MessageListSource):
+    """Replays a recorded .mid file, all tracks merged as mido plays them."""
+
+    def __init__(self, path: str, speed: float = 1):
+        signals = []
+        delay = 0  # time of skipped meta messages is carried over to the next message
+        for signal in mido.MidiFile(path):
+            delay += signal.time
+            if not signal.is_meta:
+                signals.append(signal.copy(time=delay))
+                delay = 0
+        super().__init__(signals, speed)
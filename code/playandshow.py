@@ -1,19 +1,204 @@
-import mido
 import pygame
+from time import perf_counter
 from commons import exception_catcher
+from tracelog import TRACE
+from latency import LatencyMonitor
+from midiinput import MidiReader, PitchwheelCoalescer, MidiSource, LivePortSource
+from fretboardstate import FretboardState
 
 MARGIN_X = 40
 MARGIN_Y = 80
+MIDI_EVENT = pygame.USEREVENT + 1   # posted by the MIDI reader to wake up the visualizer loop
+CONTROL_EVENT = pygame.USEREVENT + 2   # change made in the app while playing, kind is one of:
+SCALE_CONTROL = 'scale'  # root_note, scale_type, first_fret, last_fret
+SETTINGS_CONTROL = 'settings'  # the settings file was saved
+LATENCY_HUD_KEY = pygame.K_F3
+TRACE_DUMP_KEY = pygame.K_F9
+LATENCY_CSV_PATH = 'data/latency.csv'
 
 class NoInputException(Exception):
     """Raise when cannot open MIDO input"""
 
+class DirtyRegions():
+    """Collects screen rectangles changed since the last presented frame."""
+
+    def __init__(self):
+        self.rects = []
+        self.frames = 0
+        self.total_rects = 0
+        self.total_pixels = 0
+        self.last_rects = 0
+        self.last_pixels = 0
+
+    def add(self, rect: pygame.Rect):
+        self.rects.append(pygame.Rect(rect))
+
+    def merged(self) -> list:
+        # overlapping regions are pushed once - markers and string bands often overlap
+        merged = []
+        for rect in self.rects:
+            idx = rect.collidelist(merged)
+            while idx != -1:
+                rect = rect.union(merged.pop(idx))
+                idx = rect.collidelist(merged)
+            merged.append(rect)
+        return merged
+
+    def present(self, screen_rect: pygame.Rect):
+        rects = [rect.clip(screen_rect) for rect in self.merged()]
+        rects = [rect for rect in rects if rect.width and rect.height]
+        if rects:
+            pygame.display.update(rects)
+        self.last_rects = len(rects)
+        self.last_pixels = sum(rect.width * rect.height for rect in rects)
+        self.frames += 1
+        self.total_rects += self.last_rects
+        self.total_pixels += self.last_pixels
+        self.rects = []
+
+    def summary(self) -> str:
+        frames = self.frames or 1
+        return f'[DIRTY RECTS] frames: {self.frames}, rects/frame: {self.total_rects / frames:.1f}, ' \
+               f'pixels/frame: {self.total_pixels / frames:.0f}'
+
+class LayerCache():
+    """Offscreen surfaces of the parts of a Visualizer frame which change only with the inputs or settings.
+    Kept by the Visualizer while it runs, invalidated when the app changes the scale or saves the settings."""
+    MAX_ENTRIES = 4
+
+    def __init__(self):
+        self.layers = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple, build) -> dict:
+        if key in self.layers:
+            self.hits += 1
+            return self.layers[key]
+        self.misses += 1
+        if len(self.layers) >= self.MAX_ENTRIES:
+            del self.layers[next(iter(self.layers))]
+        self.layers[key] = build()
+        return self.layers[key]
+
+    def invalidate(self):
+        self.layers.clear()
+
+class GlyphCache():
+    """Rendered text surfaces keyed by (text, font size, colour), so steady-state frames do no font rasterisation."""
+    MAX_ENTRIES = 256
+
+    def __init__(self):
+        self.fonts = {}
+        self.glyphs = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_font(self, size: int) -> pygame.font.Font:
+        if size not in self.fonts:
+            self.fonts[size] = pygame.font.Font(pygame.font.get_default_font(), size)
+        return self.fonts[size]
+
+    def render(self, text: str, size: int, color) -> pygame.Surface:
+        key = (text, size, color if isinstance(color, str) else tuple(color))
+        if (glyph := self.glyphs.get(key)) is not None:
+            self.hits += 1
+            return glyph
+        self.misses += 1
+        if len(self.glyphs) >= self.MAX_ENTRIES:
+            del self.glyphs[next(iter(self.glyphs))]
+        glyph = self.glyphs[key] = self.get_font(size).render(text, False, color)
+        return glyph
+
+    def summary(self) -> str:
+        return f'[GLYPH CACHE] glyphs: {len(self.glyphs)}, hits: {self.hits}, misses: {self.misses}'
+
+class PianoKeySprites():
+    """Piano keys rendered once into an atlas - white and black, unpressed and pressed - so a key is drawn
+    with one blit. Destinations and dirty rects of the keys are computed once per keyboard, in the same
+    pixels as pygame.Rect gives for the float key positions."""
+
+    def __init__(self, piano, margin_y: int):
+        white = pygame.Rect(0, 0, piano.white_key_width, piano.white_key_length)
+        black = pygame.Rect(0, 0, piano.black_key_width, piano.black_key_length)
+        # white sprites include the outline drawn 1px outside the key
+        self.atlas = pygame.Surface((2 * (white.width + 2) + 2 * black.width, white.height + 2)).convert()
+        self.areas = {}
+        x = 0
+        for pressed in (False, True):
+            self.areas[piano.w, pressed] = self.draw_white_key(pygame.Rect(x + 1, 1, white.width, white.height), pressed)
+            x += white.width + 2
+        for pressed in (False, True):
+            area = pygame.Rect(x, 0, black.width, black.height)
+            pygame.draw.rect(self.atlas, color='black' if not pressed else 'red', rect=area, border_radius=1)
+            self.areas[piano.b, pressed] = area
+            x += black.width
+        self.keys = list(piano.sorted_keys)  # white keys first, black keys are drawn over them
+        self.key_rects = {}  # key number -> key rect grown by the outline, the dirty region of the key
+        self.sprites = {}  # key number -> ((destination, area) unpressed, (destination, area) pressed)
+        for key in self.keys:
+            key_type = piano.keys[key]['type']
+            rect = pygame.Rect(MARGIN_X + piano.keys[key]['x_pos'], margin_y,
+                               white.width if key_type == piano.w else black.width,
+                               white.height if key_type == piano.w else black.height)
+            destination = (rect.x - 1, rect.y - 1) if key_type == piano.w else rect.topleft
+            self.sprites[key] = tuple((destination, self.areas[key_type, pressed]) for pressed in (False, True))
+            self.key_rects[key] = rect.inflate(4, 4)
+        self.rects = list(self.key_rects.values())  # in the order of self.keys, for collidelistall
+        self.base_blits = [(self.atlas, *self.sprites[key][False]) for key in self.keys]
+
+    def draw_white_key(self, rect: pygame.Rect, pressed: bool) -> pygame.Rect:
+        pygame.draw.rect(self.atlas, color='white' if not pressed else 'red', rect=rect, border_radius=1)
+        # outline as 4 bars 2px wide, the inner pixels cover the edge of the key
+        outline = rect.inflate(2, 2)
+        for bar in (pygame.Rect(outline.x, outline.y, outline.width, 2),
+                    pygame.Rect(outline.x, outline.bottom - 2, outline.width, 2),
+                    pygame.Rect(outline.x, outline.y, 2, outline.height),
+                    pygame.Rect(outline.right - 2, outline.y, 2, outline.height)):
+            self.atlas.fill('black', bar)
+        return outline
+
+class FrameScheduler():
+    """Paces rendering: pending MIDI is drained first, then a frame is rendered at most once per display interval
+    (or right after draining in immediate mode) and skipped when nothing changed."""
+
+    def __init__(self, target_fps: int, immediate: bool = False):
+        self.frame_interval = 1 / target_fps
+        self.immediate = immediate
+        self.next_frame_time = perf_counter()
+        self.rendered_frames = 0
+        self.skipped_frames = 0
+
+    def frame_due(self, changed: bool) -> bool:
+        now = perf_counter()
+        if now < self.next_frame_time and not (self.immediate and changed):
+            return False
+        self.next_frame_time = now + self.frame_interval
+        if changed:
+            self.rendered_frames += 1
+        else:
+            self.skipped_frames += 1
+        return changed
+
+    def get_wait_timeout(self, changed: bool) -> int:
+        # milliseconds for pygame.event.wait, 0 waits for the next event (MIDI or window)
+        if not changed:
+            return 0
+        return max(1, int((self.next_frame_time - perf_counter()) * 1000) + 1)
+
+    def summary(self) -> str:
+        return f'[FRAMES] rendered: {self.rendered_frames}, skipped: {self.skipped_frames}'
+
 class Visualizer():
 
     @exception_catcher    
     def __init__(self, settings_client, size: tuple, show_guitar: bool, show_piano: bool,
                  guitar, piano, first_fret: int, last_fret: int, scale_type: str, max_bend: float,
-                 reduce_bends: bool):
+                 reduce_bends: bool, layer_cache: LayerCache|None=None, target_fps: int = 60,
+                 immediate_rendering: bool = False, dump_latency_csv: bool = False,
+                 midi_source: MidiSource|None = None, note_state=None, state_publisher=None):
+        # note_state - FretboardState updated here by default, or a view of the state kept by another process
+        # state_publisher - statestream.StatePublisher the shown state is sent to after every frame
         self.settings_client = settings_client
         self.size = size
         self.guitar = guitar
@@ -24,21 +209,19 @@ class Visualizer():
         self.show_guitar = show_guitar
         self.show_piano = show_piano
         self.MAX_BEND = max_bend
-        self.MAX_PITCH_SHIFT = 6000 # 2730
-        self.ONE_STEP_PITCH = [-4095, 4096]
+        self.fretboard_state = note_state if note_state is not None else FretboardState(self.guitar, self.piano)
+        self.MAX_PITCH_SHIFT = self.fretboard_state.MAX_PITCH_SHIFT
+        self.ONE_STEP_PITCH = self.fretboard_state.ONE_STEP_PITCH
         self.BEND_PER_1_PITCH = self.MAX_BEND / self.MAX_PITCH_SHIFT
-        self.intervals = self.settings_client.constants['scale_types'][scale_type]['intervals']
-        self.guitar_notes_to_show = {}
+        # views of a note state kept elsewhere (note_state) get no MIDI messages here
+        self.pitchwheel_coalescer = PitchwheelCoalescer(self.ONE_STEP_PITCH,
+                                                        getattr(self.fretboard_state, 'feeds_hammer_on', None))
+        self.midi_reader = MidiReader(wake=lambda: pygame.event.post(pygame.event.Event(MIDI_EVENT)))
+        self.intervals = self.settings_client.scale_index.get_scale_intervals(scale_type)
+        # per-string records, indexed by string number
+        self.guitar_strings = self.fretboard_state.strings
         self.recude_bends = reduce_bends
-        '''
-        {(string number) 1:{
-            "fret": 5,
-            "interval": "p4",
-            "bend": 2730
-            }
-        }
-        '''
-        self.piano_keys_to_show = set()
+        self.piano_keys_to_show = self.fretboard_state.piano_keys
         # self.guitar_intervals_to_cover_up = []
         self.LABELED_FRET_TEXT_Y = float(self.guitar.FRETBOARD_WIDTH + self.guitar.TEXT_MARGIN/2)
         self.MIDDLE_FRET_Y = self.guitar.FRETBOARD_WIDTH / 2
@@ -64,23 +247,45 @@ class Visualizer():
             for fret in self.guitar.FRET_DICT
         }
 
-        self.GUITAR_STRING_WIDTH_DICT = {string: int(0.5 + 0.5*string) for string in range(1,7)}        
-        self.INTERVALS_TO_SHOW = []
-        for string in self.settings_client.constants['guitar_strings']:
-            string_number = self.settings_client.constants['guitar_strings'][string]['number']
-            for fret in range(int(first_fret), int(last_fret)+1):
-                note = self.settings_client.constants['guitar_strings'][string]['frets'][fret]
-                interval = self.guitar.assigned_intervals[str(note)]
-                if interval in self.intervals:
-                    self.INTERVALS_TO_SHOW.append((fret, interval, string_number))
+        self.GUITAR_STRING_WIDTH_DICT = {string: int(0.5 + 0.5*string) for string in range(1, self.guitar.STRING_NUMBER+1)}
+        self.INTERVALS_TO_SHOW = self.get_intervals_to_show()
         
         pygame.font.init()
-        self.fret_font = pygame.font.Font(pygame.font.get_default_font(), 16)
-        self.interval_font = pygame.font.Font(pygame.font.get_default_font(), 
-                self.settings_client.settings['interval_font_size'] + 5) #pygame is smaller than tkinter.....
+        self.FRET_FONT_SIZE = 16
+        self.FRET_FONT_COLOR = (144, 144, 144)
+        self.INTERVAL_FONT_SIZE = self.settings_client.settings['interval_font_size'] + 5 #pygame is smaller than tkinter.....
+        self.INTERVAL_SYMBOLS = self.settings_client.constants['all_intervals']
+        self.glyph_cache = GlyphCache()
+        # pre-warm, so the first played note is not a latency spike
+        for interval, symbol in self.INTERVAL_SYMBOLS.items():
+            self.glyph_cache.render(symbol, self.INTERVAL_FONT_SIZE,
+                                    self.settings_client.settings['interval_color'][interval]['font'])
+        for fret in self.guitar.LABELED_FRETS:
+            self.glyph_cache.render(str(fret), self.FRET_FONT_SIZE, self.FRET_FONT_COLOR)
         self.fret_range = range(self.first_fret, self.last_fret+1)
+        # state drawn in the last presented frame and what changed since, to find dirty regions
+        self.drawn_guitar_notes = {string: None for string in range(1, self.guitar.STRING_NUMBER+1)}
+        self.drawn_piano_keys = set()
+        self.changed_strings = 0
+        self.changed_keys = set()
+        self.dirty_regions = DirtyRegions()
+        self.layer_cache = layer_cache if layer_cache is not None else LayerCache()
+        self.frame_scheduler = FrameScheduler(target_fps, immediate_rendering)
+        self.latency_monitor = LatencyMonitor()
+        self.midi_source = midi_source or LivePortSource()
+        self.dump_latency_csv = dump_latency_csv
+        self.state_publisher = state_publisher
+        self.show_latency_hud = False
+        self.LATENCY_HUD_REFRESH = 0.5  # seconds
+        self.latency_hud_updated_at = 0
         self.run()
 
+    @exception_catcher
+    def get_intervals_to_show(self) -> list:
+        return [(fret, interval, string_number) for fret, interval, string_number
+                in self.guitar.get_scale_markers(self.guitar.root_note, self.scale_type)
+                if int(self.first_fret) <= fret <= int(self.last_fret)]
+
     @exception_catcher
     def no_midi_input(self, screen, fill_color):
         font_color = 'black' if not self.settings_client.settings['dark_theme'] else 'white'
@@ -93,9 +298,8 @@ class Visualizer():
         pygame.display.flip()
         running = True
         while running:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
+            if pygame.event.wait().type == pygame.QUIT:
+                running = False
         pygame.quit()      
 
     @exception_catcher
@@ -106,10 +310,10 @@ class Visualizer():
         icon = pygame.image.load('data/seeMidi.ico')
         pygame.display.set_icon(icon)        
         fill_color = 'black' if self.settings_client.settings['dark_theme'] else 'white'
+        self.fill_color = fill_color
         self.piano_margin_y = 0
         self.run_instruments(screen, fill_color)
 
-    @exception_catcher
     def draw_guitar_base(self, screen: pygame.surface):
         pygame.draw.rect(screen, self.settings_client.settings['guitar_neck_color'], 
                          pygame.Rect(MARGIN_X, MARGIN_Y, self.guitar.FRETBOARD_LENGTH, self.guitar.FRETBOARD_WIDTH))
@@ -124,8 +328,8 @@ class Visualizer():
                              (self.GUITAR_FRET_DICT[fret]['x1'], self.GUITAR_FRET_DICT[fret]['y1']),
                              width=3)
             
-        for fret in self.settings_client.constants['frets_labeled']:
-            surface = self.fret_font.render(str(fret), False, (144, 144, 144))
+        for fret in self.guitar.LABELED_FRETS:
+            surface = self.glyph_cache.render(str(fret), self.FRET_FONT_SIZE, self.FRET_FONT_COLOR)
             screen.blit(surface, (
                     self.GUITAR_FRET_DICT[fret]['middle_x'],
                     MARGIN_Y + self.LABELED_FRET_TEXT_Y
@@ -144,15 +348,14 @@ class Visualizer():
             pygame.draw.circle(screen, self.settings_client.settings['guitar_dots_color'],
                 (middle_point[0], middle_point[1] + self.guitar.DOT_SIZE*5), self.guitar.DOT_SIZE)     
 
-    @exception_catcher
-    def draw_guitar_strings(self, screen):
-        for string in range(1, self.guitar.STRING_NUMBER+1):
+    def draw_guitar_strings(self, screen, strings=None):
+        for string in strings or range(1, self.guitar.STRING_NUMBER+1):
             # string_y = self.guitar.STRING_DICT[string]['coords']['y0'] + MARGIN_Y
             string_y = self.GUITAR_STRING_DICT[string]['y0']
-            if bend_val := self.guitar_notes_to_show.get(string,{}).get('bend'):
+            if bend_val := self.guitar_strings[string].bend:
                 # last string bends in other direction
                 bend_y = (1 if string==1 else -1) * self.BEND_PER_1_PITCH * bend_val + string_y 
-                bend_x = self.GUITAR_FRET_DICT[self.guitar_notes_to_show.get(string,{}).get('fret')]['middle_x']
+                bend_x = self.GUITAR_FRET_DICT[self.guitar_strings[string].fret]['middle_x']
                 pygame.draw.line(screen, self.settings_client.settings['guitar_strings_color'], 
                                 (self.START_STRING_X, string_y),
                                 (bend_x, bend_y),
@@ -167,88 +370,250 @@ class Visualizer():
                                 (self.END_STRING_X, string_y),
                                 width=self.GUITAR_STRING_WIDTH_DICT[string])
 
-    @exception_catcher
-    def show_fretboard(self, screen):
+    def show_fretboard(self, screen, strings=None):
         for fret, interval, string in self.INTERVALS_TO_SHOW:
-            self.draw_interval(screen, fret, interval, string)
+            if strings is None or string in strings:
+                self.draw_interval(screen, fret, interval, string)
 
-    @exception_catcher
     def draw_interval(self, screen, fret: int, interval: str, 
                       string_number:int|None=None, is_played: bool=False):
         color = self.settings_client.settings['interval_color'][interval]['bg'] if not is_played else 'red'
         middle_x = self.GUITAR_FRET_DICT[fret]['middle_x']
         interval_y = self.GUITAR_STRING_DICT[string_number]['y0']        
-        if self.guitar_notes_to_show.get(string_number,{}).get('bend') and \
-            self.guitar_notes_to_show.get(string_number,{}).get('fret') == fret:
-            interval_y += self.BEND_PER_1_PITCH * self.guitar_notes_to_show.get(string_number,{}).get('bend') * (1 if string_number == 1 else -1)
+        string = self.guitar_strings[string_number]
+        if string.bend and string.fret == fret:
+            interval_y += self.BEND_PER_1_PITCH * string.bend * (1 if string_number == 1 else -1)
             
         pygame.draw.circle(screen, color,
                            (middle_x, interval_y),
                            radius=self.settings_client.settings['interval_label_radius'])
         
         if fret in self.fret_range and interval in self.intervals:
-            surface = self.interval_font.render(
-                self.settings_client.constants['all_intervals'][interval].encode('cp1252').decode(),
-                    False, self.settings_client.settings['interval_color'][interval]['font'])
+            surface = self.glyph_cache.render(self.INTERVAL_SYMBOLS[interval], self.INTERVAL_FONT_SIZE,
+                                              self.settings_client.settings['interval_color'][interval]['font'])
             surface_rect = surface.get_rect()
             surface_rect.center = (middle_x, interval_y)
             screen.blit(surface, surface_rect)        
 
-    @exception_catcher
     def update_guitar(self, screen):
         self.draw_guitar_base(screen)
         self.draw_guitar_strings(screen)
         self.show_fretboard(screen)        
-        for string_num, note in self.guitar_notes_to_show.items():
-            self.draw_interval(screen, fret=note['fret'],
-                                interval=note['interval'], string_number=string_num, is_played=True)                             
+        for string_num, note in self.fretboard_state.get_played_strings():
+            self.draw_interval(screen, fret=note.fret,
+                                interval=note.interval, string_number=string_num, is_played=True)                             
 
-    @exception_catcher
     def update_piano(self, screen):
         self.draw_piano_base(screen)
-        drawn = 0
-        for white_key in filter(lambda x: x in self.piano.WHITE_KEYS_NBRS, self.piano_keys_to_show):
-            self.draw_piano_key(screen, self.piano.keys[white_key]['type'],
-                                            self.piano.keys[white_key]['x_pos'],
-                                            pressed=True)
+        pressed_keys = self.piano_keys_to_show
+        for white_key in self.piano.WHITE_KEYS.intersection(pressed_keys):
+            self.draw_piano_key(screen, white_key, pressed=True)
             self.draw_overlapping_piano_keys(screen, white_key)
-            drawn +=1
-        for black_key in filter(lambda x: x in self.piano.BLACK_KEYS_NBRS, self.piano_keys_to_show):
-            self.draw_piano_key(screen, self.piano.keys[black_key]['type'],
-                                            self.piano.keys[black_key]['x_pos'],
-                                            pressed=True)
-            drawn +=1
+        for black_key in self.piano.BLACK_KEYS.intersection(pressed_keys):
+            self.draw_piano_key(screen, black_key, pressed=True)
 
-    @exception_catcher
     def draw_piano_base(self, screen):
-        for key, values in self.piano.sorted_keys.items():
-            self.draw_piano_key(screen, values['type'], values['x_pos'])
+        screen.blits(self.piano_sprites.base_blits, doreturn=False)
+
+    def draw_piano_key(self, screen, key_number: int, pressed: bool = False):
+        screen.blit(self.piano_sprites.atlas, *self.piano_sprites.sprites[key_number][pressed])
 
+    def draw_overlapping_piano_keys(self, screen, key_number):
+        # pressed white key covers the edges of the black keys next to it
+        for neighbour in (key_number-1, key_number+1):
+            if neighbour in self.piano.BLACK_KEYS:
+                self.draw_piano_key(screen, neighbour, pressed=neighbour in self.piano_keys_to_show)
+
+    #region layers
     @exception_catcher
-    def draw_piano_key(self, screen, key_type: str, x_pos: float|int, pressed: bool = False):        
-        if key_type == self.piano.w:
-            rect = pygame.draw.rect(screen, color='white' if not pressed else 'red',
-                             rect=pygame.Rect(MARGIN_X+x_pos, self.piano_margin_y, 
-                            self.piano.white_key_width, self.piano.white_key_length),
-                            border_radius=1)
-            outline = rect.inflate(2, 2)
-            pygame.draw.rect(screen, 'black', outline, 2)
+    def get_layers_key(self) -> tuple:
+        settings = self.settings_client.settings
+        return (
+            self.guitar.root_note, self.guitar.tuning, self.guitar.FRETS_NUMBER,
+            self.scale_type, self.first_fret, self.last_fret,
+            tuple(self.size), self.show_guitar, self.show_piano, self.piano.piano_range, self.piano_margin_y,
+            self.fill_color,
+            tuple(settings[element] for element in ('guitar_neck_color', 'guitar_dots_color', 'guitar_frets_color',
+                                                    'guitar_strings_color', 'fret_zero_color')),
+            tuple((interval, colors['bg'], colors['font']) for interval, colors in settings['interval_color'].items()),
+            settings['interval_label_radius'], settings['interval_font_size']
+        )
+
+    @exception_catcher
+    def build_layers(self) -> dict:
+        '''
+        'base': background, guitar neck with frets, dots and fret numbers, unpressed piano keys
+        'static': 'base' with straight strings and the scale markers - the frame when nothing is played
+        '''
+        base = pygame.Surface(self.size).convert()
+        base.fill(self.fill_color)
+        if self.show_guitar:
+            self.draw_guitar_base(base)
+        if self.show_piano:
+            self.draw_piano_base(base)
+        static = base.copy()
+        if self.show_guitar:
+            # built before any note is played, so strings are straight and markers not moved by bends
+            self.draw_guitar_strings(static)
+            self.show_fretboard(static)
+        return {'base': base, 'static': static}
+    #endregion
+
+    #region dirty regions
+    def get_string_band_rect(self, string_number: int) -> pygame.Rect:
+        # the whole string moves while bending, so the band covers the maximum bend in both directions
+        r = self.settings_client.settings['interval_label_radius']
+        half_height = self.MAX_BEND + r + self.GUITAR_STRING_WIDTH_DICT[string_number] + 2
+        string_y = self.GUITAR_STRING_DICT[string_number]['y0']
+        return pygame.Rect(MARGIN_X - r - 1, string_y - half_height,
+                           self.guitar.FRETBOARD_LENGTH + 2*r + 2, 2*half_height + 1)
+
+    def get_fret_cell_rect(self, string_number: int, fret: int) -> pygame.Rect:
+        r = self.settings_client.settings['interval_label_radius']
+        middle_x = self.GUITAR_FRET_DICT[fret]['middle_x']
+        string_y = self.GUITAR_STRING_DICT[string_number]['y0']
+        return pygame.Rect(middle_x - r - 2, string_y - r - 2, 2*r + 5, 2*r + 5)
+
+    def get_piano_key_rect(self, key_number: int) -> pygame.Rect:
+        # white key outline is drawn 1px outside the key
+        return self.piano_sprites.key_rects[key_number]
+
+    def get_guitar_dirty_rects(self) -> list:
+        # drawn and current notes are (fret, interval, bend) snapshots
+        rects = []
+        for string in range(1, self.guitar.STRING_NUMBER+1):
+            if not self.changed_strings >> string & 1:
+                continue
+            drawn = self.drawn_guitar_notes[string]
+            current = self.guitar_strings[string].snapshot()
+            if drawn == current:
+                continue
+            if drawn and drawn[2] or current and current[2]:
+                rects.append(self.get_string_band_rect(string))
+                continue
+            for note in (drawn, current):
+                if note:
+                    rects.append(self.get_fret_cell_rect(string, note[0]))
+        return rects
+
+    def get_piano_dirty_rects(self) -> list:
+        return [self.get_piano_key_rect(key) for key in self.changed_keys
+                if (key in self.drawn_piano_keys) != (key in self.piano_keys_to_show) and key in self.piano.sorted_keys]
+
+    def redraw_guitar_rect(self, screen, rect: pygame.Rect) -> pygame.Rect:
+        strings = [string for string in range(1, self.guitar.STRING_NUMBER+1)
+                   if self.get_string_band_rect(string).colliderect(rect)]
+        if any(self.guitar_strings[string].bend for string in strings):
+            # clipped sloped lines are rasterized differently, so bent strings are always redrawn whole
+            rect = rect.unionall([self.get_string_band_rect(string) for string in range(1, self.guitar.STRING_NUMBER+1)
+                                  if self.guitar_strings[string].bend])
+            strings = [string for string in range(1, self.guitar.STRING_NUMBER+1)
+                       if self.get_string_band_rect(string).colliderect(rect)]
+        screen.set_clip(rect)
+        if any(self.guitar_strings[string].bend for string in strings):
+            screen.blit(self.layers['base'], rect, rect)
+            self.draw_guitar_strings(screen, strings)
+            self.show_fretboard(screen, strings)
         else:
-            pygame.draw.rect(screen, color='black' if not pressed else 'red',
-                             rect=pygame.Rect(MARGIN_X+x_pos, self.piano_margin_y, 
-                            self.piano.black_key_width, self.piano.black_key_length),
-                            border_radius=1)            
-    
+            screen.blit(self.layers['static'], rect, rect)
+        for string_num in strings:
+            note = self.guitar_strings[string_num]
+            if note.note is not None:
+                self.draw_interval(screen, fret=note.fret,
+                                   interval=note.interval, string_number=string_num, is_played=True)
+        screen.set_clip(None)
+        return rect
+
+    def redraw_piano_rect(self, screen, rect: pygame.Rect):
+        keys = [self.piano_sprites.keys[idx] for idx in rect.collidelistall(self.piano_sprites.rects)]
+        pressed_keys = self.piano_keys_to_show
+        screen.set_clip(rect)
+        screen.blit(self.layers['static'], rect, rect)
+        # same order as full redraw: pressed white keys, then black keys over them
+        for key in keys:
+            if key in pressed_keys and key in self.piano.WHITE_KEYS:
+                self.draw_piano_key(screen, key, pressed=True)
+        for key in keys:
+            if key in self.piano.BLACK_KEYS:
+                self.draw_piano_key(screen, key, pressed=key in pressed_keys)
+        screen.set_clip(None)
+
+    def draw_latency_hud(self, screen):
+        # space above the instruments
+        rect = pygame.Rect(MARGIN_X, 0, self.size[0] - 2*MARGIN_X, MARGIN_Y - 4)
+        screen.set_clip(rect)
+        screen.blit(self.layers['static'], rect, rect)
+        if self.show_latency_hud:
+            font_color = 'black' if not self.settings_client.settings['dark_theme'] else 'white'
+            lines = ['input to display latency (F3 hides)'] + self.latency_monitor.get_lines()
+            for idx, line in enumerate(lines):
+                surface = self.glyph_cache.get_font(14).render(line, False, font_color)
+                screen.blit(surface, (rect.x + (idx // 4) * 420, rect.y + 4 + (idx % 4) * 18))
+        screen.set_clip(None)
+        self.dirty_regions.add(rect)
+        self.latency_hud_updated_at = perf_counter()
+
     @exception_catcher
-    def draw_overlapping_piano_keys(self, screen, key_number):
-        if self.piano.keys[key_number-1]['type'] == self.piano.b:                            
-            self.draw_piano_key(screen, self.piano.b,
-                                self.piano.keys[key_number-1]['x_pos'],
-                                pressed=key_number-1 in self.piano_keys_to_show)
-        if self.piano.keys[key_number+1]['type'] == self.piano.b:                            
-            self.draw_piano_key(screen, self.piano.b,
-                                self.piano.keys[key_number+1]['x_pos'],
-                                pressed=key_number+1 in self.piano_keys_to_show)
+    def toggle_latency_hud(self, screen):
+        self.show_latency_hud = not self.show_latency_hud
+        self.draw_latency_hud(screen)
+        self.dirty_regions.present(screen.get_rect())
+
+    @exception_catcher
+    def dump_trace(self):
+        # the result is shown in the window caption, the console may not be visible
+        if (path := TRACE.dump()) is not None:
+            pygame.display.set_caption(f'Visualizing - trace dumped to {path}')
+        else:
+            pygame.display.set_caption(f'Visualizing - trace is off, set {TRACE.ENV_VAR} to one of {TRACE.LEVELS}')
+
+    @exception_catcher
+    def has_changes(self) -> bool:
+        return any(self.changed_strings >> string & 1 and
+                   self.guitar_strings[string].snapshot() != self.drawn_guitar_notes[string]
+                   for string in range(1, self.guitar.STRING_NUMBER+1)) or \
+               any((key in self.drawn_piano_keys) != (key in self.piano_keys_to_show) for key in self.changed_keys)
+
+    def mark_drawn(self):
+        for string in range(1, self.guitar.STRING_NUMBER+1):
+            if self.changed_strings >> string & 1:
+                self.drawn_guitar_notes[string] = self.guitar_strings[string].snapshot()
+        self.drawn_piano_keys = set(self.piano_keys_to_show)
+        self.changed_strings = 0
+        self.changed_keys.clear()
+
+    @exception_catcher
+    def render_changes(self, screen):
+        # the drawing functions it calls are not wrapped (that costs a call per marker or key),
+        # their errors abort the frame and are reported by the exception_catcher of render_changes
+        try:
+            if self.show_guitar:
+                redrawn = []
+                for rect in self.get_guitar_dirty_rects():
+                    # bent strings grow the redrawn rect, it can cover the next ones already
+                    if not any(redrawn_rect.contains(rect) for redrawn_rect in redrawn):
+                        redrawn.append(self.redraw_guitar_rect(screen, rect))
+                        self.dirty_regions.add(redrawn[-1])
+            if self.show_piano:
+                for rect in self.get_piano_dirty_rects():
+                    self.redraw_piano_rect(screen, rect)
+                    self.dirty_regions.add(rect)
+            self.latency_monitor.drawn()
+            if self.show_latency_hud and perf_counter() - self.latency_hud_updated_at > self.LATENCY_HUD_REFRESH:
+                self.draw_latency_hud(screen)
+            self.dirty_regions.present(screen.get_rect())
+            self.latency_monitor.displayed()
+            self.publish_state()
+        finally:
+            # a failed frame is not rendered again on every loop pass, has_changes() is false until new input
+            self.mark_drawn()
+
+    @exception_catcher
+    def publish_state(self):
+        if self.state_publisher is not None:
+            self.state_publisher.publish(self.guitar_strings, self.fretboard_state.held_notes,
+                                         (self.guitar.root_note, self.scale_type, self.first_fret, self.last_fret))
+    #endregion
 
     @exception_catcher
     def show_bored_screen(self, screen, fill_color):
@@ -262,140 +627,163 @@ class Visualizer():
         pygame.display.flip()
         running = True
         while running:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
+            if pygame.event.wait().type == pygame.QUIT:
+                running = False
         pygame.quit()      
 
+    @exception_catcher
+    def ingest(self):
+        batch = self.pitchwheel_coalescer.coalesce(self.midi_reader.drain())
+        for signal in batch:
+            TRACE.debug('%s', signal)
+            changed_strings, changed_keys = self.fretboard_state.update(signal)
+            self.changed_strings |= changed_strings
+            self.changed_keys.update(changed_keys)
+        self.latency_monitor.ingested(batch)
+
+    def get_input_lines(self) -> list:
+        return [self.midi_reader.summary(), *self.midi_source.get_port_lines(), self.pitchwheel_coalescer.summary()]
+
+    @exception_catcher
+    def set_scale(self, screen, root_note: str, scale_type: str, first_fret: int, last_fret: int):
+        # root, scale or fret range changed while playing - new layers and a full frame
+        self.guitar.show_fretboard(root_note, self.settings_client.scale_index.get_scale_name(scale_type),
+                                   first_fret, last_fret)
+        self.scale_type, self.first_fret, self.last_fret = scale_type, int(first_fret), int(last_fret)
+        self.intervals = self.settings_client.scale_index.get_scale_intervals(scale_type)
+        self.INTERVALS_TO_SHOW = self.get_intervals_to_show()
+        self.fret_range = range(self.first_fret, self.last_fret+1)
+        self.fretboard_state.set_midi_intervals(self.guitar.MIDI_INTERVALS)
+        self.redraw(screen)
+
+    @exception_catcher
+    def reload_settings(self, screen):
+        # settings saved in the app while playing - colours, theme, label radius and font size are shown now,
+        # tuning, frets number and piano range when the visuals are started again
+        self.settings_client.settings = self.settings_client.load_settings()
+        self.fill_color = 'black' if self.settings_client.settings['dark_theme'] else 'white'
+        self.INTERVAL_FONT_SIZE = self.settings_client.settings['interval_font_size'] + 5
+        self.redraw(screen)
+
+    @exception_catcher
+    def redraw(self, screen):
+        self.layers = self.layer_cache.get(self.get_layers_key(), self.build_layers)
+        screen.blit(self.layers['static'], (0, 0))
+        # nothing is drawn over the new static frame yet
+        self.drawn_guitar_notes = dict.fromkeys(self.drawn_guitar_notes)
+        self.drawn_piano_keys = set()
+        self.changed_strings = (1 << (self.guitar.STRING_NUMBER+1)) - 2
+        self.changed_keys.update(self.piano_keys_to_show)
+        if self.show_latency_hud:
+            self.draw_latency_hud(screen)
+        self.render_changes(screen)
+        pygame.display.flip()
+
     @exception_catcher
     def run_instruments(self, screen, fill_color):
         #region prepare 
         running = True
         if self.show_guitar and self.show_piano:
             self.piano_margin_y = MARGIN_Y*2 + self.guitar.FRETBOARD_WIDTH            
-            def x():
-                self.update_guitar(screen)
-                self.update_piano(screen)
-            update_what_needs_to_be = x
-        elif self.show_guitar:
-            def x():
-                self.update_guitar(screen)
-            update_what_needs_to_be = x
         elif self.show_piano:
             self.piano_margin_y = MARGIN_Y
-            def x():
-                self.update_piano(screen)
-            update_what_needs_to_be = x
-        else:
+        elif not self.show_guitar:
             running = False
             self.show_bored_screen(screen, fill_color)            
         if running:
             try:
-                inport = mido.open_input()
+                inport = self.midi_source.open(self.midi_reader.receive)
             except OSError:
                 self.no_midi_input(screen, fill_color)
                 return        
-            screen.fill(fill_color)
-            update_what_needs_to_be()
+            if self.show_piano:
+                self.piano_sprites = PianoKeySprites(self.piano, self.piano_margin_y)
+            self.layers = self.layer_cache.get(self.get_layers_key(), self.build_layers)
+            screen.blit(self.layers['static'], (0, 0))
             pygame.display.flip()
-            prev_signal = mido.Message(type='note_on')
+            self.publish_state()
         #endregion            
 
         while running:
-            for event in pygame.event.get():
+            # block until MIDI arrives, the window is closed or the next frame is due
+            events = [pygame.event.wait(self.frame_scheduler.get_wait_timeout(self.has_changes()))]
+            for event in events + pygame.event.get():
                 if event.type == pygame.QUIT:
                     running = False
                     inport.close()
                     break
-            for signal in inport.iter_pending():
-                print(signal)
-                if signal.channel < 0 or signal.channel > 5:
-                    continue
-                string_number = signal.channel + 1
-                if signal.type == 'note_on': 
-                    if signal.note not in self.piano.MIDI_INFO_DICT:
-                        continue                   
-                    piano_key_number = self.piano.MIDI_INFO_DICT[signal.note]
-                    in_guitar_range = signal.note in self.guitar.MIDI_INFO_DICT[string_number]
-                    if in_guitar_range:       
-                        fret_number = self.guitar.MIDI_INFO_DICT[string_number][signal.note]['fret_number']
-                        interval = self.guitar.MIDI_INFO_DICT[string_number][signal.note]['interval']
-                    if signal.velocity > 0:
-                        if note := self.guitar_notes_to_show.get(string_number):
-                            try: self.piano_keys_to_show.remove(self.piano.MIDI_INFO_DICT[note.get('note')])
-                            except: pass
-                        if in_guitar_range:
-                            self.guitar_notes_to_show[string_number] = {'fret': fret_number, 'interval': interval, 'note': signal.note}
-                        self.piano_keys_to_show.add(piano_key_number)
-                    else:
-                        try:
-                            if self.guitar_notes_to_show.get(string_number,{}).get('note') == signal.note:
-                                del self.guitar_notes_to_show[string_number]
-                        except:
-                            pass
-                        try: self.piano_keys_to_show.remove(piano_key_number)
-                        except: pass
-                elif signal.type == 'note_off':
-                    print(f'[NOTE OFF]: {signal}\t\tcurrent:{self.guitar_notes_to_show.get(string_number)}')
-                    piano_key_number = self.piano.MIDI_INFO_DICT.get(signal.note)
-                    note = self.guitar_notes_to_show.get(string_number,{}).get('note')
-                    if note == signal.note or \
-                        note in range(signal.note-1, signal.note+2):
-                            # prev_signal.type == 'pitchwheel' and \
-                        try: del self.guitar_notes_to_show[string_number] 
-                        except: pass
-                        try: self.piano_keys_to_show.remove(self.piano.MIDI_INFO_DICT.get(note))
-                        except: pass
+                if event.type == pygame.KEYDOWN and event.key == LATENCY_HUD_KEY:
+                    self.toggle_latency_hud(screen)
+                if event.type == pygame.KEYDOWN and event.key == TRACE_DUMP_KEY:
+                    self.dump_trace()
+                if event.type == CONTROL_EVENT:
+                    # the app changed an input, layers are rendered again
+                    self.layer_cache.invalidate()
+                    if event.kind == SETTINGS_CONTROL:
+                        self.reload_settings(screen)
                     else:
-                        print(f'[NOTE OFF WTF] {signal}\t\t{note}')
-
-                    try: self.piano_keys_to_show.remove(piano_key_number)
-                    except: pass
-                elif signal.type == 'pitchwheel':                    
-                    if note := self.guitar_notes_to_show.get(string_number):
-                        fret_number = note['fret']
-                        interval = note['interval']
-                        d = self.guitar_notes_to_show[string_number]   
-                        hammer_on = False           
-                        if signal.pitch == 0 and prev_signal.type == 'pitchwheel' and prev_signal.pitch in self.ONE_STEP_PITCH:
-                            hammer_on = True
-                            if prev_signal.pitch == self.ONE_STEP_PITCH[0]:                            
-                                side = 1 # up
-                            elif prev_signal.pitch == self.ONE_STEP_PITCH[1]:
-                                side = -1 # down                            
-
-                        if fret_number > 0 and signal.pitch in self.ONE_STEP_PITCH and \
-                            (prev_signal.type != 'pitchwheel' or prev_signal.type == 'pitchwheel' and prev_signal.pitch == 0):
-                            hammer_on = True
-                            if signal.pitch == self.ONE_STEP_PITCH[0]:                            
-                                side = -1 # down
-                            elif signal.pitch == self.ONE_STEP_PITCH[1]:
-                                side = 1 # up
-                        if hammer_on:
-                            try:
-                                self.guitar_notes_to_show[string_number] = {'fret': d['fret']+1*side, 
-                                                                    'interval': self.guitar.MIDI_INFO_DICT[string_number][d['note']+1*side]['interval'], 
-                                                                    'note': d['note']+1*side}
-                                piano_key_number = self.piano.MIDI_INFO_DICT[d['note']]
-                                self.piano_keys_to_show.add(piano_key_number + 1*side)
-                                self.piano_keys_to_show.remove(piano_key_number) if piano_key_number in self.piano_keys_to_show else None
-                                update_what_needs_to_be()
-                                pygame.display.flip()
-                                prev_signal = signal
-                                continue
-                            except:
-                                pass    
-                        if signal.pitch < 0:
-                            pitch = 0
-                        elif signal.pitch > self.MAX_PITCH_SHIFT:
-                            pitch = self.MAX_PITCH_SHIFT
-                        else:
-                            pitch = signal.pitch
-                        self.guitar_notes_to_show[string_number] = {'fret': fret_number, 'interval': interval, 
-                                                            'bend': pitch, 'note': self.guitar_notes_to_show[string_number].get('note')}
-                if not self.guitar_notes_to_show and self.piano_keys_to_show:                    
-                    self.piano_keys_to_show.clear()
-                update_what_needs_to_be()
-                pygame.display.flip()
-                prev_signal = signal
-        pygame.quit()
\ No newline at end of file
+                        self.set_scale(screen, event.root_note, event.scale_type, event.first_fret, event.last_fret)
+            self.ingest()
+            # everything pending is in the note state now, draw it once per frame
+            changed = self.has_changes()
+            if self.frame_scheduler.frame_due(changed):
+                self.render_changes(screen)
+            elif not changed:
+                self.latency_monitor.discard_pending()
+        for line in self.get_input_lines():
+            TRACE.info(line)
+        TRACE.info(self.frame_scheduler.summary())
+        TRACE.info(self.dirty_regions.summary())
+        TRACE.info(self.glyph_cache.summary())
+        for line in self.latency_monitor.get_lines():
+            TRACE.info('[LATENCY] %s', line)
+        if self.state_publisher is not None:
+            self.state_publisher.close()
+            TRACE.info(self.state_publisher.summary())
+        TRACE.dump(reason='when the visuals were closed')
+        if self.dump_latency_csv:
+            self.latency_monitor.dump_csv(LATENCY_CSV_PATH,
+                                          target_fps=round(1 / self.frame_scheduler.frame_interval),
+                                          immediate_rendering=int(self.frame_scheduler.immediate),
+                                          show_guitar=int(self.show_guitar), show_piano=int(self.show_piano))
+        pygame.quit()
+
+class SharedStateVisualizer(Visualizer):
+    """Visualizer of the note state kept by another process in shared memory (visualprocess.py).
+    midi_source announces batches with the arrival times of their messages, the note view is synced
+    once per batch, so latency is still measured from the MIDI arrival."""
+
+    def ingest(self):
+        arrivals = self.midi_source.drain()
+        changed_strings, changed_keys = self.fretboard_state.sync()
+        self.changed_strings |= changed_strings
+        self.changed_keys.update(changed_keys)
+        self.latency_monitor.ingested(arrivals)
+
+    def get_input_lines(self) -> list:
+        return self.midi_source.get_port_lines()
+
+class StreamVisualizer(Visualizer):
+    """Viewer mode - shows the state stream of visuals on another screen (statestream.py), no MIDI device is needed.
+    midi_source receives the packets and the note view applies them, root, scale and fret range follow the stream."""
+    stream_scale = None  # the last one applied
+
+    def ingest(self):
+        packets = self.midi_source.drain()
+        changed_strings, changed_keys = self.fretboard_state.apply(packets)
+        self.changed_strings |= changed_strings
+        self.changed_keys.update(changed_keys)
+        self.latency_monitor.ingested(packets)
+        scale = self.fretboard_state.scale
+        if scale is not None and scale != self.stream_scale:
+            self.stream_scale = scale
+            root_note, scale_type, first_fret, last_fret = scale
+            constants = self.settings_client.constants
+            if root_note not in constants['all_notes'] or scale_type not in constants['scale_types']:
+                TRACE.info('[STATE VIEW] scale %s %s of the stream is not known here', root_note, scale_type)
+                return
+            self.set_scale(pygame.display.get_surface(), root_note, scale_type,
+                           min(first_fret, self.guitar.FRETS_NUMBER), min(last_fret, self.guitar.FRETS_NUMBER))
+
+    def get_input_lines(self) -> list:
+        return [*self.midi_source.get_port_lines(), self.fretboard_state.summary()]
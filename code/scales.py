@@ -0,0 +1,40 @@
+class ScaleIndex():
+    """Intervals of all root notes and scale types, built lazily and kept for the session.
+    Notes are identified by their index in constants['all_notes_grouped'] (0 - C), so enharmonic names share entries.
+    Localized scale names are mapped both ways, set_strings() has to be called when the language changes."""
+
+    def __init__(self, constants: dict, strings: dict):
+        self.constants = constants
+        self.NOTES_NUMBER = len(constants['all_notes_grouped'])
+        self.note_indexes = {name: idx for idx, group in enumerate(constants['all_notes_grouped']) for name in group}
+        self.scale_intervals = {}  # scale type -> frozenset of intervals
+        self.scale_codes = {}  # scale type -> frozenset of interval codes (semitones from the root note)
+        self.set_strings(strings)
+
+    def set_strings(self, strings: dict):
+        self.scale_names = {scale_type: strings[scale_type] for scale_type in self.constants['scale_types']}
+        self.scale_types = {name: scale_type for scale_type, name in self.scale_names.items()}
+
+    def get_note_index(self, note_name: str) -> int:
+        return self.note_indexes[note_name]
+
+    def get_scale_type(self, scale_name: str) -> str:
+        # localized name -> key of constants['scale_types']
+        return self.scale_types[scale_name]
+
+    def get_scale_name(self, scale_type: str) -> str:
+        return self.scale_names[scale_type]
+
+    def get_scale_names(self) -> list:
+        return list(self.scale_names.values())
+
+    def get_scale_intervals(self, scale_type: str) -> frozenset:
+        if scale_type not in self.scale_intervals:
+            self.scale_intervals[scale_type] = frozenset(self.constants['scale_types'][scale_type]['intervals'])
+        return self.scale_intervals[scale_type]
+
+    def get_scale_codes(self, scale_type: str) -> frozenset:
+        if scale_type not in self.scale_codes:
+            intervals = list(self.constants['all_intervals'])
+            self.scale_codes[scale_type] = frozenset(intervals.index(interval) for interval in self.get_scale_intervals(scale_type))
+        return self.scale_codes[scale_type]
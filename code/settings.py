@@ -1,5 +1,8 @@
 from json import load, dump
 from commons import exception_catcher
+from tracelog import TRACE
+from scales import ScaleIndex
+from startuptrace import STARTUP_TRACE
 
 import tkinter as tk
 import ttkbootstrap as tb
@@ -15,13 +18,29 @@ class Settings:
     def __init__(self, app):
         self.app = app
         self.SETTINGS_PATH = 'config/settings.json'
-        with open(self.SETTINGS_PATH) as f:
-            self.settings = load(f)        
-        with open('config/strings.json') as f:
-            self.all_strings = load(f)
-        self.strings = self.all_strings[self.settings['language']]
-        with open('config/constants.json') as f:
-            self.constants = load(f)        
+        self.DEFAULT_SETTINGS_PATH = 'config/default_settings.json'
+        self.settings = self.load_settings()
+        self.STRINGS_PATH = 'config/strings.json'
+        self.DEFAULT_STRINGS_PATH = 'config/default_strings.json'
+        self.strings = self.load_strings(self.settings['language'])
+        self.constants = self.load_config('config/constants.json')
+        self.scale_index = ScaleIndex(self.constants, self.strings)
+
+    def load_config(self, path: str):
+        with STARTUP_TRACE.measure(f'load {path}'), open(path, encoding='utf-8') as f:
+            return load(f)
+
+    def load_settings(self) -> dict:
+        # settings added after the file was saved (by an older version) come from the defaults
+        return {**self.load_config(self.DEFAULT_SETTINGS_PATH), **self.load_config(self.SETTINGS_PATH)}
+
+    def load_strings(self, language: str) -> dict:
+        # only the active language is kept, the others are read when the language is changed
+        strings = self.load_config(self.STRINGS_PATH)[language]
+        if self.STRINGS_PATH != self.DEFAULT_STRINGS_PATH:
+            # the same for strings added after the file was saved
+            strings = {**self.load_config(self.DEFAULT_STRINGS_PATH)[language], **strings}
+        return strings
 
     @exception_catcher
     def set_color_interval(self, parameter: str):
@@ -56,6 +75,45 @@ class Settings:
         if self.settings['show_piano_on_start'] != self.check_state_show_piano.get():
             anything_changed = True
             self.settings['show_piano_on_start'] = self.check_state_show_piano.get()
+        if self.settings['tuning'] != self.tuning_combobox.get():
+            anything_changed = True
+            self.settings['tuning'] = self.tuning_combobox.get()
+        if self.settings['frets_number'] != self.frets_number.get():
+            anything_changed = True
+            self.settings['frets_number'] = self.frets_number.get()
+        if self.settings['piano_range'] != self.piano_range_combobox.get():
+            anything_changed = True
+            self.settings['piano_range'] = self.piano_range_combobox.get()
+        from midiinput import parse_channel_map
+        midi_ports = [{'name': name, 'channel_map': parse_channel_map(widgets['channel_map'].get())}
+                      for name, widgets in self.port_widgets.items() if widgets['check_state'].get()]
+        if self.settings['midi_ports'] != midi_ports:
+            anything_changed = True
+            self.settings['midi_ports'] = midi_ports
+        if self.settings['target_fps'] != self.target_fps.get():
+            anything_changed = True
+            self.settings['target_fps'] = self.target_fps.get()
+        if self.settings['immediate_rendering'] != self.check_state_immediate_rendering.get():
+            anything_changed = True
+            self.settings['immediate_rendering'] = self.check_state_immediate_rendering.get()
+        if self.settings['dump_latency_csv'] != self.check_state_dump_latency_csv.get():
+            anything_changed = True
+            self.settings['dump_latency_csv'] = self.check_state_dump_latency_csv.get()
+        if self.settings['record_sessions'] != self.check_state_record_sessions.get():
+            anything_changed = True
+            self.settings['record_sessions'] = self.check_state_record_sessions.get()
+        if self.settings['replay_speed'] != self.replay_speed.get():
+            anything_changed = True
+            self.settings['replay_speed'] = self.replay_speed.get()
+        if self.settings['stream_state'] != self.check_state_stream_state.get():
+            anything_changed = True
+            self.settings['stream_state'] = self.check_state_stream_state.get()
+        from statestream import parse_address
+        stream_address = self.stream_address.get().strip()
+        parse_address(stream_address)
+        if self.settings['stream_address'] != stream_address:
+            anything_changed = True
+            self.settings['stream_address'] = stream_address
         # if self.settings['reduce_bends'] != self.check_state_reduce_bends.get():
         #     anything_changed = True
         #     self.settings['reduce_bends'] = self.check_state_reduce_bends.get()            
@@ -78,7 +136,8 @@ class Settings:
         if self.settings['language'] != lang_code:            
             anything_changed = True
             self.settings['language'] = lang_code
-            self.strings = self.all_strings[lang_code]                            
+            self.strings = self.load_strings(lang_code)
+            self.scale_index.set_strings(self.strings)
         if anything_changed:
             with open(self.SETTINGS_PATH, 'w') as f:
                 dump(self.settings, f)
@@ -93,19 +152,17 @@ class Settings:
     def revert_to_default(self):
         mb = Messagebox.yesno(self.strings['ask_revert_to_default'], self.strings['revert_to_default'])
         if mb == 'Yes':
-            with open('config/default_settings.json') as f:
-                self.settings = load(f)        
-            with open('config/default_strings.json') as f:
-                self.all_strings = load(f)
-            self.strings = self.all_strings[self.settings['language']]            
-            with open(self.SETTINGS_PATH) as f:
-                current_settings_json = load(f)
+            self.settings = self.load_config(self.DEFAULT_SETTINGS_PATH)
+            self.STRINGS_PATH = self.DEFAULT_STRINGS_PATH
+            self.strings = self.load_strings(self.settings['language'])
+            self.scale_index.set_strings(self.strings)
+            current_settings_json = self.load_settings()
             with open(self.SETTINGS_PATH, 'w') as f:
                 dump(self.settings, f)
             try:
                 self.app.update_app()
             except Exception as ex:
-                print(f'Cannot open app after reverting to default, exception: {ex}. Restoring previous settings.')
+                TRACE.error('Cannot open app after reverting to default, exception: %s. Restoring previous settings.', ex)
                 with open(self.SETTINGS_PATH, 'w') as f:
                     dump(current_settings_json, f)
                 self.settings = current_settings_json
@@ -139,6 +196,44 @@ class Settings:
         lang_frame.grid(padx=padx, pady=pady, row=window_row)
         window_row += 1
 
+        tuning_frame = tb.Labelframe(scroll_frame, text=self.strings['tuning'])
+        self.tuning_combobox = tb.Combobox(tuning_frame, width=20, state='readonly',
+                                           values=list(self.constants['tunings']))
+        self.tuning_combobox.set(self.settings['tuning'])
+        self.tuning_combobox.grid(row=0, columnspan=2, padx=padx, pady=pady)
+        tb.Label(tuning_frame, text=self.strings['frets_number']).grid(row=1, column=0, padx=padx, pady=pady)
+        self.frets_number = tk.IntVar(value=self.settings['frets_number'])
+        frets_number_input = tb.Spinbox(tuning_frame, from_=12, to=30, textvariable=self.frets_number, state='readonly')
+        frets_number_input.grid(row=1, column=1, padx=padx, pady=pady)
+        tuning_frame.grid(padx=padx, pady=pady, row=window_row)
+        window_row += 1
+
+        piano_range_frame = tb.Labelframe(scroll_frame, text=self.strings['piano_range'])
+        self.piano_range_combobox = tb.Combobox(piano_range_frame, width=20, state='readonly',
+                                                values=list(self.constants['piano_ranges']))
+        self.piano_range_combobox.set(self.settings['piano_range'])
+        self.piano_range_combobox.grid(padx=padx, pady=pady)
+        piano_range_frame.grid(padx=padx, pady=pady, row=window_row)
+        window_row += 1
+
+        from midiinput import get_input_port_names, format_channel_map  # mido is imported when the window is opened
+        ports_frame = tb.Labelframe(scroll_frame, text=self.strings['midi_ports'])
+        tb.Label(ports_frame, text=self.strings['midi_ports_info']).grid(row=0, columnspan=2, padx=padx, pady=pady)
+        tb.Label(ports_frame, text=self.strings['channel_map']).grid(row=1, column=1, padx=padx, pady=pady)
+        configured_ports = {port['name']: port for port in self.settings['midi_ports']}
+        self.port_widgets = {}
+        # unplugged ports stay on the list while they are configured
+        for row, name in enumerate(dict.fromkeys(get_input_port_names() + list(configured_ports)), start=2):
+            check_state = tk.IntVar(value=int(name in configured_ports))
+            tb.Checkbutton(ports_frame, bootstyle="round-toggle", variable=check_state,
+                           text=name).grid(row=row, column=0, padx=padx, pady=pady, sticky='w')
+            channel_map_input = tb.Entry(ports_frame, width=20)
+            channel_map_input.insert(0, format_channel_map(configured_ports.get(name, {}).get('channel_map', {})))
+            channel_map_input.grid(row=row, column=1, padx=padx, pady=pady)
+            self.port_widgets[name] = {'check_state': check_state, 'channel_map': channel_map_input}
+        ports_frame.grid(padx=padx, pady=pady, row=window_row)
+        window_row += 1
+
         self.radius_size = tk.IntVar(value=self.settings['interval_label_radius'])        
         radius_frame = tb.Labelframe(scroll_frame, text=self.strings['interval_label_radius'])
         radius_input = tb.Spinbox(radius_frame, from_=3, to=25, textvariable=self.radius_size, state='readonly')        
@@ -162,6 +257,41 @@ class Settings:
         show_on_start_frame.grid(padx=padx, pady=pady, row=window_row)
         window_row += 1         
 
+        visualization_frame = tb.Labelframe(scroll_frame, text=self.strings['visualization'])
+        tb.Label(visualization_frame, text=self.strings['target_fps']).grid(row=0, column=0, padx=padx, pady=pady)
+        self.target_fps = tk.IntVar(value=self.settings['target_fps'])
+        target_fps_input = tb.Spinbox(visualization_frame, from_=10, to=240, increment=10,
+                                      textvariable=self.target_fps, state='readonly')
+        target_fps_input.grid(row=0, column=1, padx=padx, pady=pady)
+        self.check_state_immediate_rendering = tk.IntVar(value=self.settings['immediate_rendering'])
+        immediate_rendering_checkbtn = tb.Checkbutton(visualization_frame, bootstyle="round-toggle", 
+                                variable=self.check_state_immediate_rendering, text=self.strings['immediate_rendering'])
+        immediate_rendering_checkbtn.grid(row=1, columnspan=2, padx=padx*2, pady=pady*2)
+        self.check_state_dump_latency_csv = tk.IntVar(value=self.settings['dump_latency_csv'])
+        dump_latency_csv_checkbtn = tb.Checkbutton(visualization_frame, bootstyle="round-toggle", 
+                                variable=self.check_state_dump_latency_csv, text=self.strings['dump_latency_csv'])
+        dump_latency_csv_checkbtn.grid(row=2, columnspan=2, padx=padx*2, pady=pady*2)
+        tb.Label(visualization_frame, text=self.strings['latency_hud_info']).grid(row=3, columnspan=2, padx=padx, pady=pady)
+        self.check_state_record_sessions = tk.IntVar(value=self.settings['record_sessions'])
+        record_sessions_checkbtn = tb.Checkbutton(visualization_frame, bootstyle="round-toggle", 
+                                variable=self.check_state_record_sessions, text=self.strings['record_sessions'])
+        record_sessions_checkbtn.grid(row=4, columnspan=2, padx=padx*2, pady=pady*2)
+        tb.Label(visualization_frame, text=self.strings['replay_speed']).grid(row=5, column=0, padx=padx, pady=pady)
+        self.replay_speed = tk.IntVar(value=self.settings['replay_speed'])
+        replay_speed_input = tb.Spinbox(visualization_frame, from_=0, to=16, increment=1,
+                                        textvariable=self.replay_speed, state='readonly')
+        replay_speed_input.grid(row=5, column=1, padx=padx, pady=pady)
+        self.check_state_stream_state = tk.IntVar(value=self.settings['stream_state'])
+        stream_state_checkbtn = tb.Checkbutton(visualization_frame, bootstyle="round-toggle",
+                                variable=self.check_state_stream_state, text=self.strings['stream_state'])
+        stream_state_checkbtn.grid(row=6, columnspan=2, padx=padx*2, pady=pady*2)
+        tb.Label(visualization_frame, text=self.strings['stream_address']).grid(row=7, column=0, padx=padx, pady=pady)
+        self.stream_address = tb.Entry(visualization_frame, width=22)
+        self.stream_address.insert(0, self.settings['stream_address'])
+        self.stream_address.grid(row=7, column=1, padx=padx, pady=pady)
+        visualization_frame.grid(padx=padx, pady=pady, row=window_row)
+        window_row += 1
+
         #region intervals
         intervals_frame = tb.Labelframe(scroll_frame, text=self.strings['interval_color'])
         tb.Label(intervals_frame, text=self.strings['interval']).grid(row=0, column=0, padx=padx, pady=pady)
@@ -171,7 +301,7 @@ class Settings:
         self.interval_widgets_dict = {}
         for interval, colors in self.settings['interval_color'].items():
             tb.Label(intervals_frame, 
-                     text=self.constants['all_intervals'][interval].encode('cp1252').decode()
+                     text=self.constants['all_intervals'][interval]
                      ).grid(row=row, column=0, padx=padx, pady=pady)
             self.interval_widgets_dict[interval] = {'bg': {}, 'font':{}}
             self.interval_widgets_dict[interval]['frame1'] = tb.Frame(intervals_frame, bootstyle='dark')
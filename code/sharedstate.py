@@ -0,0 +1,166 @@
+'''
+Note state of FretboardState in shared memory. It is written by the process which ingests MIDI (the app)
+and read in place by the visualizer process (visualprocess.py), one writer and any number of readers.
+Layout, native byte order - the block does not leave the machine:
+    header     sequence number (odd while the writer is in the middle of an update), strings number
+    strings    note, fret, interval code, bend per string number 0..strings number (int16, 0 is unused),
+               SILENT note - the string is not played
+    held       held notes of channels 0-15, then their union - 128-bit bitsets, 16 bytes each (little endian)
+    bends      last pitchwheel of channels 0-15 (int16)
+    pressures  last channel pressure of channels 0-15 (uint8)
+Readers check the sequence number before and after reading and read again when it changed (seqlock),
+so they never see half of an update and the writer never waits for them.
+'''
+import struct
+from multiprocessing import shared_memory
+
+from fretboardstate import FretboardState, StringState
+
+HEADER = struct.Struct('=II')  # sequence number, strings number
+STRING_FIELDS = 4  # note, fret, interval code, bend
+BITSET_SIZE = 16
+CHANNELS = FretboardState.CHANNELS
+SILENT = -1
+
+class SharedNoteState():
+    """Shared memory block of the note state. Without name the block is created, otherwise attached to."""
+
+    def __init__(self, strings_number: int, interval_names: tuple, name: str|None = None):
+        self.STRING_NUMBER = strings_number
+        self.interval_names = interval_names
+        self.interval_codes = {interval: code for code, interval in enumerate(interval_names)}
+        strings_offset = HEADER.size
+        held_offset = strings_offset + 2 * STRING_FIELDS * (strings_number + 1)
+        bends_offset = held_offset + BITSET_SIZE * (CHANNELS + 1)
+        pressures_offset = bends_offset + 2 * CHANNELS
+        self.size = pressures_offset + CHANNELS
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=self.size)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+        buf = self.memory.buf
+        self.header = buf[:HEADER.size].cast('I')
+        self.strings = buf[strings_offset:held_offset].cast('h')
+        self.held = buf[held_offset:bends_offset]
+        self.bends = buf[bends_offset:pressures_offset].cast('h')
+        self.pressures = buf[pressures_offset:self.size]
+        if name is None:
+            self.header[1] = strings_number
+            for string_number in range(strings_number + 1):
+                self.strings[STRING_FIELDS * string_number] = SILENT
+        elif self.header[1] != strings_number:
+            self.close()
+            raise ValueError(f'shared note state {name} has {self.header[1]} strings, not {strings_number}')
+        self.written_held = [0] * (CHANNELS + 1)  # bitsets in the block, so only the changed ones are written
+
+    def write(self, state: FretboardState):
+        header = self.header
+        header[0] += 1
+        strings = self.strings
+        for string_number in range(1, self.STRING_NUMBER+1):
+            string = state.strings[string_number]
+            field = STRING_FIELDS * string_number
+            if string.note is None:
+                strings[field] = SILENT
+                continue
+            strings[field] = string.note
+            strings[field+1] = string.fret
+            strings[field+2] = self.interval_codes[string.interval]
+            strings[field+3] = string.bend
+        for channel, bits in enumerate((*state.held, state.held_notes)):
+            if bits != self.written_held[channel]:
+                self.held[BITSET_SIZE*channel:BITSET_SIZE*(channel+1)] = bits.to_bytes(BITSET_SIZE, 'little')
+                self.written_held[channel] = bits
+        self.bends[:] = state.bends
+        self.pressures[:] = state.pressures
+        header[0] += 1
+
+    def get_sequence(self) -> int:
+        return self.header[0]
+
+    def get_held(self, channel: int|None = None) -> int:
+        # bitset of the channel, of all channels without one, check the sequence number around it
+        index = CHANNELS if channel is None else channel
+        return int.from_bytes(self.held[BITSET_SIZE*index:BITSET_SIZE*(index+1)], 'little')
+
+    def close(self):
+        # views of the buffer have to be released before the block is closed
+        for view in (self.header, self.strings, self.held, self.bends, self.pressures):
+            view.release()
+        self.memory.close()
+
+    def unlink(self):
+        self.memory.unlink()
+
+class SharedNoteView():
+    """Note state read from SharedNoteState, with the part of the FretboardState interface the Visualizer
+    draws from (strings, piano_keys, get_played_strings). sync() reads the changes since the previous sync
+    and returns them as FretboardState.update does: (bitmask of changed strings, tuple of changed piano keys)."""
+    MAX_PITCH_SHIFT = FretboardState.MAX_PITCH_SHIFT
+    ONE_STEP_PITCH = FretboardState.ONE_STEP_PITCH
+    NO_CHANGE = FretboardState.NO_CHANGE
+
+    def __init__(self, shared: SharedNoteState, piano):
+        self.shared = shared
+        self.midi_keys = piano.MIDI_KEYS
+        self.no_key = piano.NO_KEY
+        self.STRING_NUMBER = shared.STRING_NUMBER
+        self.strings = [None] + [StringState() for _ in range(self.STRING_NUMBER)]
+        self.piano_keys = set()
+        self.played = 0
+        self.held_notes = 0
+        self.sequence = 0  # of the last sync
+
+    def get_played_strings(self):
+        for string_number in range(1, self.STRING_NUMBER+1):
+            if self.played >> string_number & 1:
+                yield string_number, self.strings[string_number]
+
+    def set_midi_intervals(self, midi_intervals: list) -> int:
+        # intervals are looked up by the writer
+        return 0
+
+    def sync(self) -> tuple:
+        shared = self.shared
+        fields = shared.strings
+        changed_strings = 0
+        while True:
+            sequence = shared.get_sequence()
+            if sequence == self.sequence:
+                return self.NO_CHANGE
+            if sequence & 1:
+                continue  # the writer takes microseconds
+            for string_number in range(1, self.STRING_NUMBER+1):
+                string = self.strings[string_number]
+                field = STRING_FIELDS * string_number
+                note = fields[field]
+                if note == SILENT:
+                    if string.note is not None:
+                        string.clear()
+                        self.played &= ~(1 << string_number)
+                        changed_strings |= 1 << string_number
+                    continue
+                fret, interval, bend = fields[field+1], shared.interval_names[fields[field+2]], fields[field+3]
+                if (note, fret, interval, bend) != (string.note, string.fret, string.interval, string.bend):
+                    string.set(note, fret, interval, bend)
+                    self.played |= 1 << string_number
+                    changed_strings |= 1 << string_number
+            held_notes = shared.get_held()
+            # the writer was there meanwhile - read again, bits of strings it did not change only cost a check
+            if shared.get_sequence() == sequence:
+                break
+        self.sequence = sequence
+        changed_keys = []
+        for note in FretboardState.get_notes(held_notes ^ self.held_notes):
+            if (key := self.midi_keys[note]) != self.no_key:
+                if held_notes >> note & 1:
+                    self.piano_keys.add(key)
+                else:
+                    self.piano_keys.discard(key)
+                changed_keys.append(key)
+        self.held_notes = held_notes
+        return changed_strings, tuple(changed_keys)
+
+    def close(self):
+        self.shared.close()
@@ -1,20 +1,73 @@
-import mido
 import tkinter as tk
 import ttkbootstrap as tb
-from datetime import datetime, timedelta
+from collections import Counter, deque
+from datetime import datetime
+from time import perf_counter
 
 from commons import exception_catcher
+from tracelog import TRACE
+
+class MessageRates():
+    """Messages per second by channel and message type over the last WINDOW seconds, counted per batch."""
+    WINDOW = 1  # seconds
+    SYSTEM = 'system'  # channel of messages without one (clock, active sensing, sysex)
+
+    def __init__(self):
+        self.started_at = None
+        self.batches = deque()  # (time, Counter of (channel, type))
+        self.counts = Counter()  # sum of the batches in the window
+        self.total = 0
+
+    def add(self, signals: list, now: float):
+        if self.started_at is None:
+            self.started_at = now
+        if signals:
+            batch = Counter((getattr(signal, 'channel', self.SYSTEM), signal.type) for signal in signals)
+            self.batches.append((now, batch))
+            self.counts.update(batch)
+            self.total += len(signals)
+        while self.batches and now - self.batches[0][0] > self.WINDOW:
+            self.counts.subtract(self.batches.popleft()[1])
+        self.counts = +self.counts  # drops the zero counts
+
+    def get_rates(self, now: float) -> dict:
+        # (channel, type) -> messages per second, the window is shorter right after start
+        span = min(self.WINDOW, max(now - self.started_at, 0.1)) if self.started_at is not None else self.WINDOW
+        return {key: count / span for key, count in self.counts.items()}
+
+    def get_lines(self, now: float) -> list:
+        rates = self.get_rates(now)
+        total = sum(rates.values())
+        pitchwheel = sum(rate for (_, signal_type), rate in rates.items() if signal_type == 'pitchwheel')
+        share = pitchwheel / total * 100 if total else 0
+        lines = [f'all channels: {total:.0f} msg/s, pitchwheel: {pitchwheel:.0f}/s ({share:.0f}% of messages), '
+                 f'total messages: {self.total}']
+        by_channel = {}
+        for (channel, signal_type), rate in rates.items():
+            by_channel.setdefault(channel, {})[signal_type] = rate
+        # channels are 0-based in messages, shown 1-based like on the controllers, system messages go last
+        for channel in sorted(by_channel, key=lambda channel: 16 if channel == self.SYSTEM else channel):
+            types = by_channel[channel]
+            name = f'channel {channel+1}' if channel != self.SYSTEM else self.SYSTEM
+            details = ', '.join(f'{signal_type} {rate:.0f}' for signal_type, rate in
+                                sorted(types.items(), key=lambda item: item[1], reverse=True))
+            lines.append(f'{name}: {sum(types.values()):.0f} msg/s - {details}')
+        return lines
 
 class SignalConfig:
-    LOG_NBR_LIMIT = 20
+    LOG_LINES_LIMIT = 200  # older lines are removed from the text box
+    FLUSH_LINES_LIMIT = 40  # lines added per flush, older messages of a batch are only counted
     TIMEOUT = 3
+    FLUSH_INTERVAL_MS = 100   # messages are shown in batches, so the window stays responsive under a flood
+    CAPTURE_PATH = 'data/captures/capture_{:%Y%m%d_%H%M%S}.smcap'
 
     def __init__(self, settings_client):
         self.settings_client = settings_client
-        self.logs = ''
-        self.log_nbr = 0
-        self.running = True        
-    
+        self.running = False
+        self.midi_source = None
+        self.flush_id = None
+        self.capture = None
+
     @exception_catcher
     def start(self):
         padx = 25
@@ -23,63 +76,115 @@ class SignalConfig:
         self.window = tk.Toplevel()
         self.window.resizable(False,False)
         self.window.title(self.settings_client.strings['signal_config'])
-        self.window.geometry('1000x600')
+        self.window.geometry('1000x750')
         self.window.columnconfigure(0, weight=1)
         self.window.columnconfigure(1, weight=1)
 
-        self.textbox = tb.Text(self.window, width=110)
+        self.textbox = tb.Text(self.window, width=110, height=20)
         self.textbox.grid(padx=padx, pady=pady, row=row)
         self.textbox.config(state=tk.DISABLED)
 
         row += 1
-        btn = tb.Button(self.window, command=self.check_signal, text=self.settings_client.strings['check_signal'],
+        rates_frame = tb.Labelframe(self.window, text=self.settings_client.strings['message_rates'])
+        rates_frame.grid(padx=padx, row=row, sticky='we')
+        self.rates_label = tb.Label(rates_frame, justify='left', font=('Courier', 10))
+        self.rates_label.grid(padx=10, pady=10, sticky='w')
+
+        row += 1
+        buttons_frame = tb.Frame(self.window)
+        btn = tb.Button(buttons_frame, command=self.check_signal, text=self.settings_client.strings['check_signal'],
                         bootstyle="default", takefocus=False)
-        btn.grid(row=row)
+        btn.grid(row=0, column=0, padx=padx)
+        self.check_state_capture = tk.IntVar(value=0)
+        tb.Checkbutton(buttons_frame, text=self.settings_client.strings['capture_signals'], bootstyle="default-round-toggle",
+                       variable=self.check_state_capture).grid(row=0, column=1, padx=padx)
+        tb.Button(buttons_frame, command=self.open_capture, text=self.settings_client.strings['open_capture'],
+                  bootstyle="default", takefocus=False).grid(row=0, column=2, padx=padx)
+        buttons_frame.grid(row=row, pady=pady)
         self.window.protocol("WM_DELETE_WINDOW", self.close_window)
         self.window.mainloop()
 
     @exception_catcher
     def check_signal(self):
-        self.running = True
-        timeout = datetime.now() + timedelta(seconds=self.TIMEOUT)
+        from midiinput import MidiReader, get_live_source  # mido is imported only when a signal is checked
+        if self.running:
+            return
+        # messages are queued by the callback on the MIDI backend thread and shown by flush() on the Tk thread
+        self.midi_reader = MidiReader()
+        self.message_rates = MessageRates()
         try:
-            with mido.open_input() as inport:
-                while self.running:
-                    if timeout < datetime.now():
-                        self.running = False
-                        print(f'No signal in {self.TIMEOUT} seconds.')
-                        self.add_log(f'No signal in {self.TIMEOUT} seconds.')
-                        break
-                    try:
-                        for signal in inport.iter_pending():
-                            self.add_log(str(signal))
-                            print(signal)
-                            timeout = datetime.now() + timedelta(seconds=self.TIMEOUT)
-                            if not self.running:
-                                break
-                    except Exception as ex:
-                        print(f'Exception: {ex}')
-                        self.add_log(f'Exception: {ex}')
-                        self.running = False
+            self.midi_source = get_live_source(self.settings_client.settings['midi_ports']).open(self.midi_reader.receive)
         except OSError:
-            self.add_log(self.settings_client.strings['no_signal'])
+            self.add_logs([self.settings_client.strings['no_signal']])
+            return
+        if self.check_state_capture.get():
+            from capture import CaptureWriter
+            self.capture = CaptureWriter(self.CAPTURE_PATH.format(datetime.now()))
+        self.running = True
+        self.last_signal_at = perf_counter()
+        self.flush_id = self.window.after(self.FLUSH_INTERVAL_MS, self.flush)
+
+    @exception_catcher
+    def flush(self):
+        self.flush_id = None
+        if not self.running:
+            return
+        now = perf_counter()
+        signals = self.midi_reader.drain()
+        self.message_rates.add(signals, now)
+        if signals:
+            self.last_signal_at = now
+            if self.capture is not None:
+                self.capture.write(signals)
+            for signal in signals:
+                TRACE.debug('%s', signal)
+            lines = [str(signal) for signal in signals[-self.FLUSH_LINES_LIMIT:]]
+            if len(signals) > self.FLUSH_LINES_LIMIT:
+                lines.insert(0, f'... {len(signals) - self.FLUSH_LINES_LIMIT} more messages')
+            self.add_logs(lines)
+        elif now - self.last_signal_at > self.TIMEOUT:
+            self.add_logs([f'No signal in {self.TIMEOUT} seconds.'])
+            self.stop()
+        rates_lines = self.message_rates.get_lines(now)
+        if self.midi_source is not None:
+            rates_lines.extend(self.midi_source.get_port_lines())
+        if self.midi_reader.dropped:
+            rates_lines.append(f'dropped (queue full): {self.midi_reader.dropped}')
+        self.rates_label.configure(text='\n'.join(rates_lines))
+        if self.running:
+            self.flush_id = self.window.after(self.FLUSH_INTERVAL_MS, self.flush)
 
     @exception_catcher
-    def add_log(self, log: str):
+    def add_logs(self, lines: list):
+        # one insert per batch, then the oldest lines over the limit are removed
         self.textbox.config(state=tk.NORMAL)
-        if self.log_nbr >= self.LOG_NBR_LIMIT:
-            self.log_nbr = 0
-            self.textbox.delete("1.0", tk.END)
-        self.log_nbr += 1
-        self.textbox.insert(tk.END, log + '\n')
+        self.textbox.insert(tk.END, '\n'.join(lines) + '\n')
+        excess = int(self.textbox.index('end-1c').split('.')[0]) - 1 - self.LOG_LINES_LIMIT
+        if excess > 0:
+            self.textbox.delete('1.0', f'{excess+1}.0')
+        self.textbox.see(tk.END)
         self.textbox.config(state=tk.DISABLED)
-        self.window.update()
-        print(f'log added: {log}')
+        TRACE.info('[SIGNAL CONFIG] %s log lines added', len(lines))
 
-    def close_window(self):
-        self.running = False  # turn off while loop
-        self.window.destroy()
-        print( "Window closed")
+    def stop(self):
+        self.running = False
+        if self.flush_id is not None:
+            self.window.after_cancel(self.flush_id)
+            self.flush_id = None
+        if self.midi_source is not None:
+            self.midi_source.close()
+            self.midi_source = None
+        if self.capture is not None:
+            self.capture.close()
+            self.add_logs([f"{self.settings_client.strings['capture_saved']} {self.capture.path}"])
+            self.capture = None
 
+    @exception_catcher
+    def open_capture(self):
+        from captureviewer import CaptureViewer  # mido is imported with it
+        CaptureViewer(self.settings_client).start()
 
-        
\ No newline at end of file
+    def close_window(self):
+        self.stop()
+        self.window.destroy()
+        TRACE.info('[SIGNAL CONFIG] window closed')
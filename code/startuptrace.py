@@ -0,0 +1,81 @@
+import os
+import sys
+from time import perf_counter
+from functools import wraps
+from contextlib import contextmanager
+
+class StartupTrace():
+    """Opt-in wall-clock breakdown of the app startup, enabled with the SEEMIDI_STARTUP_TRACE environment variable
+    or the --startup-trace flag of main.py. The value of the variable (other than 1) or of --startup-trace=<path>
+    is a file the breakdown is written to, otherwise it is printed.
+    Measured parts can be nested, their self time is the total time without the nested parts."""
+    ENV_VAR = 'SEEMIDI_STARTUP_TRACE'
+    FLAG = '--startup-trace'
+
+    def __init__(self, argv: list, environ: dict):
+        self.started_at = perf_counter()
+        self.path = None
+        value = environ.get(self.ENV_VAR, '')
+        self.enabled = value not in ('', '0')
+        if self.enabled and value != '1':
+            self.path = value
+        for arg in argv[1:]:
+            if arg == self.FLAG or arg.startswith(self.FLAG + '='):
+                self.enabled = True
+                self.path = arg.partition('=')[2] or self.path
+        self.finished = False
+        self.records = []  # [name, total seconds, self seconds, depth] in the order the parts started
+        self.stack = []  # records of the parts being measured
+
+    @contextmanager
+    def measure(self, name: str):
+        if not self.enabled or self.finished:
+            yield
+            return
+        record = [name, 0, 0, len(self.stack)]
+        self.records.append(record)
+        self.stack.append(record)
+        started_at = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - started_at
+            self.stack.pop()
+            record[1] += elapsed
+            record[2] += elapsed
+            if self.stack:
+                self.stack[-1][2] -= elapsed
+
+    def traced(self, fun):
+        # decorator, the function is left as it is when the trace is disabled
+        if not self.enabled:
+            return fun
+        @wraps(fun)
+        def decorator(*args, **kwargs):
+            with self.measure(fun.__qualname__):
+                return fun(*args, **kwargs)
+        return decorator
+
+    def get_report(self, total: float) -> str:
+        lines = [f'[STARTUP TRACE] {1000*total:.1f} ms to the first paint of the main window',
+                 f'{"self ms":>10}{"total ms":>10}  part']
+        for name, total_time, self_time, _ in sorted(self.records, key=lambda record: record[2], reverse=True):
+            lines.append(f'{1000*self_time:>10.1f}{1000*total_time:>10.1f}  {name}')
+        untraced = total - sum(record[1] for record in self.records if record[3] == 0)
+        lines.append(f'{1000*untraced:>10.1f}{"":>10}  not measured (interpreter start excluded)')
+        return '\n'.join(lines)
+
+    def finish(self):
+        # called once the main window is painted, later calls of measure() are not recorded
+        if not self.enabled or self.finished:
+            return
+        self.finished = True
+        report = self.get_report(perf_counter() - self.started_at)
+        if self.path:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                f.write(report + '\n')
+            print(f'[STARTUP TRACE] written to {self.path}')
+        else:
+            print(report)
+
+STARTUP_TRACE = StartupTrace(sys.argv, os.environ)
@@ -0,0 +1,405 @@
+'''
+Compact binary stream of the state shown by the Visualizer, so other screens can mirror it (viewer mode).
+The Visualizer publishes at most one packet per rendered frame over UDP - broadcast, or unicast to one host.
+Packet: HEADER (magic, version, kind, stream id - random per publisher, sequence number), then
+    KEYFRAME  strings number, STRING (note, fret, interval code, bend) of every string,
+              held notes as a 128-bit bitset (little endian), the scale
+    DELTA     changes since the packet with the previous sequence number: MASKS (sections, strings with
+              a new note, strings with a new bend), NOTE (note, fret, interval code) of every string of
+              the first mask, BEND of every string of the second one, then the optional sections:
+              KEYS - number of pressed notes and the notes, the same for released ones, SCALE - the scale
+    scale     SCALE (first fret, last fret), root note and scale type as length-prefixed utf-8
+Strings are numbered from 1 (bit n of a mask - string n), the note of a silent string is SILENT.
+A delta of one bent string is 17 bytes, so a bend storm at 60 fps takes about 1 kB/s.
+Deltas carry new values, not differences, so a viewer which missed a packet (a gap in the sequence numbers)
+still applies the next ones and only the changes of the lost packet are missing until the keyframe.
+The keyframe is sent every KEYFRAME_INTERVAL, also when nothing is played, so viewers are back in sync
+within KEYFRAME_INTERVAL after a drop and can join at any time. Packets older than the applied state are ignored.
+Run a viewer from the project directory, no MIDI device is needed:
+    python code/statestream.py [--listen 0.0.0.0:50777] [--show guitar piano]
+'''
+import random
+import socket
+import struct
+import argparse
+import threading
+from collections import deque, namedtuple
+from time import perf_counter, sleep
+
+from fretboardstate import FretboardState, StringState
+from midiinput import MidiSource
+
+MAGIC = b'SM'
+VERSION = 1
+KEYFRAME = 0
+DELTA = 1
+HEADER = struct.Struct('<2sBBHI')  # magic, version, kind, stream id, sequence number
+STRINGS_NUMBER = struct.Struct('<B')
+STRING = struct.Struct('<bBBH')  # note, fret, interval code, bend
+MASKS = struct.Struct('<BHH')  # sections, strings with a new note, strings with a new bend
+NOTE = struct.Struct('<bBB')  # note, fret, interval code
+BEND = struct.Struct('<H')
+SCALE = struct.Struct('<BB')  # first fret, last fret
+KEYS = 1  # delta sections
+SCALE_CHANGED = 2
+BITSET_SIZE = 16
+SILENT = -1
+SILENT_RECORD = (SILENT, 0, 0, 0)
+SEQUENCES = 1 << 32  # sequence numbers wrap around
+KEYFRAME_INTERVAL = 1  # seconds
+DEFAULT_PORT = 50777
+MAX_PACKET_SIZE = 2048
+Packet = namedtuple('Packet', ('type', 'time', 'data'))  # type and arrival time for the latency monitor
+
+def parse_address(text: str, default_host: str = '255.255.255.255') -> tuple:
+    # 'host:port', 'host' or ':port' -> (host, port)
+    host, separator, port = text.strip().rpartition(':')
+    if not separator:
+        host, port = port, ''
+    port = int(port) if port else DEFAULT_PORT
+    if not 0 < port < 65536:
+        raise ValueError(f'UDP port is 1-65535, got {port}')
+    return host or default_host, port
+
+def encode_scale(scale: tuple) -> bytes:
+    root_note, scale_type, first_fret, last_fret = scale
+    data = bytearray(SCALE.pack(first_fret, last_fret))
+    for text in (root_note, scale_type):
+        encoded = text.encode('utf-8')
+        data.append(len(encoded))
+        data += encoded
+    return bytes(data)
+
+def decode_scale(data: bytes, offset: int) -> tuple:
+    # (scale, offset after it)
+    first_fret, last_fret = SCALE.unpack_from(data, offset)
+    offset += SCALE.size
+    texts = []
+    for _ in range(2):
+        length = data[offset]
+        texts.append(bytes(data[offset+1:offset+1+length]).decode('utf-8'))
+        offset += 1 + length
+    return (texts[0], texts[1], first_fret, last_fret), offset
+
+class StatePublisher():
+    """Sends the state the Visualizer shows: publish() after every rendered frame sends a delta when anything
+    changed, a background thread sends the keyframe of the last published state every KEYFRAME_INTERVAL."""
+
+    def __init__(self, address: str, strings_number: int, interval_names: tuple):
+        self.address = parse_address(address)
+        self.STRING_NUMBER = strings_number
+        self.interval_codes = {interval: code for code, interval in enumerate(interval_names)}
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.stream_id = random.getrandbits(16)
+        self.sequence = 0
+        self.records = [None] + [SILENT_RECORD] * strings_number  # published (note, fret, interval code, bend)
+        self.held_notes = 0
+        self.scale = None
+        self.keyframe = None
+        self.deltas = 0
+        self.delta_bytes = 0
+        self.keyframes = 0
+        self.errors = 0
+        self.closed = False
+        threading.Thread(target=self.send_keyframes, daemon=True).start()
+
+    def get_record(self, string: StringState) -> tuple:
+        if string.note is None:
+            return SILENT_RECORD
+        return string.note, string.fret, self.interval_codes[string.interval], string.bend
+
+    def publish(self, strings: list, held_notes: int, scale: tuple):
+        # strings - StringState by string number, scale - (root note, scale type, first fret, last fret)
+        records = [None]
+        noted = bent = 0
+        for string_number in range(1, self.STRING_NUMBER+1):
+            record = self.get_record(strings[string_number])
+            published = self.records[string_number]
+            if record[:3] != published[:3]:
+                noted |= 1 << string_number
+            if record[3] != published[3]:
+                bent |= 1 << string_number
+            records.append(record)
+        toggled = held_notes ^ self.held_notes
+        scale_changed = scale != self.scale
+        if not (noted or bent or toggled or scale_changed):
+            return
+        self.sequence = (self.sequence + 1) % SEQUENCES
+        sections = (KEYS if toggled else 0) | (SCALE_CHANGED if scale_changed else 0)
+        packet = bytearray(HEADER.pack(MAGIC, VERSION, DELTA, self.stream_id, self.sequence))
+        packet += MASKS.pack(sections, noted, bent)
+        for string_number in FretboardState.get_notes(noted):
+            packet += NOTE.pack(*records[string_number][:3])
+        for string_number in FretboardState.get_notes(bent):
+            packet += BEND.pack(records[string_number][3])
+        if toggled:
+            for notes in (FretboardState.get_notes(toggled & held_notes), FretboardState.get_notes(toggled & ~held_notes)):
+                packet.append(len(notes))
+                packet += bytes(notes)
+        if scale_changed:
+            packet += encode_scale(scale)
+        self.records, self.held_notes, self.scale = records, held_notes, scale
+        self.send(packet)
+        self.deltas += 1
+        self.delta_bytes += len(packet)
+        self.keyframe = self.get_keyframe()
+
+    def get_keyframe(self) -> bytes:
+        packet = bytearray(HEADER.pack(MAGIC, VERSION, KEYFRAME, self.stream_id, self.sequence))
+        packet += STRINGS_NUMBER.pack(self.STRING_NUMBER)
+        for record in self.records[1:]:
+            packet += STRING.pack(*record)
+        packet += self.held_notes.to_bytes(BITSET_SIZE, 'little')
+        packet += encode_scale(self.scale)
+        return bytes(packet)
+
+    def send_keyframes(self):
+        while not self.closed:
+            sleep(KEYFRAME_INTERVAL)
+            # the reference is swapped by publish(), a keyframe older than the last delta is ignored by viewers
+            if (keyframe := self.keyframe) is not None and not self.closed:
+                self.send(keyframe)
+                self.keyframes += 1
+
+    def send(self, packet: bytes):
+        # the network going down does not stop the visuals
+        try:
+            self.socket.sendto(packet, self.address)
+        except OSError:
+            self.errors += 1
+
+    def close(self):
+        self.closed = True
+        self.socket.close()
+
+    def summary(self) -> str:
+        mean_size = self.delta_bytes / self.deltas if self.deltas else 0
+        return f'[STATE STREAM] {self.address[0]}:{self.address[1]}: deltas: {self.deltas}, ' \
+               f'mean delta: {mean_size:.1f} B, keyframes: {self.keyframes}, send errors: {self.errors}'
+
+class StateStreamReceiver(MidiSource):
+    """Packets of a state stream, received on a background thread. wake() is called once until they are drained.
+    OSError is raised by open() when the port cannot be bound."""
+    TIMEOUT = 0.5  # seconds, how long close() can wait for the receiving thread
+
+    def __init__(self, address: str, wake=None):
+        self.address = parse_address(address, default_host='0.0.0.0')
+        self.wake = wake
+        self.packets = deque()
+        self.wake_pending = False
+        self.received = 0
+        self.closed = False
+
+    def open(self, callback):
+        # no messages are delivered, the packets are drained by the viewer
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # more viewers on one machine get the broadcast stream
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.settimeout(self.TIMEOUT)
+        try:
+            self.socket.bind(self.address)
+        except OSError:
+            self.socket.close()
+            raise
+        self.thread = threading.Thread(target=self.receive, daemon=True)
+        self.thread.start()
+        return self
+
+    def receive(self):
+        while not self.closed:
+            try:
+                data = self.socket.recv(MAX_PACKET_SIZE)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self.packets.append(Packet('state', perf_counter(), data))
+            self.received += 1
+            if not self.wake_pending:
+                self.wake_pending = True
+                if self.wake:
+                    self.wake()
+
+    def drain(self) -> list:
+        self.wake_pending = False
+        packets = []
+        while self.packets:
+            packets.append(self.packets.popleft())
+        return packets
+
+    def close(self):
+        self.closed = True
+        self.thread.join()
+        self.socket.close()
+
+    def get_port_lines(self) -> list:
+        return [f'[STATE STREAM] {self.address[0]}:{self.address[1]}: packets received: {self.received}']
+
+class StateStreamView():
+    """Note state of a state stream, with the part of the FretboardState interface the Visualizer draws from
+    (strings, piano_keys, get_played_strings). apply(packets) returns the changes as FretboardState.update does.
+    Strings and frets the guitar of the viewer does not have are not shown."""
+    MAX_PITCH_SHIFT = FretboardState.MAX_PITCH_SHIFT
+    ONE_STEP_PITCH = FretboardState.ONE_STEP_PITCH
+    NO_CHANGE = FretboardState.NO_CHANGE
+
+    def __init__(self, guitar, piano):
+        self.interval_names = guitar.INTERVAL_NAMES
+        self.STRING_NUMBER = guitar.STRING_NUMBER
+        self.FRETS_NUMBER = guitar.FRETS_NUMBER
+        self.midi_keys = piano.MIDI_KEYS
+        self.no_key = piano.NO_KEY
+        self.strings = [None] + [StringState() for _ in range(self.STRING_NUMBER)]
+        self.records = {}  # string number -> [note, fret, interval code, bend] of the stream
+        self.piano_keys = set()
+        self.played = 0
+        self.held_notes = 0
+        self.scale = None  # (root note, scale type, first fret, last fret) of the stream
+        self.stream_id = None
+        self.sequence = 0  # of the applied state
+        self.in_sync = False  # no packet is lost since the last keyframe
+        self.applied = 0
+        self.lost = 0  # packets missing from the sequence
+        self.resyncs = 0
+        self.invalid = 0
+
+    def get_played_strings(self):
+        for string_number in range(1, self.STRING_NUMBER+1):
+            if self.played >> string_number & 1:
+                yield string_number, self.strings[string_number]
+
+    def set_midi_intervals(self, midi_intervals: list) -> int:
+        # intervals come with the stream
+        return 0
+
+    def apply(self, packets: list) -> tuple:
+        changed_strings = 0
+        held_notes = self.held_notes
+        for packet in packets:
+            try:
+                changed_strings |= self.apply_packet(packet.data)
+            except (struct.error, IndexError, ValueError):
+                # UnicodeDecodeError is a ValueError too
+                self.invalid += 1
+        changed_strings &= (1 << (self.STRING_NUMBER+1)) - 2
+        for string_number in FretboardState.get_notes(changed_strings):
+            string = self.strings[string_number]
+            note, fret, code, bend = self.records.get(string_number, SILENT_RECORD)
+            if note == SILENT or fret > self.FRETS_NUMBER or code >= len(self.interval_names):
+                string.clear()
+                self.played &= ~(1 << string_number)
+            else:
+                string.set(note, fret, self.interval_names[code], bend)
+                self.played |= 1 << string_number
+        changed_keys = []
+        for note in FretboardState.get_notes(held_notes ^ self.held_notes):
+            if (key := self.midi_keys[note]) != self.no_key:
+                if self.held_notes >> note & 1:
+                    self.piano_keys.add(key)
+                else:
+                    self.piano_keys.discard(key)
+                changed_keys.append(key)
+        return changed_strings, tuple(changed_keys)
+
+    def apply_packet(self, data: bytes) -> int:
+        # changed strings of the stream
+        magic, version, kind, stream_id, sequence = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'not a state stream packet of version {VERSION}')
+        changed_strings = 0
+        if stream_id != self.stream_id:
+            # a new publisher (or the same one started again) begins with nothing played
+            self.stream_id = stream_id
+            self.sequence = 0
+            self.in_sync = kind == DELTA and sequence == 1
+            self.records = {}
+            self.held_notes = 0
+            changed_strings = (1 << (self.STRING_NUMBER+1)) - 2
+        ahead = (sequence - self.sequence) % SEQUENCES
+        if ahead >= SEQUENCES // 2 or ahead == 0 and (kind == DELTA or self.in_sync):
+            return changed_strings  # an older state or the applied one (keyframes repeat the last sequence number)
+        self.sequence = sequence
+        if kind == KEYFRAME:
+            if not self.in_sync:
+                self.in_sync = True
+                self.resyncs += 1
+            return self.apply_keyframe(data)
+        if ahead != 1:
+            # changes of the lost packets are missing until the next keyframe
+            self.lost += ahead - 1
+            self.in_sync = False
+        self.applied += 1
+        return changed_strings | self.apply_delta(data)
+
+    def apply_keyframe(self, data: bytes) -> int:
+        offset = HEADER.size
+        strings_number, = STRINGS_NUMBER.unpack_from(data, offset)
+        offset += STRINGS_NUMBER.size
+        self.records = {}
+        for string_number in range(1, strings_number+1):
+            self.records[string_number] = list(STRING.unpack_from(data, offset))
+            offset += STRING.size
+        self.held_notes = int.from_bytes(data[offset:offset+BITSET_SIZE], 'little')
+        self.scale, _ = decode_scale(data, offset + BITSET_SIZE)
+        return (1 << (self.STRING_NUMBER+1)) - 2
+
+    def apply_delta(self, data: bytes) -> int:
+        offset = HEADER.size
+        sections, noted, bent = MASKS.unpack_from(data, offset)
+        offset += MASKS.size
+        for string_number in FretboardState.get_notes(noted):
+            record = self.records.setdefault(string_number, list(SILENT_RECORD))
+            record[:3] = NOTE.unpack_from(data, offset)
+            offset += NOTE.size
+        for string_number in FretboardState.get_notes(bent):
+            self.records.setdefault(string_number, list(SILENT_RECORD))[3], = BEND.unpack_from(data, offset)
+            offset += BEND.size
+        if sections & KEYS:
+            count = data[offset]
+            for note in data[offset+1:offset+1+count]:
+                self.held_notes |= 1 << note
+            offset += 1 + count
+            count = data[offset]
+            for note in data[offset+1:offset+1+count]:
+                self.held_notes &= ~(1 << note)
+            offset += 1 + count
+        if sections & SCALE_CHANGED:
+            self.scale, offset = decode_scale(data, offset)
+        return noted | bent
+
+    def summary(self) -> str:
+        return f'[STATE VIEW] deltas applied: {self.applied}, packets lost: {self.lost}, ' \
+               f'resyncs: {self.resyncs}, invalid packets: {self.invalid}'
+
+def run_viewer(address: str, show_guitar: bool = True, show_piano: bool = True):
+    # viewer mode, the instruments are built from the settings files and follow the scale of the stream
+    import pygame
+    from settings import Settings
+    from instruments import HeadlessGuitar, HeadlessPiano
+    from playandshow import StreamVisualizer, MIDI_EVENT
+    settings_client = Settings(app=None)
+    pygame.display.init()
+    size = pygame.display.get_desktop_sizes()[0]
+    guitar = HeadlessGuitar(None, size[0], settings_client)
+    piano = HeadlessPiano(None, size[0], settings_client)
+    root_note = settings_client.constants['all_notes'][0]
+    scale_type = next(iter(settings_client.constants['scale_types']))
+    guitar.show_fretboard(root_note, settings_client.scale_index.get_scale_name(scale_type), 0, guitar.FRETS_NUMBER)
+    StreamVisualizer(settings_client=settings_client, size=size, show_guitar=show_guitar, show_piano=show_piano,
+                     guitar=guitar, piano=piano, first_fret=0, last_fret=guitar.FRETS_NUMBER, scale_type=scale_type,
+                     max_bend=guitar.STRING_DISTANCE, reduce_bends=False,
+                     target_fps=settings_client.settings['target_fps'],
+                     immediate_rendering=settings_client.settings['immediate_rendering'],
+                     midi_source=StateStreamReceiver(address, wake=lambda: pygame.event.post(pygame.event.Event(MIDI_EVENT))),
+                     note_state=StateStreamView(guitar, piano))
+
+def main():
+    parser = argparse.ArgumentParser(description='Shows the state stream of See MIDI visuals from another screen.')
+    parser.add_argument('--listen', default=f'0.0.0.0:{DEFAULT_PORT}', help='address:port the stream is sent to')
+    parser.add_argument('--show', nargs='+', choices=('guitar', 'piano'), default=['guitar', 'piano'])
+    args = parser.parse_args()
+    run_viewer(args.listen, 'guitar' in args.show, 'piano' in args.show)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import os
+from collections import deque
+from time import perf_counter
+from datetime import datetime
+
+class TraceLog():
+    """Leveled trace of MIDI messages and app events kept in memory, enabled with the SEEMIDI_TRACE environment
+    variable set to one of LEVELS (every level up to it is recorded). Disabled levels are bound to a no-op
+    and messages are formatted (msg % args) only when the trace is dumped, so tracing costs one call when off.
+    The last RING_SIZE entries are kept, dump() writes them to DUMP_PATH - on demand (F9 in the visualizer)
+    or when exception_catcher reports an error."""
+    ENV_VAR = 'SEEMIDI_TRACE'
+    LEVELS = ('error', 'warning', 'info', 'debug')
+    RING_SIZE = 4096
+    DUMP_PATH = 'data/trace.txt'
+
+    def __init__(self, level: str|None = None):
+        self.started_at = perf_counter()
+        self.entries = deque(maxlen=self.RING_SIZE)  # (time, level, msg, args), appended from any thread
+        self.dropped = 0
+        self.set_level(level)
+
+    def set_level(self, level: str|None):
+        # None or 'off' - nothing is recorded
+        if level not in (None, 'off') and level not in self.LEVELS:
+            raise ValueError(f'Unknown trace level {level}, expected one of {self.LEVELS}')
+        self.level = level if level in self.LEVELS else None
+        self.enabled = self.level is not None
+        enabled_levels = self.LEVELS[:self.LEVELS.index(self.level)+1] if self.enabled else ()
+        for name in self.LEVELS:
+            setattr(self, name, self.get_recorder(name) if name in enabled_levels else self.ignore)
+
+    def get_recorder(self, level: str):
+        entries = self.entries
+        def record(msg: str, *args):
+            if len(entries) == entries.maxlen:
+                self.dropped += 1
+            entries.append((perf_counter(), level, msg, args))
+        return record
+
+    def ignore(self, msg: str, *args):
+        pass
+
+    def get_lines(self) -> list:
+        lines = []
+        for timestamp, level, msg, args in list(self.entries):
+            try:
+                text = msg % args if args else msg
+            except (TypeError, ValueError) as ex:
+                text = f'{msg} {args} (cannot format: {ex})'
+            lines.append(f'{timestamp - self.started_at:12.6f} {level.upper():<7} {text}')
+        return lines
+
+    def dump(self, path: str|None = None, reason: str = 'on demand') -> str|None:
+        if not self.enabled:
+            return None
+        path = path or self.DUMP_PATH
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f'[TRACE] {datetime.now()} dumped {reason}, level: {self.level}, '
+                    f'entries: {len(self.entries)}, dropped: {self.dropped}\n')
+            f.write('\n'.join(self.get_lines()) + '\n')
+        return path
+
+def create_trace(environ: dict) -> TraceLog:
+    # an unknown level in the environment records warnings, the first one says why
+    level = environ.get(TraceLog.ENV_VAR, '').lower() or None
+    if level in (None, 'off') or level in TraceLog.LEVELS:
+        return TraceLog(level)
+    trace = TraceLog('warning')
+    trace.warning('Unknown %s=%s, expected one of %s, the warning level is used', TraceLog.ENV_VAR, level,
+                  TraceLog.LEVELS)
+    return trace
+
+TRACE = create_trace(os.environ)
@@ -0,0 +1,79 @@
+from array import array
+
+class FretboardTables():
+    """Note tables of one tuning and fret count, never changed after they are built. Indexed by string number
+    (first string is the highest one, index 0 is unused) and then by MIDI value 0-127. Notes are indexes
+    of constants['all_notes_grouped'] (0 - C), interval codes are semitones from the root note."""
+    NO_FRET = -1  # MIDI value not on the string
+    NOTES_NUMBER = 12
+    MAX_MARKERS_ENTRIES = 64
+
+    def __init__(self, open_strings: tuple, frets_number: int):
+        self.OPEN_STRINGS = (None,) + open_strings  # MIDI value of every open string
+        self.STRING_NUMBER = len(open_strings)
+        self.FRETS_NUMBER = frets_number
+        self.OPEN_STRING_NOTES = (None,) + tuple(midi_val % self.NOTES_NUMBER for midi_val in open_strings)
+        midi_frets = [None]
+        for open_string in open_strings:
+            frets = array('b', [self.NO_FRET]) * 128
+            for fret in range(min(frets_number, 127 - open_string) + 1):
+                frets[open_string + fret] = fret
+            midi_frets.append(memoryview(frets).toreadonly())
+        self.MIDI_FRETS = tuple(midi_frets)
+        self.midi_intervals = {}  # root note -> interval codes like MIDI_FRETS
+        self.scale_markers = {}  # (root note, interval codes of the scale) -> markers
+
+    def get_midi_intervals(self, root_note_idx: int) -> tuple:
+        if root_note_idx not in self.midi_intervals:
+            midi_intervals = [None]
+            for string_number in range(1, self.STRING_NUMBER+1):
+                intervals = array('b', [0]) * 128
+                for midi_val, fret in enumerate(self.MIDI_FRETS[string_number]):
+                    if fret != self.NO_FRET:
+                        intervals[midi_val] = (midi_val - root_note_idx) % self.NOTES_NUMBER
+                midi_intervals.append(memoryview(intervals).toreadonly())
+            self.midi_intervals[root_note_idx] = tuple(midi_intervals)
+        return self.midi_intervals[root_note_idx]
+
+    def get_scale_markers(self, root_note_idx: int, scale_codes: frozenset) -> tuple:
+        # (fret, interval code, string number) of every scale interval on the fretboard, strings from the first one
+        key = (root_note_idx, scale_codes)
+        if key not in self.scale_markers:
+            if len(self.scale_markers) >= self.MAX_MARKERS_ENTRIES:
+                del self.scale_markers[next(iter(self.scale_markers))]
+            self.scale_markers[key] = tuple(
+                (fret, code, string_number)
+                for string_number in range(1, self.STRING_NUMBER+1)
+                for fret in range(self.FRETS_NUMBER+1)
+                if (code := (self.OPEN_STRING_NOTES[string_number] + fret - root_note_idx) % self.NOTES_NUMBER) in scale_codes
+            )
+        return self.scale_markers[key]
+
+    def get_size(self) -> int:
+        # bytes taken by the MIDI lookup tables
+        return sum(table.nbytes for table in self.MIDI_FRETS[1:]) + \
+               sum(table.nbytes for tables in self.midi_intervals.values() for table in tables[1:])
+
+class TuningCache():
+    """FretboardTables by (open strings, frets number), shared by all guitars. The least recently used are evicted."""
+    MAX_ENTRIES = 8
+
+    def __init__(self):
+        self.tables = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, open_strings: tuple|list, frets_number: int) -> FretboardTables:
+        key = (tuple(open_strings), frets_number)
+        if key in self.tables:
+            self.hits += 1
+            self.tables[key] = self.tables.pop(key)  # most recently used go last
+            return self.tables[key]
+        self.misses += 1
+        if len(self.tables) >= self.MAX_ENTRIES:
+            del self.tables[next(iter(self.tables))]
+        self.tables[key] = FretboardTables(*key)
+        return self.tables[key]
+
+    def summary(self) -> str:
+        return f'[TUNINGS] cached: {len(self.tables)}, hits: {self.hits}, misses: {self.misses}'
@@ -0,0 +1,228 @@
+'''
+Visualizer in a child process, so the Tk window stays responsive while playing and the pygame loop does not
+share the interpreter lock with it. MIDI is ingested in the app process: the source callback queues messages
+(MidiReader), the publisher thread folds them into FretboardState and writes it to SharedNoteState.
+The visualizer process reads the note state in place (sharedstate.py) and is told about every batch through
+a pipe, with the message types and arrival times for its latency monitor (perf_counter is system-wide).
+The same pipe carries scale changes and saved settings from the app while playing. The MIDI source is opened when the
+visualizer window is up, as in the Visualizer, so a replayed file does not start before it is shown.
+'''
+import threading
+import multiprocessing
+from collections import deque, namedtuple
+
+from tracelog import TRACE
+from commons import exception_catcher
+from midiinput import MidiReader, PitchwheelCoalescer, MidiSource
+from fretboardstate import FretboardState
+from sharedstate import SharedNoteState, SharedNoteView
+
+# pipe messages are (kind, payload)
+READY = 'ready'  # visualizer -> app, the window is up
+OPENED = 'opened'  # app -> visualizer, the MIDI source is open
+NO_INPUT = 'no_input'  # app -> visualizer, the MIDI source cannot be opened
+BATCH = 'batch'  # (message type, arrival time) of the messages written to the note state
+SCALE = 'scale'  # (root note, scale type, first fret, last fret)
+SETTINGS = 'settings'  # the settings file was saved, the visualizer reads it again
+Arrival = namedtuple('Arrival', ('type', 'time'))
+
+class VisualizerProcess():
+    """Starts the visualizer process and publishes the note state for it until its window is closed.
+    params - the Visualizer arguments which are not built from the settings files in the child process
+    (size, show_guitar, show_piano, first_fret, last_fret, scale_type, reduce_bends, target_fps,
+    immediate_rendering, dump_latency_csv) and root_note."""
+
+    def __init__(self, guitar, piano, midi_source: MidiSource, params: dict):
+        self.guitar = guitar
+        self.piano = piano
+        self.midi_source = midi_source
+        self.params = params
+        self.wake = threading.Event()
+        self.controls = deque()  # (pipe message, MIDI intervals of the guitar or None), queued by the Tk thread
+        self.process = None
+        self.closed = False
+
+    def start(self):
+        self.note_state = FretboardState(self.guitar, self.piano)
+        self.pitchwheel_coalescer = PitchwheelCoalescer(FretboardState.ONE_STEP_PITCH, self.note_state.feeds_hammer_on)
+        self.midi_reader = MidiReader(wake=self.wake.set)
+        self.shared = SharedNoteState(self.guitar.STRING_NUMBER, self.guitar.INTERVAL_NAMES)
+        # spawn on every platform, the child does not inherit Tk or the MIDI ports
+        context = multiprocessing.get_context('spawn')
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=run_visualizer, args=(self.params, self.shared.name, child_connection),
+                                       name='visualizer', daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.publisher = threading.Thread(target=self.publish, daemon=True)
+        self.publisher.start()
+        threading.Thread(target=self.watch, daemon=True).start()
+        return self
+
+    def is_running(self) -> bool:
+        return self.process is not None and not self.closed
+
+    def set_scale(self, root_note: str, scale_type: str, first_fret: int, last_fret: int):
+        # called after guitar.show_fretboard, the played notes get intervals of the new root
+        self.controls.append(((SCALE, (root_note, scale_type, first_fret, last_fret)), self.guitar.MIDI_INTERVALS))
+        self.wake.set()
+
+    def reload_settings(self):
+        self.controls.append(((SETTINGS, None), None))
+        self.wake.set()
+
+    def publish(self):
+        # the pipe is written by this thread only
+        try:
+            self.connection.recv()  # READY
+            try:
+                self.midi_source.open(self.midi_reader.receive)
+            except OSError:
+                self.connection.send((NO_INPUT, None))
+                return
+            self.connection.send((OPENED, None))
+        except (EOFError, OSError):
+            return  # the visualizer is closed
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            if self.closed:
+                return
+            controls = []
+            # None after an error, it is reported and the messages of the batch are dropped
+            batch = self.ingest(controls) or []
+            if not batch and not controls:
+                continue
+            try:
+                for control in controls:
+                    self.connection.send(control)
+                self.connection.send((BATCH, [(signal.type, signal.time) for signal in batch]))
+            except OSError:
+                return  # the visualizer is closed
+
+    @exception_catcher
+    def ingest(self, controls: list) -> list:
+        # pending controls are moved to controls, so they are still sent when the batch fails
+        while self.controls:
+            control, midi_intervals = self.controls.popleft()
+            controls.append(control)
+            if midi_intervals is not None:
+                self.note_state.set_midi_intervals(midi_intervals)
+        batch = self.pitchwheel_coalescer.coalesce(self.midi_reader.drain())
+        for signal in batch:
+            TRACE.debug('%s', signal)
+            self.note_state.update(signal)
+        if batch or controls:
+            self.shared.write(self.note_state)
+        return batch
+
+    def watch(self):
+        self.process.join()
+        self.stop()
+
+    def stop(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.wake.set()
+        self.publisher.join()
+        self.midi_source.close()
+        self.connection.close()
+        self.shared.close()
+        self.shared.unlink()
+        for line in (self.midi_reader.summary(), *self.midi_source.get_port_lines(),
+                     self.pitchwheel_coalescer.summary()):
+            TRACE.info(line)
+
+class StatePipeSource(MidiSource):
+    """Batches announced by VisualizerProcess, received on a thread of the visualizer process.
+    wake() is called once until the arrivals are drained, control(kind, payload) for every SCALE and SETTINGS."""
+
+    def __init__(self, connection, wake, control):
+        self.connection = connection
+        self.wake = wake
+        self.control = control
+        self.arrivals = deque()
+        self.wake_pending = False
+        self.batches = 0
+        self.received = 0
+
+    def open(self, callback):
+        # no messages are delivered, the note state is read from shared memory
+        self.connection.send((READY, None))
+        try:
+            kind, _ = self.connection.recv()
+        except EOFError:
+            kind = NO_INPUT
+        if kind == NO_INPUT:
+            raise OSError('MIDI input cannot be opened by the app')
+        self.thread = threading.Thread(target=self.receive, daemon=True)
+        self.thread.start()
+        return self
+
+    def receive(self):
+        while True:
+            try:
+                kind, payload = self.connection.recv()
+            except (EOFError, OSError):
+                return  # the app is closed
+            if kind in (SCALE, SETTINGS):
+                self.control(kind, payload)
+                continue
+            self.arrivals.extend(map(Arrival._make, payload))
+            self.batches += 1
+            self.received += len(payload)
+            if not self.wake_pending:
+                self.wake_pending = True
+                self.wake()
+
+    def drain(self) -> list:
+        self.wake_pending = False
+        arrivals = []
+        while self.arrivals:
+            arrivals.append(self.arrivals.popleft())
+        return arrivals
+
+    def close(self):
+        # the receiving thread ends with the pipe
+        self.connection.close()
+
+    def get_port_lines(self) -> list:
+        return [f'[STATE PIPE] batches: {self.batches}, messages: {self.received}']
+
+def run_visualizer(params: dict, shared_name: str, connection):
+    # entry of the visualizer process, the instruments are built again from the settings files
+    import pygame
+    from settings import Settings
+    from instruments import HeadlessGuitar, HeadlessPiano
+    from playandshow import SharedStateVisualizer, MIDI_EVENT, CONTROL_EVENT, SCALE_CONTROL, SETTINGS_CONTROL
+    params = dict(params)
+    root_note = params.pop('root_note')
+    settings_client = Settings(app=None)
+    guitar = HeadlessGuitar(None, params['size'][0], settings_client)
+    piano = HeadlessPiano(None, params['size'][0], settings_client)
+    guitar.show_fretboard(root_note, settings_client.scale_index.get_scale_name(params['scale_type']),
+                          params['first_fret'], params['last_fret'])
+    shared = SharedNoteState(guitar.STRING_NUMBER, guitar.INTERVAL_NAMES, shared_name)
+    state_publisher = None
+    if settings_client.settings['stream_state']:
+        from statestream import StatePublisher
+        state_publisher = StatePublisher(settings_client.settings['stream_address'],
+                                         guitar.STRING_NUMBER, guitar.INTERVAL_NAMES)
+
+    def post_control(kind: str, payload):
+        if kind == SCALE:
+            root_note, scale_type, first_fret, last_fret = payload
+            pygame.event.post(pygame.event.Event(CONTROL_EVENT, kind=SCALE_CONTROL, root_note=root_note,
+                                                 scale_type=scale_type, first_fret=first_fret, last_fret=last_fret))
+        else:
+            pygame.event.post(pygame.event.Event(CONTROL_EVENT, kind=SETTINGS_CONTROL))
+
+    source = StatePipeSource(connection, wake=lambda: pygame.event.post(pygame.event.Event(MIDI_EVENT)),
+                             control=post_control)
+    try:
+        SharedStateVisualizer(settings_client=settings_client, guitar=guitar, piano=piano,
+                              max_bend=guitar.STRING_DISTANCE, midi_source=source,
+                              note_state=SharedNoteView(shared, piano), state_publisher=state_publisher, **params)
+    finally:
+        shared.close()
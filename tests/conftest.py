@@ -0,0 +1,43 @@
+import os
+import sys
+from array import array
+from types import SimpleNamespace
+
+import pytest
+
+# modules of the app import each other from code/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'code'))
+
+from tunings import FretboardTables
+from tracelog import TRACE
+
+E_STANDARD = (64, 59, 55, 50, 45, 40)
+INTERVAL_NAMES = ('R', 'b2', 'd2', 'b3', 'd3', 'p4', 'b5', 'p5', 'b6', 'd6', 'b7', 'd7')
+PIANO_RANGE = (40, 88)  # 49 keys, E2-E6
+NO_KEY = -128
+
+@pytest.fixture
+def guitar():
+    # lookup tables of the Guitar, 24 frets in E standard with C as the root note
+    tables = FretboardTables(E_STANDARD, 24)
+    return SimpleNamespace(STRING_NUMBER=tables.STRING_NUMBER, MIDI_FRETS=tables.MIDI_FRETS,
+                           MIDI_INTERVALS=tables.get_midi_intervals(0), INTERVAL_NAMES=INTERVAL_NAMES,
+                           NO_FRET=FretboardTables.NO_FRET)
+
+@pytest.fixture
+def piano():
+    first_midi_val, last_midi_val = PIANO_RANGE
+    midi_keys = array('b', [NO_KEY]) * 128
+    for key_num, midi_val in enumerate(range(first_midi_val, last_midi_val+1)):
+        midi_keys[midi_val] = key_num
+    return SimpleNamespace(MIDI_KEYS=midi_keys, NO_KEY=NO_KEY)
+
+@pytest.fixture
+def trace():
+    # warnings of the trace are recorded during the test
+    level = TRACE.level
+    TRACE.set_level('warning')
+    TRACE.entries.clear()
+    yield TRACE
+    TRACE.set_level(level)
+    TRACE.entries.clear()
@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+
+import commons
+from commons import ErrorReporter
+
+class FakeRoot():
+    # Tk root whose after() callbacks are run by the test, as the Tk thread would
+    def __init__(self):
+        self.callbacks = []
+
+    def after(self, ms: int, callback):
+        self.callbacks.append(callback)
+
+    def run_pending(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+@pytest.fixture
+def reporter(tmp_path, monkeypatch):
+    monkeypatch.setattr(ErrorReporter, 'LOG_PATH', str(tmp_path / 'logs.txt'))
+    reporter = ErrorReporter()
+    yield reporter
+    reporter.close()
+
+@pytest.fixture
+def shown(monkeypatch):
+    shown = []
+    monkeypatch.setattr(commons.Messagebox, 'show_error', lambda msg, title: shown.append(msg))
+    return shown
+
+def fail():
+    raise ValueError('bad value')
+
+def report_errors(reporter, count: int):
+    for _ in range(count):
+        try:
+            fail()
+        except ValueError as ex:
+            reporter.report(fail, ex)
+
+def test_call_site_is_reported_once_from_many_threads(reporter, shown):
+    threads = [threading.Thread(target=report_errors, args=(reporter, 500)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    (site_state,) = reporter.call_sites.values()
+    assert site_state[1] == 8 * 500 - 1
+    assert reporter.reports_in_interval == 1
+    assert shown == []  # no Tk root
+
+def test_dialog_is_shown_by_the_tk_thread(reporter, shown):
+    root = FakeRoot()
+    reporter.set_root(root)
+    thread = threading.Thread(target=report_errors, args=(reporter, 3))
+    thread.start()
+    thread.join()
+    assert shown == []
+    root.run_pending()
+    assert len(shown) == 1 and 'bad value' in shown[0]
+    assert root.callbacks == [reporter.show_dialogs]  # polling goes on
+
+def test_report_is_written_to_the_log(reporter, shown):
+    report_errors(reporter, 2)
+    reporter.close()
+    with open(ErrorReporter.LOG_PATH, encoding='utf-8') as f:
+        log = f.read()
+    assert log.count('Error in function fail.') == 1
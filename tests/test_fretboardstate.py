@@ -0,0 +1,138 @@
+import mido
+import pytest
+
+from fretboardstate import FretboardState
+
+STRING_1 = 1 << 1  # bit of string 1 in the changed strings mask
+
+def note_on(note: int, channel: int = 0, velocity: int = 90):
+    return mido.Message('note_on', channel=channel, note=note, velocity=velocity)
+
+def note_off(note: int, channel: int = 0):
+    return mido.Message('note_off', channel=channel, note=note)
+
+def pitchwheel(pitch: int, channel: int = 0):
+    return mido.Message('pitchwheel', channel=channel, pitch=pitch)
+
+@pytest.fixture
+def state(guitar, piano):
+    return FretboardState(guitar, piano)
+
+def played(state, string_number: int = 1) -> tuple:
+    string = state.strings[string_number]
+    return string.note, string.fret, string.interval, string.bend
+
+# hammer-on and pull-off
+
+def test_hammer_on_moves_the_note_one_fret_up(state):
+    state.update(note_on(65))
+    assert state.update(pitchwheel(FretboardState.ONE_STEP_PITCH[1])) == (STRING_1, (26, 25))
+    assert played(state) == (66, 2, 'b5', 0)
+    assert state.get_notes(state.held_notes) == [66]
+
+def test_pull_off_moves_the_note_one_fret_down(state):
+    state.update(note_on(67))
+    assert state.update(pitchwheel(FretboardState.ONE_STEP_PITCH[0])) == (STRING_1, (26, 27))
+    assert played(state) == (66, 2, 'b5', 0)
+    assert state.get_notes(state.held_notes) == [66]
+
+def test_pitch_zero_right_after_a_one_step_pitch_moves_the_note_back(state):
+    state.update(note_on(65))
+    state.update(pitchwheel(FretboardState.ONE_STEP_PITCH[1]))
+    state.update(pitchwheel(0))
+    assert played(state) == (65, 1, 'p4', 0)
+    state.update(pitchwheel(FretboardState.ONE_STEP_PITCH[0]))
+    state.update(pitchwheel(0))
+    assert played(state) == (65, 1, 'p4', 0)
+
+def test_pitch_zero_after_a_bend_only_releases_the_bend(state):
+    state.update(note_on(65))
+    state.update(pitchwheel(FretboardState.ONE_STEP_PITCH[1]))
+    state.update(pitchwheel(200))
+    state.update(pitchwheel(0))
+    assert played(state) == (66, 2, 'b5', 0)
+
+def test_one_step_pitch_on_an_open_string_is_a_bend(state):
+    state.update(note_on(64))
+    state.update(pitchwheel(FretboardState.ONE_STEP_PITCH[1]))
+    assert played(state) == (64, 0, 'd3', FretboardState.ONE_STEP_PITCH[1])
+
+def test_hammer_on_is_ignored_on_another_channel_message_in_between(state):
+    # the heuristic looks at the previous message of any string
+    state.update(note_on(65))
+    state.update(pitchwheel(FretboardState.ONE_STEP_PITCH[1]))
+    state.update(note_on(59, channel=1))
+    state.update(pitchwheel(0))
+    assert played(state) == (66, 2, 'b5', 0)
+
+# note_off tolerance
+
+@pytest.mark.parametrize('off_note', [64, 65, 66])
+def test_note_off_within_a_semitone_clears_the_string(state, off_note):
+    state.update(note_on(65))
+    assert state.update(note_off(off_note)) == (STRING_1, (25,))
+    assert played(state) == (None, None, None, 0)
+    assert state.held_notes == 0
+    assert state.piano_keys == set()
+
+def test_note_on_with_velocity_zero_clears_only_the_same_note(state):
+    state.update(note_on(65))
+    assert state.update(note_on(66, velocity=0)) == (0, ())
+    assert played(state) == (65, 1, 'p4', 0)
+    state.update(note_on(65, velocity=0))
+    assert played(state) == (None, None, None, 0)
+
+def test_note_off_of_no_held_note_keeps_the_string(state, trace):
+    state.update(note_on(65))
+    assert state.update(note_off(68)) == (0, ())
+    assert played(state) == (65, 1, 'p4', 0)
+    assert state.get_notes(state.held_notes) == [65]
+    assert any('[NOTE OFF WTF]' in line for line in trace.get_lines())
+
+def test_note_off_on_a_silent_string_is_traced(state, trace):
+    assert state.update(note_off(65)) == (0, ())
+    assert any('[NOTE OFF WTF]' in line for line in trace.get_lines())
+
+# notes out of the string range
+
+def test_note_below_the_string_is_shown_on_the_piano_only(state):
+    state.update(note_on(65))
+    # 50 is below the open string 1 (64), but on the piano
+    assert state.update(note_on(50)) == (0, (25, 10))
+    assert played(state) == (65, 1, 'p4', 0)
+    assert state.get_notes(state.held_notes) == [50]
+
+def test_note_out_of_the_string_and_the_piano_is_ignored(state):
+    assert state.update(note_on(30)) == FretboardState.NO_CHANGE
+    assert state.played == 0
+    assert state.held_notes == 0
+
+def test_ignored_note_does_not_reset_the_hammer_on_heuristic(state):
+    state.update(note_on(65))
+    state.update(pitchwheel(FretboardState.ONE_STEP_PITCH[1]))
+    state.update(note_on(30, channel=1))
+    state.update(pitchwheel(0))
+    assert played(state) == (65, 1, 'p4', 0)
+
+# bends
+
+@pytest.mark.parametrize('pitch, bend', [
+    (1000, 1000),
+    (FretboardState.MAX_PITCH_SHIFT, FretboardState.MAX_PITCH_SHIFT),
+    (8191, FretboardState.MAX_PITCH_SHIFT),
+    (-3000, 0),
+    (-8192, 0),
+])
+def test_bend_is_clamped(state, pitch, bend):
+    state.update(note_on(64))
+    state.update(pitchwheel(pitch))
+    assert state.strings[1].bend == bend
+
+def test_same_bend_is_no_change(state):
+    state.update(note_on(64))
+    assert state.update(pitchwheel(7000)) == (STRING_1, ())
+    assert state.update(pitchwheel(8000)) == (0, ())
+
+def test_pitchwheel_on_a_silent_string_is_no_change(state):
+    assert state.update(pitchwheel(1000)) == (0, ())
+    assert state.strings[1].bend == 0
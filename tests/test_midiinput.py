@@ -0,0 +1,72 @@
+import random
+
+import mido
+import pytest
+
+from fretboardstate import FretboardState
+from midiinput import PitchwheelCoalescer
+
+ONE_STEP_DOWN, ONE_STEP_UP = FretboardState.ONE_STEP_PITCH
+
+def note_on(note: int, channel: int = 0):
+    return mido.Message('note_on', channel=channel, note=note, velocity=90)
+
+def pitchwheel(pitch: int, channel: int = 0):
+    return mido.Message('pitchwheel', channel=channel, pitch=pitch)
+
+def get_state(state: FretboardState) -> tuple:
+    return tuple(string.snapshot() for string in state.strings[1:]), state.held_notes, tuple(state.bends)
+
+def play(guitar, piano, batches: list, coalesce: bool) -> tuple:
+    state = FretboardState(guitar, piano)
+    coalescer = PitchwheelCoalescer(FretboardState.ONE_STEP_PITCH, state.feeds_hammer_on)
+    states = []
+    for batch in batches:
+        for signal in coalescer.coalesce(batch) if coalesce else batch:
+            state.update(signal)
+        states.append(get_state(state))
+    return states, coalescer.folded
+
+@pytest.mark.parametrize('between', [
+    mido.Message('clock'),
+    note_on(60, channel=8),  # keyboard channel
+    pitchwheel(300, channel=8),
+    note_on(30, channel=1),  # out of the string and the piano, ignored
+], ids=['clock', 'keyboard note', 'keyboard pitchwheel', 'ignored note'])
+def test_messages_the_heuristic_does_not_see_keep_the_bend_before_a_pitch_zero(guitar, piano, between):
+    batch = [note_on(69), pitchwheel(ONE_STEP_DOWN), pitchwheel(500), between, pitchwheel(0)]
+    raw, _ = play(guitar, piano, [batch], coalesce=False)
+    coalesced, folded = play(guitar, piano, [batch], coalesce=True)
+    assert raw[-1][0][0] == (4, 'b6', 0)  # string 1 stays on the pulled-off note 68
+    assert coalesced == raw
+    assert folded == 0
+
+def test_bend_storm_is_folded(guitar, piano):
+    batch = [note_on(64)] + [pitchwheel(pitch) for pitch in range(100, 3000, 100)]
+    raw, _ = play(guitar, piano, [batch], coalesce=False)
+    coalesced, folded = play(guitar, piano, [batch], coalesce=True)
+    assert coalesced == raw
+    assert folded == len(batch) - 2
+
+def test_coalesced_batches_end_in_the_raw_state(guitar, piano):
+    rng = random.Random(5)
+    pitches = (0, 0, ONE_STEP_DOWN, ONE_STEP_UP, 300, 1500, 6000, -200)
+
+    def get_signal():
+        kind = rng.random()
+        channel = rng.choice((0, 0, 1, 2, 8))
+        if kind < 0.55:
+            return pitchwheel(rng.choice(pitches), channel)
+        if kind < 0.7:
+            return note_on(rng.choice((30, 50, 60, 64, 65, 67, 69)), channel)
+        if kind < 0.8:
+            return mido.Message('note_off', channel=channel, note=rng.choice((60, 64, 65, 67, 68, 69)))
+        if kind < 0.9:
+            return mido.Message('clock')
+        return mido.Message('aftertouch', channel=channel, value=rng.randrange(128))
+
+    batches = [[get_signal() for _ in range(rng.randrange(1, 12))] for _ in range(3000)]
+    raw, _ = play(guitar, piano, batches, coalesce=False)
+    coalesced, folded = play(guitar, piano, batches, coalesce=True)
+    assert coalesced == raw
+    assert folded > 0
@@ -0,0 +1,42 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from settings import Settings
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config')
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    # copy of config/ in a temporary project directory, settings and strings saved before the new keys
+    shutil.copytree(CONFIG_DIR, tmp_path / 'config')
+    monkeypatch.chdir(tmp_path)
+    with open('config/default_settings.json', encoding='utf-8') as f:
+        defaults = json.load(f)
+    old_settings = {key: value for key, value in defaults.items()
+                    if key not in ('tuning', 'frets_number', 'piano_range', 'midi_ports', 'target_fps',
+                                   'stream_state', 'stream_address')}
+    old_settings['interval_label_radius'] = 12
+    with open('config/settings.json', 'w', encoding='utf-8') as f:
+        json.dump(old_settings, f)
+    with open('config/default_strings.json', encoding='utf-8') as f:
+        strings = json.load(f)
+    for language in strings.values():
+        del language['stream_state']
+        language['update'] = 'Refresh'
+    with open('config/strings.json', 'w', encoding='utf-8') as f:
+        json.dump(strings, f)
+    return defaults
+
+def test_settings_saved_before_new_keys_get_the_defaults(config):
+    settings = Settings(app=None).settings
+    assert settings['interval_label_radius'] == 12
+    for key in ('tuning', 'frets_number', 'piano_range', 'midi_ports', 'target_fps', 'stream_state', 'stream_address'):
+        assert settings[key] == config[key]
+
+def test_strings_saved_before_new_keys_get_the_defaults(config):
+    strings = Settings(app=None).strings
+    assert strings['update'] == 'Refresh'
+    assert strings['stream_state'] == 'Stream the shown fretboard to viewers (UDP)'
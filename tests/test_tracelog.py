@@ -0,0 +1,22 @@
+import pytest
+
+from tracelog import TraceLog, create_trace
+
+@pytest.mark.parametrize('value, level', [('', None), ('off', None), ('INFO', 'info'), ('debug', 'debug')])
+def test_trace_level_is_read_from_the_environment(value, level):
+    trace = create_trace({TraceLog.ENV_VAR: value})
+    assert trace.level == level
+    assert list(trace.entries) == []
+
+def test_unknown_level_records_warnings_and_says_why():
+    trace = create_trace({TraceLog.ENV_VAR: 'loud'})
+    assert trace.level == 'warning'
+    (line,) = trace.get_lines()
+    assert f'Unknown {TraceLog.ENV_VAR}=loud' in line
+
+def test_disabled_level_is_not_recorded():
+    trace = TraceLog('warning')
+    trace.info('frame %d', 1)
+    trace.warning('late frame %d', 2)
+    (line,) = trace.get_lines()
+    assert line.endswith('WARNING late frame 2')
@@ -0,0 +1,66 @@
+import threading
+import multiprocessing
+
+import mido
+import pytest
+
+import commons
+from fretboardstate import FretboardState
+from midiinput import MidiReader, MidiSource, PitchwheelCoalescer
+from sharedstate import SharedNoteState
+from visualprocess import VisualizerProcess, READY, OPENED, BATCH
+
+BAD_NOTE = 66
+
+class SilentSource(MidiSource):
+    # messages are given to the MidiReader by the test
+    def open(self, callback):
+        return self
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def reported(monkeypatch):
+    reported = []
+    monkeypatch.setattr(commons.ERROR_REPORTER, 'report', lambda fun, ex, **kwargs: reported.append(ex))
+    return reported
+
+@pytest.fixture
+def process(guitar, piano):
+    # the app side of VisualizerProcess without the child process, the test plays the visualizer on the pipe
+    process = VisualizerProcess(guitar, piano, SilentSource(), params={})
+    process.note_state = FretboardState(guitar, piano)
+    process.pitchwheel_coalescer = PitchwheelCoalescer(FretboardState.ONE_STEP_PITCH, process.note_state.feeds_hammer_on)
+    process.midi_reader = MidiReader(wake=process.wake.set)
+    process.shared = SharedNoteState(guitar.STRING_NUMBER, guitar.INTERVAL_NAMES)
+    process.connection, child_connection = multiprocessing.Pipe()
+    process.publisher = threading.Thread(target=process.publish, daemon=True)
+    process.publisher.start()
+    yield process, child_connection
+    process.closed = True
+    process.wake.set()
+    process.publisher.join(timeout=2)
+    process.shared.close()
+    process.shared.unlink()
+
+def test_publisher_reports_a_failed_batch_and_goes_on(process, reported, monkeypatch):
+    process, connection = process
+    update = process.note_state.update
+
+    def failing_update(signal):
+        if signal.type == 'note_on' and signal.note == BAD_NOTE:
+            raise ValueError('bad note')
+        return update(signal)
+
+    monkeypatch.setattr(process.note_state, 'update', failing_update)
+    connection.send((READY, None))
+    assert connection.poll(2) and connection.recv() == (OPENED, None)
+    process.midi_reader.receive(mido.Message('note_on', note=BAD_NOTE, velocity=90))
+    assert connection.poll(0.5) is False
+    process.midi_reader.receive(mido.Message('note_on', note=67, velocity=90))
+    assert connection.poll(2)
+    kind, arrivals = connection.recv()
+    assert (kind, [signal_type for signal_type, _ in arrivals]) == (BATCH, ['note_on'])
+    assert [str(ex) for ex in reported] == ['bad note']
+    assert process.publisher.is_alive()